@@ -67,6 +67,13 @@ class Coordinate(BaseModel):
 class ReqPrdcerLyrMapData(BaseModel):
     prdcer_lyr_id: str
     user_id: str
+    # When given, only features inside bounding_box ([lat_min, lat_max,
+    # lng_min, lng_max]) or within radius meters of center are returned
+    bounding_box: Optional[list[float]] = None
+    center: Optional[Coordinate] = None
+    radius: Optional[float] = None
+    # Feature properties to keep, all of them when None
+    fields: Optional[list[str]] = None
 
 
 class ReqNearestRoute(ReqPrdcerLyrMapData):
@@ -82,6 +89,7 @@ class ReqFetchDataset(BaseModel):
     page_token: Optional[str] = ""
     search_type: Optional[str] = "default"
     text_search: Optional[str] = ""
+    sampling_mode: Optional[str] = ""  # "" or "grid"
     user_id: str
 
 
@@ -95,6 +103,10 @@ class ReqFetchCtlgLyrs(BaseModel):
     prdcer_ctlg_id: str
     as_layers: bool
     user_id: str
+    # Feature properties to keep, all of them when None
+    fields: Optional[list[str]] = None
+    # Decimal digits of compact fetch_ctlg_bundle coordinates, float64 when None
+    coordinate_precision: Optional[int] = None
 
 
 class ReqCostEstimate(BaseModel):
@@ -123,6 +135,7 @@ class ReqRealEstate(BaseModel):
     includedTypes: list[str]
     page_token: Optional[str] = ""
     text_search: Optional[str] = ""
+    sampling_mode: Optional[str] = ""
 
 
 class ReqCensus(BaseModel):
@@ -130,6 +143,12 @@ class ReqCensus(BaseModel):
     city_name: str
     includedTypes: List[str]
     page_token: Optional[str] = None
+    sampling_mode: Optional[str] = ""
+
+
+class ReqCensusAggregation(ReqCensus):
+    grid_type: Optional[str] = "hex"  # "hex" or "square"
+    cell_size_km: Optional[float] = 1.0
 
 
 class ReqCommercial(BaseModel):
@@ -137,6 +156,7 @@ class ReqCommercial(BaseModel):
     city_name: str
     includedTypes: List[str]
     page_token: Optional[str] = None
+    sampling_mode: Optional[str] = ""
     
 
 class ReqGeodata(BaseModel):
@@ -155,6 +175,12 @@ class ReqGradientColorBasedOnZone(BaseModel):
     color_based_on: str # ["rating" or "user_ratings_total"]
 
 
+class ReqDatasetClusters(BaseModel):
+    bknd_dataset_id: str
+    bounding_box: list[float]  # [lat_min, lat_max, lng_min, lng_max]
+    zoom: int
+
+
 class ReqStreeViewCheck(BaseModel):
     lat: float
     lng: float
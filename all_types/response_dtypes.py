@@ -1,8 +1,11 @@
+import random
 from typing import Dict, List, TypeVar, Generic, Literal, Any, Optional, Union
 
 from pydantic import BaseModel, Field
 
 T = TypeVar("T")
+# Features validated when a FeatureCollection is built from trusted data
+TRUSTED_SAMPLE_SIZE = 20
 
 
 class ResModel(BaseModel, Generic[T]):
@@ -44,7 +47,24 @@ class card_metadata(BaseModel):
     can_access: int
 
 
-class MapData(BaseModel):
+class TrustedFeatures(BaseModel):
+    """
+    Models holding features that were already validated when they were
+    stored. construct_trusted validates every other field but only a random
+    sample of the features; the rest are kept as plain dicts, so dump these
+    models with serialize_as_any=True.
+    """
+
+    @classmethod
+    def construct_trusted(cls, sample_size: int = TRUSTED_SAMPLE_SIZE, **data):
+        features = data.get("features") or []
+        sample = random.sample(features, min(sample_size, len(features)))
+        model = cls.model_validate({**data, "features": sample})
+        model.features = features
+        return model
+
+
+class MapData(TrustedFeatures):
     type: Literal["FeatureCollection"]
     features: List[Feature]
     properties:list[str]
@@ -58,7 +78,7 @@ class CityData(BaseModel):
     type: str = None
 
 
-class ResFetchDataset(BaseModel):
+class ResFetchDataset(TrustedFeatures):
     type: Literal["FeatureCollection"]
     features: List[Feature]
     bknd_dataset_id: str
@@ -67,6 +87,20 @@ class ResFetchDataset(BaseModel):
     next_page_token: Optional[str] = ""
 
 
+class ResDatasetClusters(TrustedFeatures):
+    type: Literal["FeatureCollection"]
+    # clusters (properties.cluster is true) and unclustered points
+    features: List[Feature]
+    zoom: int
+    records_count: int
+
+
+class ResCensusAggregation(MapData):
+    grid_type: str
+    cell_size_km: float
+    records_count: int
+
+
 class UserCatalogInfo(BaseModel):
     prdcer_ctlg_id: str
     prdcer_ctlg_name: str
@@ -94,6 +128,22 @@ class ResLyrMapData(MapData, LayerInfo):
     pass
 
 
+class CtlgBundleLayer(LayerInfo):
+    properties: list[str]
+    # base64 little-endian float64 [lng, lat, lng, lat, ...], or compact
+    # coordinates decoded as coordinate_encoding says
+    coordinates: str
+    coordinate_encoding: Optional[Dict[str, Any]] = None
+    # per feature [key_code, value_code, ...]; list values are coded element-wise
+    feature_properties: List[List[Union[int, List[int]]]]
+
+
+class ResCtlgBundle(BaseModel):
+    keys: List[str]
+    values: List[Any]
+    layers: List[CtlgBundleLayer]
+
+
 class TrafficCondition(BaseModel):
     start_index: int
     end_index: int
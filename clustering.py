@@ -0,0 +1,179 @@
+import math
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, List
+
+from dataset_stats import is_finite_number
+from vector_tiles import MAX_MERCATOR_LAT, LRUCache, lng_lat_to_world
+
+# Cluster radius in pixels of a CLUSTER_EXTENT-pixel tile, as in supercluster
+CLUSTER_RADIUS = 40
+CLUSTER_EXTENT = 512
+MIN_CLUSTER_ZOOM = 0
+# Points are never clustered above this zoom
+MAX_CLUSTER_ZOOM = 16
+MIN_CLUSTER_POINTS = 2
+CLUSTER_INDEX_CACHE_SIZE = 32
+
+
+def world_to_lng_lat(x: float, y: float) -> List[float]:
+    lng = (x - 0.5) * 360
+    lat = math.degrees(2 * math.atan(math.exp((0.5 - y) * 2 * math.pi)) - math.pi / 2)
+    return [lng, lat]
+
+
+class ClusterNode:
+    """A point or a cluster at one zoom level"""
+
+    __slots__ = ("x", "y", "count", "zoom", "node_id", "point_index", "aggregates")
+
+    def __init__(self, x, y, count, node_id, point_index=None, aggregates=None):
+        self.x = x
+        self.y = y
+        self.count = count
+        # Lowest zoom the node has been visited at while clustering
+        self.zoom = math.inf
+        self.node_id = node_id
+        # Index of the original feature, None for clusters
+        self.point_index = point_index
+        # property -> [sum, count, min, max] over numeric values
+        self.aggregates = aggregates or {}
+
+
+def point_aggregates(properties: Dict[str, Any]) -> Dict[str, List[float]]:
+    return {
+        key: [value, 1, value, value]
+        for key, value in properties.items()
+        if is_finite_number(value)
+    }
+
+
+def merge_aggregates(target: Dict[str, List[float]], source: Dict[str, List[float]]):
+    for key, (total, count, low, high) in source.items():
+        known = target.get(key)
+        if known is None:
+            target[key] = [total, count, low, high]
+        else:
+            known[0] += total
+            known[1] += count
+            known[2] = min(known[2], low)
+            known[3] = max(known[3], high)
+
+
+class ClusterLevel:
+    """Nodes of one zoom, sorted by x for range queries"""
+
+    def __init__(self, nodes: List[ClusterNode]):
+        self.nodes = sorted(nodes, key=lambda node: node.x)
+        self.xs = [node.x for node in self.nodes]
+
+    def within_box(self, min_x, min_y, max_x, max_y) -> List[ClusterNode]:
+        start = bisect_left(self.xs, min_x)
+        end = bisect_right(self.xs, max_x)
+        return [node for node in self.nodes[start:end] if min_y <= node.y <= max_y]
+
+    def within_radius(self, x, y, radius) -> List[ClusterNode]:
+        radius_squared = radius * radius
+        return [
+            node
+            for node in self.within_box(x - radius, y - radius, x + radius, y + radius)
+            if (node.x - x) ** 2 + (node.y - y) ** 2 <= radius_squared
+        ]
+
+
+class ClusterIndex:
+    """
+    Hierarchical greedy clustering of a dataset's points, in the style of
+    supercluster: every zoom from MAX_CLUSTER_ZOOM down to MIN_CLUSTER_ZOOM
+    merges the nodes of the zoom above that lie within CLUSTER_RADIUS pixels
+    of each other into clusters at their weighted center. Clusters carry
+    their point count and sum/count/min/max of numeric properties.
+    """
+
+    def __init__(self, features: List[Dict[str, Any]]):
+        self.features = features
+        nodes = []
+        for i, feature in enumerate(features):
+            coordinates = (feature.get("geometry") or {}).get("coordinates") or []
+            if len(coordinates) < 2:
+                continue
+            x, y = lng_lat_to_world(coordinates[0], coordinates[1])
+            aggregates = point_aggregates(feature.get("properties") or {})
+            nodes.append(ClusterNode(x, y, 1, i, point_index=i, aggregates=aggregates))
+
+        self.next_id = len(features)
+        self.levels: Dict[int, ClusterLevel] = {MAX_CLUSTER_ZOOM + 1: ClusterLevel(nodes)}
+        for zoom in range(MAX_CLUSTER_ZOOM, MIN_CLUSTER_ZOOM - 1, -1):
+            self.levels[zoom] = ClusterLevel(self._cluster(self.levels[zoom + 1], zoom))
+
+    def _cluster(self, level: ClusterLevel, zoom: int) -> List[ClusterNode]:
+        radius = CLUSTER_RADIUS / (CLUSTER_EXTENT * 2**zoom)
+        clustered = []
+        for node in level.nodes:
+            if node.zoom <= zoom:
+                continue
+            node.zoom = zoom
+            neighbors = [
+                neighbor
+                for neighbor in level.within_radius(node.x, node.y, radius)
+                if neighbor.zoom > zoom
+            ]
+            count = node.count + sum(neighbor.count for neighbor in neighbors)
+            if not neighbors or count < MIN_CLUSTER_POINTS:
+                clustered.append(node)
+                continue
+
+            weighted_x = node.x * node.count
+            weighted_y = node.y * node.count
+            aggregates: Dict[str, List[float]] = {}
+            merge_aggregates(aggregates, node.aggregates)
+            for neighbor in neighbors:
+                neighbor.zoom = zoom
+                weighted_x += neighbor.x * neighbor.count
+                weighted_y += neighbor.y * neighbor.count
+                merge_aggregates(aggregates, neighbor.aggregates)
+            clustered.append(
+                ClusterNode(
+                    weighted_x / count,
+                    weighted_y / count,
+                    count,
+                    self.next_id,
+                    aggregates=aggregates,
+                )
+            )
+            self.next_id += 1
+        return clustered
+
+    def get_clusters(self, bounding_box: List[float], zoom: int) -> List[Dict[str, Any]]:
+        """
+        GeoJSON features visible in bounding_box ([lat_min, lat_max, lng_min,
+        lng_max]) at zoom: clusters with their point_count and aggregated
+        properties, and unclustered points as the original features.
+        """
+        zoom = min(max(zoom, MIN_CLUSTER_ZOOM), MAX_CLUSTER_ZOOM + 1)
+        lat_min, lat_max, lng_min, lng_max = bounding_box
+        lat_min = max(lat_min, -MAX_MERCATOR_LAT)
+        lat_max = min(lat_max, MAX_MERCATOR_LAT)
+        min_x, max_y = lng_lat_to_world(max(lng_min, -180), lat_min)
+        max_x, min_y = lng_lat_to_world(min(lng_max, 180), lat_max)
+        nodes = self.levels[zoom].within_box(min_x, min_y, max_x, max_y)
+        return [self.node_feature(node) for node in nodes]
+
+    def node_feature(self, node: ClusterNode) -> Dict[str, Any]:
+        if node.point_index is not None:
+            return self.features[node.point_index]
+        return {
+            "type": "Feature",
+            "properties": {
+                "cluster": True,
+                "cluster_id": node.node_id,
+                "point_count": node.count,
+                "aggregates": {
+                    key: {"mean": total / count, "sum": total, "min": low, "max": high}
+                    for key, (total, count, low, high) in node.aggregates.items()
+                },
+            },
+            "geometry": {"type": "Point", "coordinates": world_to_lng_lat(node.x, node.y)},
+        }
+
+
+cluster_indexes = LRUCache(CLUSTER_INDEX_CACHE_SIZE)
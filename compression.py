@@ -0,0 +1,290 @@
+import hashlib
+import struct
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Smaller bodies are sent as they are
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSIBLE_CONTENT_TYPES = (
+    "application/json",
+    "application/geo+json",
+    "application/vnd.",
+    "text/",
+)
+# Response header an endpoint sets to have its compressed body cached; it is
+# removed before the response is sent
+CACHE_COMPRESSED_HEADER = b"x-cache-compressed"
+COMPRESSED_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Streamed bodies are sync flushed after about this much input, like the
+# STREAM_CHUNK_SIZE chunks of layer_encoding, not after every ASGI message
+STREAM_FLUSH_SIZE = 64 * 1024
+# (level for one-off bodies, level for bodies that go to the cache)
+COMPRESSION_LEVELS = {"br": (4, 9), "zstd": (3, 10), "gzip": (5, 9), "deflate-segment": (5, 9)}
+# gzip member header: deflate, no name, no timestamp, unknown OS
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+
+def available_encodings() -> List[str]:
+    """Supported encodings in order of preference"""
+    encodings = []
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    encodings.append("gzip")
+    return encodings
+
+
+def accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    """Encoding -> q value from an Accept-Encoding header"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, *parameters = [part.strip() for part in item.split(";")]
+        if not name:
+            continue
+        q = 1.0
+        for parameter in parameters:
+            key, _, value = parameter.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.lower()] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding: str, encodings: Optional[List[str]] = None) -> Optional[str]:
+    """The preferred supported encoding the client accepts, None if none"""
+    accepted = accepted_encodings(accept_encoding)
+    for encoding in encodings or available_encodings():
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def envelope_encodings() -> List[str]:
+    """Encodings compress_json_envelope can build from cached segments"""
+    return [encoding for encoding in available_encodings() if encoding != "br"]
+
+
+def compress(body: bytes, encoding: str, level: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    if encoding == "deflate-segment":
+        # Raw deflate ending byte-aligned and not final, so more segments can follow
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        return compressor.compress(body) + compressor.flush(zlib.Z_FULL_FLUSH)
+    # wbits 31 writes a gzip header without a timestamp
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+class CompressedBodyCache:
+    """
+    LRU of compressed bodies keyed by a hash of the uncompressed body and the
+    encoding, bounded by the total size of the compressed bodies.
+    """
+
+    def __init__(self, max_bytes: int = COMPRESSED_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._bodies: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def key(body: bytes, encoding: str) -> Tuple[bytes, str]:
+        return hashlib.blake2b(body, digest_size=16).digest(), encoding
+
+    def get_or_compress(self, body: bytes, encoding: str) -> bytes:
+        key = self.key(body, encoding)
+        compressed = self._bodies.get(key)
+        if compressed is not None:
+            self.hits += 1
+            self._bodies.move_to_end(key)
+            return compressed
+        self.misses += 1
+        compressed = compress(body, encoding, COMPRESSION_LEVELS[encoding][1])
+        if len(compressed) <= self.max_bytes:
+            self._bodies[key] = compressed
+            self.size += len(compressed)
+            while self.size > self.max_bytes:
+                _, evicted = self._bodies.popitem(last=False)
+                self.size -= len(evicted)
+        return compressed
+
+
+compressed_bodies = CompressedBodyCache()
+
+
+def compress_json_envelope(
+    prefix: bytes, data: bytes, suffix: bytes, encoding: str, cache: CompressedBodyCache = None
+) -> bytes:
+    """
+    Compresses prefix + data + suffix (a response envelope around its data)
+    with only data taken from the cache, since the envelope differs for every
+    request. gzip output is one member made of independently deflated
+    segments; zstd output is one frame per part.
+    """
+    cache = cache or compressed_bodies
+    level = COMPRESSION_LEVELS[encoding][0]
+    if encoding == "zstd":
+        return (
+            compress(prefix, "zstd", level)
+            + cache.get_or_compress(data, "zstd")
+            + compress(suffix, "zstd", level)
+        )
+    last = zlib.compressobj(level, zlib.DEFLATED, -15)
+    crc = zlib.crc32(suffix, zlib.crc32(data, zlib.crc32(prefix)))
+    size = len(prefix) + len(data) + len(suffix)
+    return (
+        GZIP_HEADER
+        + compress(prefix, "deflate-segment", level)
+        + cache.get_or_compress(data, "deflate-segment")
+        + last.compress(suffix)
+        + last.flush()
+        + struct.pack("<II", crc, size & 0xFFFFFFFF)
+    )
+
+
+def is_compressible(headers: List[Tuple[bytes, bytes]]) -> bool:
+    content_type = ""
+    for name, value in headers:
+        if name.lower() == b"content-encoding":
+            return False
+        if name.lower() == b"content-type":
+            content_type = value.decode("latin-1").lower()
+    return content_type.startswith(COMPRESSIBLE_CONTENT_TYPES)
+
+
+def replace_headers(
+    headers: List[Tuple[bytes, bytes]], drop: Tuple[bytes, ...], add: List[Tuple[bytes, bytes]]
+) -> List[Tuple[bytes, bytes]]:
+    return [(name, value) for name, value in headers if name.lower() not in drop] + add
+
+
+def encoded_headers(
+    headers: List[Tuple[bytes, bytes]], encoding: str, content_length: Optional[int]
+) -> List[Tuple[bytes, bytes]]:
+    """Headers of a response compressed with encoding, Vary kept and extended"""
+    vary = [value for name, value in headers if name.lower() == b"vary"]
+    vary.append(b"Accept-Encoding")
+    added = [(b"content-encoding", encoding.encode()), (b"vary", b", ".join(vary))]
+    if content_length is not None:
+        added.append((b"content-length", str(content_length).encode()))
+    return replace_headers(headers, (b"content-length", b"vary"), added)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses with br, zstd or gzip as
+    negotiated on Accept-Encoding. Complete bodies of at least minimum_size
+    bytes are compressed in one go, and taken from compressed_bodies when
+    the endpoint set CACHE_COMPRESSED_HEADER. Streamed bodies are gzipped
+    as they go, flushed every STREAM_FLUSH_SIZE bytes so they keep streaming.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, cache: CompressedBodyCache = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache = cache or compressed_bodies
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = ""
+        for name, value in scope.get("headers", []):
+            if name.lower() == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        responder = CompressionResponder(send, accept_encoding, self.minimum_size, self.cache)
+        await self.app(scope, receive, responder.send)
+
+
+class CompressionResponder:
+    def __init__(self, send, accept_encoding: str, minimum_size: int, cache: CompressedBodyCache):
+        self._send = send
+        self.encoding = choose_encoding(accept_encoding)
+        self.stream_encoding = choose_encoding(accept_encoding, ["gzip"])
+        self.minimum_size = minimum_size
+        self.cache = cache
+        self.start_message = None
+        self.cache_body = False
+        self.mode = None
+        self.compressor = None
+        self.unflushed = 0
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            headers = list(message.get("headers", []))
+            self.cache_body = any(name.lower() == CACHE_COMPRESSED_HEADER for name, _ in headers)
+            headers = replace_headers(headers, (CACHE_COMPRESSED_HEADER,), [])
+            self.start_message = {**message, "headers": headers}
+            if self.encoding is None or message["status"] in (204, 304) or not is_compressible(headers):
+                self.mode = "identity"
+                await self._send(self.start_message)
+            return
+
+        if message["type"] != "http.response.body" or self.mode == "identity":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.mode is None:
+            if not more_body:
+                await self._send_whole(body)
+                return
+            if self.stream_encoding is None:
+                self.mode = "identity"
+                await self._send(self.start_message)
+                await self._send(message)
+                return
+            self.mode = "stream"
+            self.compressor = zlib.compressobj(COMPRESSION_LEVELS["gzip"][0], zlib.DEFLATED, 31)
+            await self._send(
+                {
+                    **self.start_message,
+                    "headers": encoded_headers(self.start_message["headers"], "gzip", None),
+                }
+            )
+
+        chunk = self.compressor.compress(body)
+        self.unflushed += len(body)
+        if not more_body:
+            chunk += self.compressor.flush()
+        elif self.unflushed >= STREAM_FLUSH_SIZE:
+            # Sync flush so clients can decode what they have received so far
+            chunk += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.unflushed = 0
+        if chunk or not more_body:
+            await self._send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+    async def _send_whole(self, body: bytes):
+        self.mode = "identity"
+        headers = self.start_message["headers"]
+        if len(body) < self.minimum_size:
+            await self._send(self.start_message)
+            await self._send({"type": "http.response.body", "body": body})
+            return
+        if self.cache_body:
+            compressed = self.cache.get_or_compress(body, self.encoding)
+        else:
+            compressed = compress(body, self.encoding, COMPRESSION_LEVELS[self.encoding][0])
+        headers = encoded_headers(headers, self.encoding, len(compressed))
+        await self._send({**self.start_message, "headers": headers})
+        await self._send({"type": "http.response.body", "body": compressed})
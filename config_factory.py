@@ -25,13 +25,20 @@ class ApiConfig(CommonApiConfig):
     old_nearby_categories: str = backend_base_uri + "old_nearby_categories"
     fetch_dataset_full_data: str = backend_base_uri + "fetch_dataset/full_data"
     fetch_dataset: str = backend_base_uri + "fetch_dataset"
+    fetch_dataset_stream: str = backend_base_uri + "fetch_dataset/stream"
+    census_aggregation: str = backend_base_uri + "census_aggregation"
     save_layer: str = backend_base_uri + "save_layer"
     user_layers: str = backend_base_uri + "user_layers"
     prdcer_lyr_map_data: str = backend_base_uri + "prdcer_lyr_map_data"
+    prdcer_lyr_map_data_stream: str = backend_base_uri + "prdcer_lyr_map_data/stream"
     nearest_lyr_map_data: str = backend_base_uri + "nearest_lyr_map_data"
     save_producer_catalog: str = backend_base_uri + "save_producer_catalog"
     user_catalogs: str = backend_base_uri + "user_catalogs"
     fetch_ctlg_lyrs: str = backend_base_uri + "fetch_ctlg_lyrs"
+    fetch_ctlg_lyrs_stream: str = backend_base_uri + "fetch_ctlg_lyrs/stream"
+    fetch_ctlg_bundle: str = backend_base_uri + "fetch_ctlg_bundle"
+    dataset_tile: str = backend_base_uri + "tiles/{dataset_id}/{z}/{x}/{y}"
+    dataset_clusters: str = backend_base_uri + "dataset_clusters"
     apply_zone_layers: str = backend_base_uri + "apply_zone_layers"
     cost_calculator: str = backend_base_uri + "cost_calculator"
     check_street_view: str = backend_base_uri + "check_street_view"
@@ -41,6 +48,7 @@ class ApiConfig(CommonApiConfig):
     save_draft_catalog: str = backend_base_uri + "save_draft_catalog"
     fetch_gradient_colors :str = backend_base_uri + "fetch_gradient_colors"
     gradient_color_based_on_zone :str = backend_base_uri + "gradient_color_based_on_zone"
+    write_queue_metrics :str = backend_base_uri + "write_queue_metrics"
 
     gcloud_slocator_bucket_name:str = "s-locator"
     gcloud_images_bucket_path:str = "postgreSQL/dbo_operational/raw_schema_marketplace/catalog_thumbnails"
@@ -1,7 +1,8 @@
+import asyncio
 import logging
 import math
 import uuid
-from typing import List, Dict, Any, Union, Tuple
+from typing import AsyncIterator, List, Dict, Any, Union, Tuple
 import json
 import orjson
 from geopy.distance import geodesic
@@ -10,13 +11,14 @@ import numpy as np
 from fastapi import HTTPException
 from fastapi import status
 import requests
-from backend_common.auth import load_user_profile, update_user_profile
 from backend_common.utils.utils import convert_strings_to_ints
 from backend_common.gbucket import upload_file_to_google_cloud_bucket
 from config_factory import CONF
 from all_types.myapi_dtypes import *
 from all_types.response_dtypes import (
     ResGradientColorBasedOnZone,
+    ResDatasetClusters,
+    ResFetchDataset,
     ResLyrMapData,
     LayerInfo,
     UserCatalogInfo,
@@ -33,6 +35,15 @@ from backend_common.logging_wrapper import (
 )
 from backend_common.logging_wrapper import log_and_validate
 from mapbox_connector import MapBoxConnector
+from vector_tiles import is_valid_tile
+from etags import content_etag, etag_matches
+from layer_encoding import (
+    MAX_COORDINATE_PRECISION,
+    encode_catalog_bundle,
+    encode_layers_binary,
+    stream_feature_collection,
+    stream_json_array,
+)
 from storage import generate_layer_id
 from storage import (
     store_data_resp,
@@ -40,14 +51,25 @@ from storage import (
     load_census_categories,
     get_real_estate_dataset_from_storage,
     get_census_dataset_from_storage,
+    get_census_aggregation_from_storage,
     get_commercial_properties_dataset_from_storage,
     fetch_dataset_id,
+    fetch_dataset_ids,
     load_dataset,
+    load_datasets,
+    stream_dataset_features,
+    load_dataset_tile_index,
+    load_dataset_cluster_index,
+    load_dataset_features_in_area,
+    load_dataset_manifest,
+    load_dataset_manifests,
+    load_dataset_etags,
+    fetch_dataset_records_count,
     fetch_layer_owner,
     update_dataset_layer_matching,
     update_user_layer_matching,
     fetch_user_catalogs,
-    load_user_layer_matching,
+    fetch_layer_owner_id,
     fetch_user_layers,
     load_store_catalogs,
     convert_to_serializable,
@@ -56,6 +78,15 @@ from storage import (
     create_real_estate_plan,
     load_gradient_colors,
     make_dataset_filename,
+    get_write_queue_metrics,
+    load_user_profile,
+    patch_user_profile,
+    save_prdcer_layer_relations,
+    save_prdcer_catalog_relations,
+    load_normalized_user_layers,
+    load_normalized_layers,
+    load_normalized_user_catalogs,
+    load_normalized_catalog,
 )
 from storage import (
     load_google_categories,
@@ -304,7 +335,7 @@ async def fetch_census_realestate(
         )
 
     temp_req = to_location_req(req_dataset)
-    bknd_dataset_id = make_dataset_filename(temp_req)
+    bknd_dataset_id = make_dataset_filename(temp_req, req_dataset.sampling_mode)
     dataset = await load_dataset(bknd_dataset_id)
 
     if not dataset:
@@ -693,7 +724,7 @@ def prepare_response(dataset, bknd_dataset_id, next_page_token):
     }
 
 
-async def fetch_country_city_category_map_data(req: ReqFetchDataset):
+async def fetch_country_city_category_map_data(req: ReqFetchDataset) -> ResFetchDataset:
     """
     This function attempts to fetch an existing layer based on the provided
     request parameters. If the layer exists, it loads the data, transforms it,
@@ -718,6 +749,7 @@ async def fetch_country_city_category_map_data(req: ReqFetchDataset):
             includedTypes=req.includedTypes,
             page_token=req.page_token,
             text_search=req.text_search,
+            sampling_mode=req.sampling_mode,
         )
         geojson_dataset, bknd_dataset_id, next_page_token, plan_name = (
             await fetch_census_realestate(req_dataset, req_create_lyr=req)
@@ -728,6 +760,7 @@ async def fetch_country_city_category_map_data(req: ReqFetchDataset):
             city_name=req.dataset_city,
             includedTypes=req.includedTypes,
             page_token=req.page_token,
+            sampling_mode=req.sampling_mode,
         )
         geojson_dataset, bknd_dataset_id, next_page_token, plan_name = (
             await fetch_census_realestate(req_dataset, req_create_lyr=req)
@@ -738,6 +771,7 @@ async def fetch_country_city_category_map_data(req: ReqFetchDataset):
             city_name=req.dataset_city,
             includedTypes=req.includedTypes,
             page_token=req.page_token,
+            sampling_mode=req.sampling_mode,
         )
         geojson_dataset, bknd_dataset_id, next_page_token, plan_name = (
             await fetch_census_realestate(req_dataset, req_create_lyr=req)
@@ -768,32 +802,67 @@ async def fetch_country_city_category_map_data(req: ReqFetchDataset):
     # the name of the dataset will be the action + cct_layer name
     # make_ggl_layer_filename
     if req.action == "full data":
-        user_data = await load_user_profile(req.user_id)
-        user_data["prdcer"]["prdcer_dataset"][
-            plan_name.replace("plan_", "")
-        ] = plan_name
-        await update_user_profile(req.user_id, user_data)
+        await patch_user_profile(
+            req.user_id, "prdcer_dataset", plan_name.replace("plan_", ""), plan_name
+        )
 
     geojson_dataset["bknd_dataset_id"] = bknd_dataset_id
     geojson_dataset["records_count"] = len(geojson_dataset["features"])
     geojson_dataset["prdcer_lyr_id"] = generate_layer_id()
     geojson_dataset["next_page_token"] = next_page_token
-    return geojson_dataset
+    # Features come from our own store or from MapBoxConnector, both validated
+    return ResFetchDataset.construct_trusted(**geojson_dataset)
 
 
-async def save_lyr(req: ReqSavePrdcerLyer) -> str:
-    user_data = await load_user_profile(req.user_id)
+async def stream_dataset(req: ReqFetchDataset) -> AsyncIterator[bytes]:
+    """
+    Streaming version of fetch_country_city_category_map_data. The dataset
+    is still fetched as a whole, only its serialization is streamed.
+    """
+    dataset = await fetch_country_city_category_map_data(req)
+    features = dataset.features
+    envelope = dataset.model_dump(exclude={"features"})
+
+    async def encoded_features():
+        for feature in features:
+            yield orjson.dumps(feature)
+
+    return stream_feature_collection(envelope, encoded_features())
+
 
+async def fetch_census_aggregation(req: ReqCensusAggregation) -> Dict[str, Any]:
+    """
+    Returns the census rows of a city binned into a hex or square grid, one
+    feature per cell with per-cell sums and means of the numeric columns.
+    """
+    request_location = to_location_req(req)
+    aggregated = await get_census_aggregation_from_storage(req, request_location)
+    aggregated["grid_type"] = req.grid_type
+    aggregated["cell_size_km"] = req.cell_size_km
+    aggregated["records_count"] = len(aggregated["features"])
+    return aggregated
+
+
+async def save_lyr(req: ReqSavePrdcerLyer) -> str:
     try:
-        # Add the new layer to user profile
-        user_data["prdcer"]["prdcer_lyrs"][req.prdcer_lyr_id] = req.model_dump(
-            exclude={"user_id"}
+        # Add the new layer to user profile, writing only that entry
+        await patch_user_profile(
+            req.user_id,
+            "prdcer_lyrs",
+            req.prdcer_lyr_id,
+            req.model_dump(exclude={"user_id"}),
+        )
+        records_count = await fetch_dataset_records_count(req.bknd_dataset_id)
+        await update_dataset_layer_matching(
+            req.prdcer_lyr_id, req.bknd_dataset_id, records_count
         )
-
-        # Save updated user data
-        await update_user_profile(req.user_id, user_data)
-        await update_dataset_layer_matching(req.prdcer_lyr_id, req.bknd_dataset_id)
         await update_user_layer_matching(req.prdcer_lyr_id, req.user_id)
+        await save_prdcer_layer_relations(
+            req.user_id,
+            req.prdcer_lyr_id,
+            req.model_dump(exclude={"user_id"}),
+            records_count,
+        )
     except KeyError as ke:
         logger.error(f"Invalid user data structure for user_id: {req.user_id}")
         raise HTTPException(
@@ -813,12 +882,25 @@ async def aquire_user_lyrs(req: ReqUserId) -> List[LayerInfo]:
     all layers owned by the user, including metadata like layer name, color,
     and record count.
     """
-    user_layers = await fetch_user_layers(req.user_id)
+    # Layers not migrated to the prdcer_layers table yet are only in the
+    # profile, so both are merged, the table winning for migrated layers
+    (table_layers, layers_dataset_ids), profile_layers = await asyncio.gather(
+        load_normalized_user_layers(req.user_id), fetch_user_layers(req.user_id)
+    )
+    user_layers = {**profile_layers, **table_layers}
+    unmigrated_ids = [lyr_id for lyr_id in user_layers if lyr_id not in layers_dataset_ids]
+    if unmigrated_ids:
+        layers_dataset_ids.update(await fetch_dataset_ids(unmigrated_ids))
 
     user_layers_metadata = []
     for lyr_id, lyr_data in user_layers.items():
         try:
-            dataset_id, dataset_info = await fetch_dataset_id(lyr_id)
+            if lyr_id not in layers_dataset_ids:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Dataset not found for this layer",
+                )
+            dataset_id, dataset_info = layers_dataset_ids[lyr_id]
             records_count = dataset_info["records_count"]
 
             user_layers_metadata.append(
@@ -847,38 +929,63 @@ async def aquire_user_lyrs(req: ReqUserId) -> List[LayerInfo]:
     return user_layers_metadata
 
 
-async def fetch_lyr_map_data(req: ReqPrdcerLyrMapData) -> ResLyrMapData:
+async def resolve_lyr_map_data(req: ReqPrdcerLyrMapData) -> Tuple[Dict, str, Dict]:
     """
-    Fetches detailed map data for a specific producer layer.
+    Finds a producer layer's metadata and (dataset_id, dataset_info), without
+    loading the dataset.
     """
-    try:
-        dataset = {}
-        user_layer_matching = await load_user_layer_matching()
-        layer_owner_id = user_layer_matching.get(req.prdcer_lyr_id)
-        layer_owner_data = await load_user_profile(layer_owner_id)
+    layer_owner_id = await fetch_layer_owner_id(req.prdcer_lyr_id)
+    layer_owner_data = await load_user_profile(layer_owner_id)
+    layer_metadata = (
+        layer_owner_data.get("prdcer", {}).get("prdcer_lyrs", {}).get(req.prdcer_lyr_id)
+    )
+    if layer_metadata is None:
+        raise HTTPException(
+            status_code=404, detail="Producer layer not found for this user"
+        )
+    dataset_id, dataset_info = await fetch_dataset_id(req.prdcer_lyr_id)
+    return layer_metadata, dataset_id, dataset_info
 
-        try:
-            layer_metadata = layer_owner_data["prdcer"]["prdcer_lyrs"][
-                req.prdcer_lyr_id
-            ]
-        except KeyError as ke:
-            raise HTTPException(
-                status_code=404, detail="Producer layer not found for this user"
-            ) from ke
 
-        dataset_id, dataset_info = await fetch_dataset_id(req.prdcer_lyr_id)
-        dataset = await load_dataset(dataset_id)
+async def fetch_lyr_map_data(
+    req: ReqPrdcerLyrMapData, resolved: Optional[Tuple[Dict, str, Dict]] = None
+) -> ResLyrMapData:
+    """
+    Fetches detailed map data for a specific producer layer. resolved is the
+    result of resolve_lyr_map_data when the caller already has it.
+    """
+    try:
+        dataset = {}
+        if resolved is None:
+            resolved = await resolve_lyr_map_data(req)
+        layer_metadata, dataset_id, dataset_info = resolved
+        area = lyr_map_data_area(req)
+        if area is None:
+            dataset, manifest = await asyncio.gather(
+                load_dataset(dataset_id, req.fields), load_dataset_manifest(dataset_id)
+            )
+            if not dataset:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND, detail="Dataset not found"
+                )
+            features = dataset["features"]
+            records_count = manifest.get("records_count", dataset_info["records_count"])
+        else:
+            features, manifest = await asyncio.gather(
+                load_dataset_features_in_area(dataset_id, fields=req.fields, **area),
+                load_dataset_manifest(dataset_id),
+            )
+            dataset = {"features": features}
+            records_count = len(features)
 
-        # Extract properties from first feature if available
-        properties = []
-        if dataset.get("features") and len(dataset["features"]) > 0:
-            first_feature = dataset["features"][0]
-            properties = list(first_feature.get("properties", {}).keys())
+        properties = project_properties(
+            extract_dataset_properties(dataset, manifest), req.fields
+        )
 
-        return ResLyrMapData(
+        return ResLyrMapData.construct_trusted(
             type="FeatureCollection",
-            features=dataset["features"],
-            properties=properties,  # Add the properties list here
+            features=features,
+            properties=properties,
             prdcer_layer_name=layer_metadata["prdcer_layer_name"],
             prdcer_lyr_id=req.prdcer_lyr_id,
             bknd_dataset_id=dataset_id,
@@ -886,13 +993,145 @@ async def fetch_lyr_map_data(req: ReqPrdcerLyrMapData) -> ResLyrMapData:
             layer_legend=layer_metadata["layer_legend"],
             layer_description=layer_metadata["layer_description"],
             city_name=layer_metadata["city_name"],
-            records_count=dataset_info["records_count"],
+            records_count=records_count,
             is_zone_lyr="false",
         )
     except HTTPException:
         raise
 
 
+async def fetch_lyr_map_data_etag(
+    req: ReqPrdcerLyrMapData,
+    representation: Optional[str] = None,
+    resolved: Optional[Tuple[Dict, str, Dict]] = None,
+) -> Optional[str]:
+    """
+    ETag of the fetch_lyr_map_data response for req, from the stored etag of
+    the layer's dataset and the layer metadata, without loading the dataset.
+    None when the dataset has no stored row.
+    """
+    if resolved is None:
+        resolved = await resolve_lyr_map_data(req)
+    layer_metadata, dataset_id, _ = resolved
+    dataset_etag = (await load_dataset_etags([dataset_id])).get(dataset_id)
+    if dataset_etag is None:
+        return None
+    return content_etag(
+        dataset_etag, layer_metadata, req.model_dump(mode="json"), representation
+    )
+
+
+async def fetch_lyr_map_data_if_modified(
+    req: ReqPrdcerLyrMapData,
+    if_none_match: Optional[str] = None,
+    representation: Optional[str] = None,
+) -> Tuple[Optional[str], Optional[ResLyrMapData]]:
+    """
+    (etag, layer) of a conditional fetch_lyr_map_data. The layer is looked
+    up once for both; when if_none_match matches the etag the dataset is
+    not loaded and layer is None.
+    """
+    resolved = await resolve_lyr_map_data(req)
+    etag = await fetch_lyr_map_data_etag(req, representation, resolved)
+    if etag_matches(if_none_match, etag):
+        return etag, None
+    return etag, await fetch_lyr_map_data(req, resolved)
+
+
+def make_lyr_envelope(
+    lyr_id: str,
+    lyr_metadata: Dict,
+    dataset_id: str,
+    dataset_info: Dict,
+    manifest: Dict,
+    fields: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Validated ResLyrMapData fields of a layer, everything but its features,
+    taken from the layer metadata and the dataset manifest.
+    """
+    envelope = ResLyrMapData.model_validate(
+        {
+            "type": "FeatureCollection",
+            "features": [],
+            "properties": project_properties(
+                extract_dataset_properties({}, manifest), fields
+            ),
+            "prdcer_layer_name": lyr_metadata.get("prdcer_layer_name", f"Layer {lyr_id}"),
+            "prdcer_lyr_id": lyr_id,
+            "bknd_dataset_id": dataset_id,
+            "points_color": lyr_metadata.get("points_color", "red"),
+            "layer_legend": lyr_metadata.get("layer_legend", ""),
+            "layer_description": lyr_metadata.get("layer_description", ""),
+            "records_count": manifest.get("records_count", dataset_info["records_count"]),
+            "city_name": lyr_metadata.get("city_name", ""),
+            "is_zone_lyr": "false",
+        }
+    )
+    return envelope.model_dump(exclude={"features"})
+
+
+async def stream_lyr_map_data(req: ReqPrdcerLyrMapData) -> AsyncIterator[bytes]:
+    """
+    Streaming version of fetch_lyr_map_data. Returns the layer as chunks of
+    JSON, to be wrapped in the response envelope. Lookups happen before the
+    first byte is sent, so missing layers still fail with a 404; the features
+    are then streamed from the database without loading the whole dataset.
+    """
+    layer_metadata, dataset_id, dataset_info = await resolve_lyr_map_data(req)
+    manifest = await load_dataset_manifest(dataset_id)
+    envelope = make_lyr_envelope(
+        req.prdcer_lyr_id, layer_metadata, dataset_id, dataset_info, manifest, req.fields
+    )
+    return stream_feature_collection(
+        envelope, stream_dataset_features(dataset_id, req.fields)
+    )
+
+
+def lyr_map_data_area(req: ReqPrdcerLyrMapData) -> Optional[Dict[str, Any]]:
+    """
+    Keyword arguments of load_dataset_features_in_area for the viewport of a
+    request, None when the whole layer is asked for.
+    """
+    if req.bounding_box is not None:
+        if len(req.bounding_box) != 4:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="bounding_box must be [lat_min, lat_max, lng_min, lng_max]",
+            )
+        return {"bounding_box": req.bounding_box}
+    if req.center is not None or req.radius is not None:
+        if req.center is None or not req.radius or req.radius <= 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="center and a positive radius are needed together",
+            )
+        return {
+            "center": (req.center.latitude, req.center.longitude),
+            "radius": req.radius,
+        }
+    return None
+
+
+def project_properties(properties: List[str], fields: Optional[List[str]]) -> List[str]:
+    """Property names left after a fields projection"""
+    if fields is None:
+        return properties
+    return [key for key in properties if key in fields]
+
+
+def extract_dataset_properties(dataset: Dict, manifest: Dict) -> List[str]:
+    """
+    Property names of a dataset, from its manifest when there is one and
+    otherwise from the first feature.
+    """
+    if "properties" in manifest:
+        return manifest["properties"]
+    if dataset.get("features"):
+        return list(dataset["features"][0].get("properties", {}).keys())
+    return []
+
+
 async def fetch_nearest_points_Gmap(
     req: ReqNearestRoute,
 ) -> List[NearestPointRouteResponse]:
@@ -1000,7 +1239,6 @@ async def save_prdcer_ctlg(req: ReqSavePrdcerCtlg) -> str:
     # add display elements key value pair display_elements:{"polygons":[]}
     # catalog should have "catlog_layer_options":{} extra configurations for the layers with their display options (point,grid:{"size":3, color:#FFFF45},heatmap:{"proeprty":rating})
     try:
-        user_data = await load_user_profile(req["user_id"])
         new_ctlg_id = str(uuid.uuid4())
 
         req["thumbnail_url"] = ""
@@ -1028,9 +1266,10 @@ async def save_prdcer_ctlg(req: ReqSavePrdcerCtlg) -> str:
             "display_elements": req["display_elements"],
             "catalog_layer_options": req["catalog_layer_options"],
         }
-        user_data["prdcer"]["prdcer_ctlgs"][new_ctlg_id] = new_catalog
-        # serializable_user_data = convert_to_serializable(user_data)
-        await update_user_profile(req["user_id"], user_data)
+        await patch_user_profile(
+            req["user_id"], "prdcer_ctlgs", new_ctlg_id, new_catalog
+        )
+        await save_prdcer_catalog_relations(req["user_id"], new_ctlg_id, new_catalog)
         return new_ctlg_id
     except Exception as e:
         raise e
@@ -1041,7 +1280,12 @@ async def fetch_prdcer_ctlgs(req: ReqUserId) -> List[UserCatalogInfo]:
     Retrieves all producer catalogs associated with a specific user.
     """
     try:
-        user_catalogs = await fetch_user_catalogs(req.user_id)
+        # Catalogs not migrated to the prdcer_catalogs table yet are only in
+        # the profile, so both are merged, the table winning for migrated ones
+        table_catalogs, profile_catalogs = await asyncio.gather(
+            load_normalized_user_catalogs(req.user_id), fetch_user_catalogs(req.user_id)
+        )
+        user_catalogs = {**profile_catalogs, **table_catalogs}
         validated_catalogs = []
 
         for ctlg_id, ctlg_data in user_catalogs.items():
@@ -1065,51 +1309,91 @@ async def fetch_prdcer_ctlgs(req: ReqUserId) -> List[UserCatalogInfo]:
         ) from e
 
 
-async def fetch_ctlg_lyrs(req: ReqFetchCtlgLyrs) -> List[ResLyrMapData]:
+async def resolve_ctlg_lyrs(
+    req: ReqFetchCtlgLyrs,
+) -> Tuple[List[str], Dict[str, Dict], Dict[str, Tuple[str, Dict]]]:
     """
-    Fetches all layers associated with a specific catalog.
+    Finds a catalog's layers in catalog order, with each layer's metadata and
+    (dataset_id, dataset_info), without loading any dataset.
     """
-    try:
+    ctlg = await load_normalized_catalog(req.prdcer_ctlg_id, req.user_id)
+    if not ctlg:
         user_data = await load_user_profile(req.user_id)
         ctlg = (
             user_data.get("prdcer", {})
             .get("prdcer_ctlgs", {})
             .get(req.prdcer_ctlg_id, {})
         )
-        if not ctlg:
-            store_ctlgs = load_store_catalogs()
-            ctlg = next(
-                (
-                    ctlg_info
-                    for ctlg_key, ctlg_info in store_ctlgs.items()
-                    if ctlg_key == req.prdcer_ctlg_id
-                ),
-                {},
-            )
-        if not ctlg:
-            raise HTTPException(status_code=404, detail="Catalog not found")
-
+    if not ctlg:
+        store_ctlgs = load_store_catalogs()
+        ctlg = next(
+            (
+                ctlg_info
+                for ctlg_key, ctlg_info in store_ctlgs.items()
+                if ctlg_key == req.prdcer_ctlg_id
+            ),
+            {},
+        )
+    if not ctlg:
+        raise HTTPException(status_code=404, detail="Catalog not found")
+
+    lyr_ids = [lyr_info["layer_id"] for lyr_info in ctlg["lyrs"]]
+    lyrs_metadata, lyrs_dataset_ids = await load_normalized_layers(lyr_ids)
+    # Layers missing from the tables come from the JSON layout
+    missing_dataset_ids = [lyr_id for lyr_id in lyr_ids if lyr_id not in lyrs_dataset_ids]
+    if missing_dataset_ids:
+        lyrs_dataset_ids.update(await fetch_dataset_ids(missing_dataset_ids))
+    missing_metadata = [lyr_id for lyr_id in lyr_ids if lyr_id not in lyrs_metadata]
+    if missing_metadata:
         ctlg_owner_data = await load_user_profile(ctlg["ctlg_owner_user_id"])
+        owner_layers = ctlg_owner_data.get("prdcer", {}).get("prdcer_lyrs", {})
+        for lyr_id in missing_metadata:
+            lyrs_metadata[lyr_id] = owner_layers.get(lyr_id, {})
+
+    if any(lyr_id not in lyrs_dataset_ids for lyr_id in lyr_ids):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Dataset not found for this layer",
+        )
+    return lyr_ids, lyrs_metadata, lyrs_dataset_ids
+
+
+async def fetch_ctlg_lyrs(
+    req: ReqFetchCtlgLyrs,
+    resolved: Optional[Tuple[List[str], Dict[str, Dict], Dict[str, Tuple[str, Dict]]]] = None,
+) -> List[ResLyrMapData]:
+    """
+    Fetches all layers associated with a specific catalog. resolved is the
+    result of resolve_ctlg_lyrs when the caller already has it.
+    """
+    try:
+        if resolved is None:
+            resolved = await resolve_ctlg_lyrs(req)
+        lyr_ids, lyrs_metadata, lyrs_dataset_ids = resolved
         ctlg_lyrs_map_data = []
+        dataset_ids = [lyrs_dataset_ids[lyr_id][0] for lyr_id in lyr_ids]
+        datasets, manifests = await asyncio.gather(
+            load_datasets(dataset_ids, req.fields), load_dataset_manifests(dataset_ids)
+        )
 
-        for lyr_info in ctlg["lyrs"]:
-            lyr_id = lyr_info["layer_id"]
-            dataset_id, dataset_info = await fetch_dataset_id(lyr_id)
-            trans_dataset = await load_dataset(dataset_id)
+        for lyr_id in lyr_ids:
+            dataset_id, dataset_info = lyrs_dataset_ids[lyr_id]
+            trans_dataset = datasets[dataset_id]
+            if not trans_dataset:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND, detail="Dataset not found"
+                )
             # trans_dataset = await MapBoxConnector.new_ggl_to_boxmap(trans_dataset)
 
-            # Extract properties from first feature if available
-            properties = []
-            if trans_dataset.get("features") and len(trans_dataset["features"]) > 0:
-                first_feature = trans_dataset["features"][0]
-                properties = list(first_feature.get("properties", {}).keys())
-
-            lyr_metadata = (
-                ctlg_owner_data.get("prdcer", {}).get("prdcer_lyrs", {}).get(lyr_id, {})
+            properties = project_properties(
+                extract_dataset_properties(trans_dataset, manifests[dataset_id]),
+                req.fields,
             )
 
+            lyr_metadata = lyrs_metadata[lyr_id]
+
             ctlg_lyrs_map_data.append(
-                ResLyrMapData(
+                ResLyrMapData.construct_trusted(
                     type="FeatureCollection",
                     features=trans_dataset["features"],
                     properties=properties,  # Add the properties list here
@@ -1122,7 +1406,7 @@ async def fetch_ctlg_lyrs(req: ReqFetchCtlgLyrs) -> List[ResLyrMapData]:
                     layer_legend=lyr_metadata.get("layer_legend", ""),
                     layer_description=lyr_metadata.get("layer_description", ""),
                     records_count=len(trans_dataset["features"]),
-                    city_name=lyr_metadata["city_name"],
+                    city_name=lyr_metadata.get("city_name", ""),
                     is_zone_lyr="false",
                 )
             )
@@ -1131,14 +1415,173 @@ async def fetch_ctlg_lyrs(req: ReqFetchCtlgLyrs) -> List[ResLyrMapData]:
         raise
 
 
+async def fetch_ctlg_lyrs_etag(
+    req: ReqFetchCtlgLyrs,
+    representation: Optional[str] = None,
+    resolved: Optional[Tuple[List[str], Dict[str, Dict], Dict[str, Tuple[str, Dict]]]] = None,
+) -> Optional[str]:
+    """
+    ETag of the fetch_ctlg_lyrs response for req, from the stored etags of
+    the catalog's datasets, without loading them. None when one of them has
+    no stored row.
+    """
+    if resolved is None:
+        resolved = await resolve_ctlg_lyrs(req)
+    lyr_ids, lyrs_metadata, lyrs_dataset_ids = resolved
+    dataset_ids = [lyrs_dataset_ids[lyr_id][0] for lyr_id in lyr_ids]
+    dataset_etags = await load_dataset_etags(dataset_ids)
+    if any(dataset_id not in dataset_etags for dataset_id in dataset_ids):
+        return None
+    return content_etag(
+        [dataset_etags[dataset_id] for dataset_id in dataset_ids],
+        [lyrs_metadata[lyr_id] for lyr_id in lyr_ids],
+        req.model_dump(mode="json"),
+        representation,
+    )
+
+
+async def fetch_ctlg_lyrs_if_modified(
+    req: ReqFetchCtlgLyrs,
+    if_none_match: Optional[str] = None,
+    representation: Optional[str] = None,
+) -> Tuple[Optional[str], Optional[List[ResLyrMapData]]]:
+    """
+    (etag, layers) of a conditional fetch_ctlg_lyrs. The catalog is resolved
+    once for both; when if_none_match matches the etag no dataset is loaded
+    and layers is None.
+    """
+    resolved = await resolve_ctlg_lyrs(req)
+    etag = await fetch_ctlg_lyrs_etag(req, representation, resolved)
+    if etag_matches(if_none_match, etag):
+        return etag, None
+    return etag, await fetch_ctlg_lyrs(req, resolved)
+
+
+async def fetch_ctlg_bundle(req: ReqFetchCtlgLyrs) -> Dict[str, Any]:
+    """
+    Same layers as fetch_ctlg_lyrs, encoded as one catalog bundle with shared
+    property dictionaries and packed coordinates, compact ones when the
+    request has a coordinate_precision.
+    """
+    if req.coordinate_precision is not None and not (
+        0 <= req.coordinate_precision <= MAX_COORDINATE_PRECISION
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"coordinate_precision must be between 0 and {MAX_COORDINATE_PRECISION}",
+        )
+    ctlg_lyrs = await fetch_ctlg_lyrs(req)
+    return encode_catalog_bundle(
+        [lyr.model_dump(serialize_as_any=True) for lyr in ctlg_lyrs],
+        req.coordinate_precision,
+    )
+
+
+async def stream_ctlg_lyrs(req: ReqFetchCtlgLyrs) -> AsyncIterator[bytes]:
+    """
+    Streaming version of fetch_ctlg_lyrs: a JSON array of layers whose
+    features are streamed one dataset at a time.
+    """
+    lyr_ids, lyrs_metadata, lyrs_dataset_ids = await resolve_ctlg_lyrs(req)
+    manifests = await load_dataset_manifests(
+        [lyrs_dataset_ids[lyr_id][0] for lyr_id in lyr_ids]
+    )
+    envelopes = []
+    for lyr_id in lyr_ids:
+        dataset_id, dataset_info = lyrs_dataset_ids[lyr_id]
+        envelopes.append(
+            make_lyr_envelope(
+                lyr_id,
+                lyrs_metadata[lyr_id],
+                dataset_id,
+                dataset_info,
+                manifests[dataset_id],
+                req.fields,
+            )
+        )
+
+    async def layers():
+        for envelope in envelopes:
+            yield stream_feature_collection(
+                envelope,
+                stream_dataset_features(envelope["bknd_dataset_id"], req.fields),
+            )
+
+    return stream_json_array(layers())
+
+
+async def fetch_dataset_tile(dataset_id: str, z: int, x: int, y: int) -> bytes:
+    """
+    Cuts one Mapbox Vector Tile from a stored dataset. Below
+    FULL_DETAIL_ZOOM points are thinned; empty tiles are empty bytes.
+    """
+    if not is_valid_tile(z, x, y):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid tile coordinates"
+        )
+    index = await load_dataset_tile_index(dataset_id)
+    return index.tile(z, x, y)
+
+
+async def fetch_dataset_clusters(req: ReqDatasetClusters) -> ResDatasetClusters:
+    """
+    Clusters and unclustered points of a dataset inside a bounding box at a
+    zoom level, from the dataset's cached clustering index.
+    """
+    if len(req.bounding_box) != 4:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="bounding_box must be [lat_min, lat_max, lng_min, lng_max]",
+        )
+    index = await load_dataset_cluster_index(req.bknd_dataset_id)
+    features = index.get_clusters(req.bounding_box, req.zoom)
+    return ResDatasetClusters.construct_trusted(
+        type="FeatureCollection",
+        features=features,
+        zoom=req.zoom,
+        # Points represented, clusters count for all of theirs
+        records_count=sum(
+            feature["properties"]["point_count"]
+            if feature["properties"].get("cluster") is True
+            else 1
+            for feature in features
+        ),
+    )
+
+
+def fetch_layers_binary(
+    data: Union[ResLyrMapData, ResFetchDataset, List[ResLyrMapData]],
+    coordinate_type: str = "float64",
+) -> bytes:
+    """
+    Encodes the data of a layer response, one layer or a list of them, in the
+    columnar binary layer format (see layer_encoding.encode_layer_binary).
+    """
+    layers = data if isinstance(data, list) else [data]
+    return encode_layers_binary(
+        [
+            {
+                **layer.model_dump(exclude={"features"}),
+                "features": [
+                    feature if isinstance(feature, dict) else feature.model_dump()
+                    for feature in layer.features
+                ],
+            }
+            for layer in layers
+        ],
+        coordinate_type,
+    )
+
+
 def calculate_thresholds(values: List[float]) -> List[float]:
     """
     Calculates threshold values to divide a set of values into three categories.
     """
     try:
-        sorted_values = sorted(values)
-        n = len(sorted_values)
-        return [sorted_values[n // 3], sorted_values[2 * n // 3]]
+        n = len(values)
+        # Partial partition instead of a full sort; same order statistics
+        partitioned = np.partition(np.asarray(values), [n // 3, 2 * n // 3])
+        return [partitioned[n // 3].item(), partitioned[2 * n // 3].item()]
     except Exception as e:
         raise ValueError(f"Error in calculate_thresholds: {str(e)}")
 
@@ -1198,7 +1641,6 @@ async def fetch_nearby_categories() -> Dict:
 
 async def save_draft_catalog(req: ReqSavePrdcerLyer) -> str:
     try:
-        user_data = await load_user_profile(req.user_id)
         if len(req.lyrs) > 0:
 
             new_ctlg_id = str(uuid.uuid4())
@@ -1212,10 +1654,12 @@ async def save_draft_catalog(req: ReqSavePrdcerLyer) -> str:
                 "thumbnail_url": req.thumbnail_url,
                 "ctlg_owner_user_id": req.user_id,
             }
-            user_data["prdcer"]["draft_ctlgs"][new_ctlg_id] = new_catalog
-
-            serializable_user_data = convert_to_serializable(user_data)
-            await update_user_profile(req.user_id, serializable_user_data)
+            await patch_user_profile(
+                req.user_id, "draft_ctlgs", new_ctlg_id, new_catalog
+            )
+            await save_prdcer_catalog_relations(
+                req.user_id, new_ctlg_id, new_catalog, is_draft=True
+            )
 
             return new_ctlg_id
         else:
@@ -1237,10 +1681,35 @@ async def fetch_gradient_colors() -> List[List]:
     return data
 
 
+# ETags of lookup data that only changes with a deploy, by endpoint
+static_etags: Dict[str, str] = {}
+
+
+async def fetch_static_etag(name: str) -> str:
+    """
+    ETag of the country_city, nearby_categories or gradient_colors data,
+    computed once per process.
+    """
+    etag = static_etags.get(name)
+    if etag is None:
+        fetchers = {
+            "country_city": fetch_country_city_data,
+            "nearby_categories": fetch_nearby_categories,
+            "gradient_colors": fetch_gradient_colors,
+        }
+        etag = content_etag(await fetchers[name]())
+        static_etags[name] = etag
+    return etag
+
+
+async def fetch_write_queue_metrics() -> Dict[str, Any]:
+    """Queue depth and flush latency of the Firestore write-behind queue"""
+    return get_write_queue_metrics()
+
+
 async def given_layer_fetch_dataset(layer_id: str):
     # given layer id get dataset
-    user_layer_matching = await load_user_layer_matching()
-    layer_owner_id = user_layer_matching.get(layer_id)
+    layer_owner_id = await fetch_layer_owner_id(layer_id)
     layer_owner_data = await load_user_profile(layer_owner_id)
     try:
         layer_metadata = layer_owner_data["prdcer"]["prdcer_lyrs"][layer_id]
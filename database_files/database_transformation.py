@@ -1,15 +1,50 @@
 # database_transformation.py
 import json
+import logging
+from typing import Callable, Optional
 from backend_common.database import Database
 from all_types.response_dtypes import MapData
 from storage import (
     convert_to_serializable,
 )
 
+logger = logging.getLogger(__name__)
+
+# Features per COPY + INSERT ... ON CONFLICT round
+DEFAULT_UPSERT_CHUNK_SIZE = 5000
+
 
 async def insert_geojson_to_table(
-    table_name: str, json_data: dict, id_column: str = "id", data_column: str = "data"
+    table_name: str,
+    json_data: dict,
+    id_column: str = "id",
+    data_column: str = "data",
+    chunk_size: int = DEFAULT_UPSERT_CHUNK_SIZE,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
 ) -> list[str]:
+    """
+    Upserts the point features of a FeatureCollection into table_name, keyed by
+    "<lng>_<lat>". Features are COPYed chunk by chunk into a temporary table and
+    merged with a single INSERT ... ON CONFLICT per chunk, so the size of the
+    collection is not bounded by the Postgres parameter limit.
+    """
+    if json_data["type"] != "FeatureCollection" or not json_data["features"]:
+        raise ValueError("Invalid JSON structure")
+
+    records = []
+    inserted_or_updated_ids = []
+    for feature in json_data["features"]:
+        coordinates = feature["geometry"]["coordinates"]
+        if len(coordinates) == 2:
+            custom_id = f"{coordinates[0]}_{coordinates[1]}"
+            records.append((custom_id, json.dumps(feature), len(records)))
+            inserted_or_updated_ids.append(custom_id)
+        else:
+            logger.warning(f"Skipping feature with invalid coordinates: {coordinates}")
+
+    if not inserted_or_updated_ids:
+        raise ValueError("No valid features found in the GeoJSON data")
+
     # Create table if it doesn't exist
     create_table_query = f"""
         CREATE TABLE IF NOT EXISTS {table_name} (
@@ -19,41 +54,44 @@ async def insert_geojson_to_table(
         """
     await Database.execute(create_table_query)
 
-    # Prepare the upsert query
+    # DISTINCT ON keeps the last occurrence of an id inside a chunk, since
+    # ON CONFLICT cannot update the same row twice in one statement
     upsert_query = f"""
-        INSERT INTO {table_name} ({id_column}, {data_column})  
-        VALUES 
+        INSERT INTO {table_name} ({id_column}, {data_column})
+        SELECT DISTINCT ON (feature_id) feature_id, feature_data
+        FROM geojson_upsert_staging
+        ORDER BY feature_id, feature_order DESC
+        ON CONFLICT ({id_column}) DO UPDATE SET {data_column} = EXCLUDED.{data_column}
         """
 
-    values = []
-    inserted_or_updated_ids = []
-    params = []
-
-    if json_data["type"] == "FeatureCollection" and json_data["features"]:
-        for i, feature in enumerate(json_data["features"]):
-            coordinates = feature["geometry"]["coordinates"]
-            if len(coordinates) == 2:
-                custom_id = f"{coordinates[0]}_{coordinates[1]}"
-                feature_json = json.dumps(feature)
-                values.append(f"(${i * 2 + 1}, ${i * 2 + 2})")
-                params.extend([custom_id, feature_json])
-                inserted_or_updated_ids.append(custom_id)
-            else:
-                print(f"Skipping feature with invalid coordinates: {coordinates}")
-
-        if not inserted_or_updated_ids:
-            raise ValueError("No valid features found in the GeoJSON data")
-
-        # Complete the upsert query
-        upsert_query += ",".join(values)
-        upsert_query += f" ON CONFLICT ({id_column}) DO UPDATE SET {data_column} = EXCLUDED.{data_column}"
-
-        # Execute the query with all the data
-        await Database.execute(upsert_query, *params, save_sql_script=True)
-
-        return inserted_or_updated_ids
-    else:
-        raise ValueError("Invalid JSON structure")
+    total = len(records)
+    done = 0
+    async with Database.get_connection() as conn:
+        for chunk_start in range(0, total, chunk_size):
+            chunk = records[chunk_start : chunk_start + chunk_size]
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    CREATE TEMP TABLE geojson_upsert_staging (
+                        feature_id TEXT,
+                        feature_data JSONB,
+                        feature_order BIGINT
+                    ) ON COMMIT DROP
+                    """
+                )
+                await conn.copy_records_to_table(
+                    "geojson_upsert_staging",
+                    records=chunk,
+                    columns=["feature_id", "feature_data", "feature_order"],
+                )
+                await conn.execute(upsert_query)
+
+            done += len(chunk)
+            logger.info(f"Upserted {done}/{total} features into {table_name}")
+            if progress_callback is not None:
+                progress_callback(done, total)
+
+    return inserted_or_updated_ids
 
 
 def create_feature_collection(rows: list) -> MapData:
@@ -0,0 +1,138 @@
+import math
+from typing import Any, Dict, List, Optional
+
+# Quantiles stored for every numeric property of a dataset
+MANIFEST_QUANTILES = [0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95]
+
+
+def property_type(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, list):
+        return "array"
+    return "object"
+
+
+def is_finite_number(value: Any) -> bool:
+    return (
+        isinstance(value, (int, float))
+        and not isinstance(value, bool)
+        and math.isfinite(value)
+    )
+
+
+def quantile(sorted_values: List[float], q: float) -> float:
+    """Linear interpolation between closest ranks, like numpy.percentile"""
+    position = (len(sorted_values) - 1) * q
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = position - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+def build_dataset_manifest(dataset: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Summarises a GeoJSON FeatureCollection: feature count, property names in
+    order of first appearance with their types ("mixed" when they differ,
+    nulls ignored), the bounding box as [lat_min, lat_max, lng_min, lng_max]
+    and count/min/max/quantiles of every numeric property.
+    """
+    features = dataset.get("features") or []
+    properties: Dict[str, Optional[str]] = {}
+    numeric_values: Dict[str, List[float]] = {}
+    lats, lngs = [], []
+
+    for feature in features:
+        coordinates = (feature.get("geometry") or {}).get("coordinates") or []
+        if len(coordinates) >= 2 and is_finite_number(coordinates[0]) and is_finite_number(coordinates[1]):
+            lngs.append(coordinates[0])
+            lats.append(coordinates[1])
+
+        for key, value in (feature.get("properties") or {}).items():
+            value_type = property_type(value)
+            known_type = properties.setdefault(key, None)
+            if value_type != "null":
+                if known_type is None:
+                    properties[key] = value_type
+                elif known_type != value_type:
+                    properties[key] = "mixed"
+            if is_finite_number(value):
+                numeric_values.setdefault(key, []).append(value)
+
+    numeric_stats = {}
+    for key, values in numeric_values.items():
+        if properties[key] != "number":
+            continue
+        values.sort()
+        numeric_stats[key] = {
+            "count": len(values),
+            "min": values[0],
+            "max": values[-1],
+            "quantiles": {str(q): quantile(values, q) for q in MANIFEST_QUANTILES},
+        }
+
+    return {
+        "records_count": len(features),
+        "properties": list(properties.keys()),
+        "property_types": {key: value_type or "null" for key, value_type in properties.items()},
+        "bounding_box": [min(lats), max(lats), min(lngs), max(lngs)] if lats else None,
+        "numeric_stats": numeric_stats,
+    }
+
+
+def merge_dataset_manifests(first: Dict[str, Any], second: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Combines the manifests of two datasets as if their features had been
+    stored together. Numeric count/min/max merge exactly; quantiles can't be
+    combined from two summaries, so merged numeric stats leave them out.
+    """
+    if not first:
+        return second
+    if not second:
+        return first
+
+    property_types = dict(first["property_types"])
+    for key, value_type in second["property_types"].items():
+        known_type = property_types.get(key)
+        if known_type is None or known_type == "null":
+            property_types[key] = value_type
+        elif value_type not in ("null", known_type):
+            property_types[key] = "mixed"
+
+    boxes = [box for box in (first.get("bounding_box"), second.get("bounding_box")) if box]
+    bounding_box = (
+        [
+            min(box[0] for box in boxes),
+            max(box[1] for box in boxes),
+            min(box[2] for box in boxes),
+            max(box[3] for box in boxes),
+        ]
+        if boxes
+        else None
+    )
+
+    numeric_stats = {}
+    for key in set(first["numeric_stats"]) | set(second["numeric_stats"]):
+        if property_types.get(key) != "number":
+            continue
+        stats = [manifest["numeric_stats"][key] for manifest in (first, second) if key in manifest["numeric_stats"]]
+        numeric_stats[key] = {
+            "count": sum(stat["count"] for stat in stats),
+            "min": min(stat["min"] for stat in stats),
+            "max": max(stat["max"] for stat in stats),
+        }
+
+    return {
+        "records_count": first["records_count"] + second["records_count"],
+        "properties": list(dict.fromkeys(first["properties"] + second["properties"])),
+        "property_types": property_types,
+        "bounding_box": bounding_box,
+        "numeric_stats": numeric_stats,
+    }
+
@@ -0,0 +1,32 @@
+import hashlib
+from typing import Any, Optional
+
+import orjson
+
+
+def content_etag(*parts: Any) -> str:
+    """
+    Weak ETag over parts: bytes are hashed as they are, anything else as
+    JSON with sorted keys, so equal content always gives the same tag.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = orjson.dumps(part, default=str, option=orjson.OPT_SORT_KEYS)
+        # Length prefixes keep ("ab", "c") and ("a", "bc") apart
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return f'W/"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Weak comparison of an If-None-Match header against etag"""
+    if not if_none_match or etag is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == opaque_tag
+        for candidate in if_none_match.split(",")
+    )
@@ -16,10 +16,11 @@ from fastapi import (
     Form,
 )
 import json
+import orjson
 from backend_common.background import set_background_tasks
 from fastapi.middleware.cors import CORSMiddleware
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from pydantic import ValidationError
 import asyncio
@@ -47,6 +48,8 @@ from all_types.myapi_dtypes import (
     ReqStreeViewCheck,
     ReqSavePrdcerLyer,
     ReqFetchCtlgLyrs,
+    ReqCensusAggregation,
+    ReqDatasetClusters,
 )
 from backend_common.request_processor import request_handling
 from backend_common.auth import (
@@ -71,6 +74,9 @@ from all_types.response_dtypes import (
     ResGradientColorBasedOnZone,
     ResGetPaymentMethods,
     ResLyrMapData,
+    ResCensusAggregation,
+    ResCtlgBundle,
+    ResDatasetClusters,
     card_metadata,
     CityData,
     NearestPointRouteResponse,
@@ -87,10 +93,19 @@ from data_fetcher import (
     fetch_layer_collection,
     save_lyr,
     aquire_user_lyrs,
-    fetch_lyr_map_data,
     save_prdcer_ctlg,
     fetch_prdcer_ctlgs,
-    fetch_ctlg_lyrs,
+    fetch_ctlg_bundle,
+    fetch_layers_binary,
+    fetch_dataset_tile,
+    fetch_dataset_clusters,
+    fetch_lyr_map_data_if_modified,
+    fetch_ctlg_lyrs_if_modified,
+    fetch_static_etag,
+    lyr_map_data_area,
+    stream_lyr_map_data,
+    stream_ctlg_lyrs,
+    stream_dataset,
     fetch_nearby_categories,
     save_draft_catalog,
     fetch_gradient_colors,
@@ -98,6 +113,8 @@ from data_fetcher import (
     get_user_profile,
     fetch_nearest_points_Gmap,
     fetch_country_city_category_map_data,
+    fetch_census_aggregation,
+    fetch_write_queue_metrics,
 )
 from backend_common.dtypes.stripe_dtypes import (
     ProductReq,
@@ -113,6 +130,24 @@ from backend_common.dtypes.stripe_dtypes import (
     PaymentMethodAttachReq,
 )
 from backend_common.database import Database
+from write_behind_queue import write_behind_queue
+from unit_of_work import begin_unit_of_work, end_unit_of_work
+from storage import commit_unit_of_work
+from compression import (
+    CACHE_COMPRESSED_HEADER,
+    COMPRESSION_MIN_SIZE,
+    CompressionMiddleware,
+    choose_encoding,
+    compress_json_envelope,
+    envelope_encodings,
+)
+from etags import etag_matches
+from vector_tiles import TILE_MAX_AGE, TILE_MEDIA_TYPE
+from layer_encoding import (
+    LAYER_BINARY_MEDIA_TYPE,
+    binary_coordinate_type,
+    stream_response_model,
+)
 from backend_common.logging_wrapper import log_and_validate
 from backend_common.stripe_backend import (
     create_stripe_product,
@@ -146,6 +181,119 @@ T = TypeVar("T", bound=BaseModel)
 U = TypeVar("U", bound=BaseModel)
 
 
+def trusted_json_response(response: BaseModel) -> Response:
+    """
+    Serializes a response built with construct_trusted. Returning a Response
+    keeps FastAPI from validating every feature against response_model again.
+    """
+    return Response(
+        content=response.model_dump_json(serialize_as_any=True),
+        media_type="application/json",
+    )
+
+
+def dump_trusted_data(data: Any) -> bytes:
+    if isinstance(data, list):
+        return b"[" + b",".join(dump_trusted_data(item) for item in data) + b"]"
+    return data.model_dump_json(serialize_as_any=True).encode()
+
+
+def cached_trusted_json_response(response: BaseModel, request: Request) -> Response:
+    """
+    trusted_json_response for data that is the same for every request of a
+    dataset version: the compressed data is cached and only the envelope,
+    which carries the request id, is compressed per request.
+    """
+    data = dump_trusted_data(response.data)
+    encoding = choose_encoding(request.headers.get("accept-encoding", ""), envelope_encodings())
+    if encoding is None or len(data) < COMPRESSION_MIN_SIZE:
+        return trusted_json_response(response)
+    envelope = response.model_dump(exclude={"data"}, mode="json")
+    prefix = orjson.dumps(envelope)[:-1] + b',"data":'
+    return Response(
+        content=compress_json_envelope(prefix, data, b"}", encoding),
+        media_type="application/json",
+        headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+    )
+
+
+def layer_response(response: BaseModel, request: Request, cache_body: bool = False) -> Response:
+    """
+    Sends layers in the binary layer format when the Accept header asks for
+    it, as trusted JSON otherwise. cache_body is only for whole stored layers,
+    which are the same for every request of a dataset version; other bodies
+    (fresh layer ids, viewports) would never be hit and are compressed on the
+    way out by CompressionMiddleware.
+    """
+    coordinate_type = binary_coordinate_type(request.headers.get("accept", ""))
+    if coordinate_type is None:
+        if cache_body:
+            return cached_trusted_json_response(response, request)
+        return trusted_json_response(response)
+    headers = {"X-Request-Id": response.request_id}
+    if cache_body:
+        headers[CACHE_COMPRESSED_HEADER.decode()] = "1"
+    return Response(
+        content=fetch_layers_binary(response.data, coordinate_type),
+        media_type=LAYER_BINARY_MEDIA_TYPE,
+        headers=headers,
+    )
+
+
+def not_modified_response(etag: str) -> Response:
+    # Same Vary as the 200 it stands for, so caches keep encodings apart
+    return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept-Encoding"})
+
+
+def not_modified(request: Request, etag: Optional[str]) -> Optional[Response]:
+    """A 304 response when the request's If-None-Match matches etag"""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified_response(etag)
+    return None
+
+
+def conditional_layer_response(
+    response: BaseModel, request: Request, cache_body: bool = False
+) -> Response:
+    """
+    Response for the (etag, layers) data of a conditional layer fetch: a 304
+    when layers is None, the layer response with its ETag otherwise.
+    """
+    etag, data = response.data
+    if data is None:
+        return not_modified_response(etag)
+    layer = layer_response(response.model_copy(update={"data": data}), request, cache_body)
+    if etag is not None:
+        layer.headers["ETag"] = etag
+    return layer
+
+
+def layer_representation(request: Request) -> str:
+    """Which layer encoding the Accept header selects, part of layer ETags"""
+    return str(binary_coordinate_type(request.headers.get("accept", "")))
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that closes its body once sent, also when the client
+    disconnects halfway, so the cursor behind a stream goes back to the pool.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+
+
+def streamed_response(response: BaseModel) -> Response:
+    """Streams the data of a request_handling response inside its envelope"""
+    return ClosingStreamingResponse(
+        stream_response_model(response.data, response.request_id, response.message),
+        media_type="application/json",
+    )
+
+
 def create_formatted_example(model_class):
     """Create a formatted JSON example string"""
     schema = model_class.model_json_schema()
@@ -207,6 +355,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
 
 
 @app.middleware("http")
@@ -218,14 +367,32 @@ async def background_tasks_middleware(request, call_next):
     return response
 
 
+@app.middleware("http")
+async def unit_of_work_middleware(request, call_next):
+    # Profile, table and matching writes made while handling the request are
+    # written once here, and dropped if the request failed. The stores are
+    # not written atomically, see commit_unit_of_work
+    token = begin_unit_of_work()
+    try:
+        response = await call_next(request)
+        if response.status_code < 400:
+            await commit_unit_of_work()
+        return response
+    finally:
+        end_unit_of_work(token)
+
+
 @app.on_event("startup")
 async def startup_event():
     await Database.create_pool()
     await db.initialize_all()
+    write_behind_queue.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    # Drain queued Firestore writes before the clients go away
+    await write_behind_queue.stop()
     await Database.close_pool()
     # Run cleanup in a thread to not block
     await asyncio.get_event_loop().run_in_executor(None, db.cleanup)
@@ -264,7 +431,11 @@ async def layer_collection():
 
 
 @app.get(CONF.country_city, response_model=ResModel[dict[str, list[CityData]]])
-async def country_city():
+async def country_city(request: Request, http_response: Response):
+    etag = await fetch_static_etag("country_city")
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
     response = await request_handling(
         None,
         None,
@@ -272,11 +443,16 @@ async def country_city():
         fetch_country_city_data,
         wrap_output=True,
     )
+    http_response.headers["ETag"] = etag
     return response
 
 
 @app.get(CONF.nearby_categories, response_model=ResModel[dict[str, list[str]]])
-async def nearby_categories():
+async def nearby_categories(request: Request, http_response: Response):
+    etag = await fetch_static_etag("nearby_categories")
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
     response = await request_handling(
         None,
         None,
@@ -284,6 +460,7 @@ async def nearby_categories():
         fetch_nearby_categories,
         wrap_output=True,
     )
+    http_response.headers["ETag"] = etag
     return response
 
 
@@ -300,6 +477,34 @@ async def fetch_dataset_ep(req: ReqModel[ReqFetchDataset], request: Request):
         fetch_country_city_category_map_data,
         wrap_output=True,
     )
+    return layer_response(response, request)
+
+
+@app.post(
+    CONF.fetch_dataset_stream,
+    description="Same as fetch_dataset, with the features streamed",
+    dependencies=[Depends(JWTBearer())],
+)
+async def fetch_dataset_stream_ep(req: ReqModel[ReqFetchDataset]):
+    response = await request_handling(
+        req.request_body, ReqFetchDataset, ResModel[Any], stream_dataset, wrap_output=True
+    )
+    return streamed_response(response)
+
+
+@app.post(
+    CONF.census_aggregation,
+    response_model=ResModel[ResCensusAggregation],
+    dependencies=[Depends(JWTBearer())],
+)
+async def census_aggregation_ep(req: ReqModel[ReqCensusAggregation], request: Request):
+    response = await request_handling(
+        req.request_body,
+        ReqCensusAggregation,
+        ResModel[ResCensusAggregation],
+        fetch_census_aggregation,
+        wrap_output=True,
+    )
     return response
 
 
@@ -326,15 +531,38 @@ async def user_layers(req: ReqModel[ReqUserId]):
 
 
 @app.post(CONF.prdcer_lyr_map_data, response_model=ResModel[ResLyrMapData])
-async def prdcer_lyr_map_data(req: ReqModel[ReqPrdcerLyrMapData]):
+async def prdcer_lyr_map_data(req: ReqModel[ReqPrdcerLyrMapData], request: Request):
+    async def fetch_if_modified(req: ReqPrdcerLyrMapData):
+        return await fetch_lyr_map_data_if_modified(
+            req, request.headers.get("if-none-match"), layer_representation(request)
+        )
+
     response = await request_handling(
         req.request_body,
         ReqPrdcerLyrMapData,
-        ResModel[ResLyrMapData],
-        fetch_lyr_map_data,
+        ResModel[Any],
+        fetch_if_modified,
         wrap_output=True,
     )
-    return response
+    # Only the whole layer is worth caching; viewports differ per request
+    return conditional_layer_response(
+        response, request, cache_body=lyr_map_data_area(req.request_body) is None
+    )
+
+
+@app.post(
+    CONF.prdcer_lyr_map_data_stream,
+    description="Same as prdcer_lyr_map_data, with the features streamed",
+)
+async def prdcer_lyr_map_data_stream(req: ReqModel[ReqPrdcerLyrMapData]):
+    response = await request_handling(
+        req.request_body,
+        ReqPrdcerLyrMapData,
+        ResModel[Any],
+        stream_lyr_map_data,
+        wrap_output=True,
+    )
+    return streamed_response(response)
 
 
 @app.post(
@@ -399,17 +627,78 @@ async def user_catalogs(req: ReqModel[ReqUserId]):
 
 
 @app.post(CONF.fetch_ctlg_lyrs, response_model=ResModel[list[ResLyrMapData]])
-async def fetch_catalog_layers(req: ReqModel[ReqFetchCtlgLyrs]):
+async def fetch_catalog_layers(req: ReqModel[ReqFetchCtlgLyrs], request: Request):
+    async def fetch_if_modified(req: ReqFetchCtlgLyrs):
+        return await fetch_ctlg_lyrs_if_modified(
+            req, request.headers.get("if-none-match"), layer_representation(request)
+        )
+
+    response = await request_handling(
+        req.request_body,
+        ReqFetchCtlgLyrs,
+        ResModel[Any],
+        fetch_if_modified,
+        wrap_output=True,
+    )
+    return conditional_layer_response(response, request, cache_body=True)
+
+
+@app.post(
+    CONF.fetch_ctlg_lyrs_stream,
+    description="Same as fetch_ctlg_lyrs, with the features streamed",
+)
+async def fetch_catalog_layers_stream(req: ReqModel[ReqFetchCtlgLyrs]):
+    response = await request_handling(
+        req.request_body, ReqFetchCtlgLyrs, ResModel[Any], stream_ctlg_lyrs, wrap_output=True
+    )
+    return streamed_response(response)
+
+
+@app.post(CONF.fetch_ctlg_bundle, response_model=ResModel[ResCtlgBundle])
+async def fetch_catalog_bundle(req: ReqModel[ReqFetchCtlgLyrs]):
     response = await request_handling(
         req.request_body,
         ReqFetchCtlgLyrs,
-        ResModel[list[ResLyrMapData]],
-        fetch_ctlg_lyrs,
+        ResModel[ResCtlgBundle],
+        fetch_ctlg_bundle,
         wrap_output=True,
     )
     return response
 
 
+@app.get(
+    CONF.dataset_tile,
+    response_class=Response,
+    dependencies=[Depends(JWTBearer())],
+)
+async def dataset_tile(dataset_id: str, z: int, x: int, y: int):
+    tile = await fetch_dataset_tile(dataset_id, z, x, y)
+    return Response(
+        content=tile,
+        media_type=TILE_MEDIA_TYPE,
+        headers={
+            "Cache-Control": f"public, max-age={TILE_MAX_AGE}",
+            CACHE_COMPRESSED_HEADER.decode(): "1",
+        },
+    )
+
+
+@app.post(
+    CONF.dataset_clusters,
+    response_model=ResModel[ResDatasetClusters],
+    dependencies=[Depends(JWTBearer())],
+)
+async def dataset_clusters(req: ReqModel[ReqDatasetClusters]):
+    response = await request_handling(
+        req.request_body,
+        ReqDatasetClusters,
+        ResModel[ResDatasetClusters],
+        fetch_dataset_clusters,
+        wrap_output=True,
+    )
+    return trusted_json_response(response)
+
+
 # Authentication
 @app.post(CONF.login, response_model=ResModel[dict[str, Any]], tags=["Authentication"])
 async def login(req: ReqModel[ReqUserLogin]):
@@ -585,10 +874,27 @@ async def save_draft_catalog_endpoint(
 
 
 @app.get(CONF.fetch_gradient_colors, response_model=ResModel[list[list[str]]])
-async def ep_fetch_gradient_colors():
+async def ep_fetch_gradient_colors(request: Request, http_response: Response):
+    etag = await fetch_static_etag("gradient_colors")
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
     response = await request_handling(
         None, None, ResModel[list[list[str]]], fetch_gradient_colors, wrap_output=True
     )
+    http_response.headers["ETag"] = etag
+    return response
+
+
+@app.get(
+    CONF.write_queue_metrics,
+    response_model=ResModel[dict],
+    dependencies=[Depends(JWTBearer())],
+)
+async def ep_write_queue_metrics():
+    response = await request_handling(
+        None, None, ResModel[dict], fetch_write_queue_metrics, wrap_output=True
+    )
     return response
 
 
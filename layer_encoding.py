@@ -0,0 +1,554 @@
+import base64
+import struct
+import sys
+from array import array
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple
+
+import orjson
+
+# Layer fields copied as they are into the bundle next to the encoded features
+BUNDLE_LAYER_FIELDS = [
+    "prdcer_layer_name",
+    "prdcer_lyr_id",
+    "bknd_dataset_id",
+    "points_color",
+    "layer_legend",
+    "layer_description",
+    "records_count",
+    "city_name",
+    "is_zone_lyr",
+    "properties",
+]
+SCALAR_TYPES = (str, int, float, bool, type(None))
+# Streamed JSON is sent in chunks of at least this many bytes
+STREAM_CHUNK_SIZE = 64 * 1024
+# Compact coordinates keep this many decimal digits; 6 is about 0.1 m and
+# 7, the most allowed, still fits quantized degrees in 32 bits
+COMPACT_COORDINATES = "delta-varint"
+MAX_COORDINATE_PRECISION = 7
+
+
+def pack_coordinates(coordinates: List[float]) -> str:
+    """Packs a flat coordinate list as base64 little-endian float64"""
+    packed = array("d", coordinates)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode("ascii")
+
+
+def unpack_coordinates(packed: str) -> List[float]:
+    unpacked = array("d")
+    unpacked.frombytes(base64.b64decode(packed))
+    if sys.byteorder == "big":
+        unpacked.byteswap()
+    return unpacked.tolist()
+
+
+def zigzag_varints(values: List[int]) -> bytes:
+    """Signed integers as zigzag LEB128 varints"""
+    out = bytearray()
+    for value in values:
+        value = (value << 1) ^ (value >> 63)
+        while value > 0x7F:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def read_zigzag_varints(buffer: bytes) -> List[int]:
+    values = []
+    value = shift = 0
+    for byte in buffer:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append((value >> 1) ^ -(value & 1))
+        value = shift = 0
+    return values
+
+
+def _spread_bits(value: int) -> int:
+    """Moves the 32 low bits of value to the even bits of a 64-bit integer"""
+    value &= 0xFFFFFFFF
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    return (value | (value << 1)) & 0x5555555555555555
+
+
+def morton_code(x: int, y: int) -> int:
+    """Z-order curve position of two non-negative 32-bit integers"""
+    return _spread_bits(x) | (_spread_bits(y) << 1)
+
+
+def encode_compact_coordinates(
+    coordinates: List[List[float]], precision: int
+) -> Tuple[List[int], str, Dict[str, Any]]:
+    """
+    Quantizes [lng, lat] points to precision decimal digits and orders them
+    along a Morton curve, so neighbours on the map are neighbours in the
+    list, then delta-encodes them as zigzag varints. Returns the original
+    index of each point in curve order, the base64 deltas and the decode
+    parameters.
+    """
+    if not 0 <= precision <= MAX_COORDINATE_PRECISION:
+        raise ValueError(f"precision must be between 0 and {MAX_COORDINATE_PRECISION}")
+    scale = 10**precision
+    quantized = [(round(lng * scale), round(lat * scale)) for lng, lat, *_ in coordinates]
+    # Offsets from -180/-90 are non-negative and fit in 32 bits
+    order = sorted(
+        range(len(quantized)),
+        key=lambda i: morton_code(quantized[i][0] + 180 * scale, quantized[i][1] + 90 * scale),
+    )
+    deltas = []
+    previous_lng = previous_lat = 0
+    for i in order:
+        lng, lat = quantized[i]
+        deltas.append(lng - previous_lng)
+        deltas.append(lat - previous_lat)
+        previous_lng, previous_lat = lng, lat
+    encoding = {"type": COMPACT_COORDINATES, "precision": precision, "order": "morton"}
+    return order, base64.b64encode(zigzag_varints(deltas)).decode("ascii"), encoding
+
+
+def decode_compact_coordinates(packed: str, encoding: Dict[str, Any]) -> List[float]:
+    """Flat [lng, lat, ...] list of coordinates made by encode_compact_coordinates"""
+    scale = 10 ** encoding["precision"]
+    coordinates = []
+    lng = lat = 0
+    deltas = read_zigzag_varints(base64.b64decode(packed))
+    for i in range(0, len(deltas), 2):
+        lng += deltas[i]
+        lat += deltas[i + 1]
+        coordinates.append(lng / scale)
+        coordinates.append(lat / scale)
+    return coordinates
+
+
+class SharedDictionary:
+    """Assigns integer codes to property keys and values, shared by all layers"""
+
+    def __init__(self):
+        self.keys: List[str] = []
+        self.values: List[Any] = []
+        self._key_codes: Dict[str, int] = {}
+        self._value_codes: Dict[Tuple, int] = {}
+
+    def key_code(self, key: str) -> int:
+        code = self._key_codes.get(key)
+        if code is None:
+            code = self._key_codes[key] = len(self.keys)
+            self.keys.append(key)
+        return code
+
+    def value_code(self, value: Any) -> int:
+        # The type is part of the identity so 1, 1.0, True and "1" stay apart
+        if isinstance(value, SCALAR_TYPES):
+            identity = (type(value).__name__, value)
+        else:
+            identity = ("json", orjson.dumps(value, option=orjson.OPT_SORT_KEYS))
+        code = self._value_codes.get(identity)
+        if code is None:
+            code = self._value_codes[identity] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def encode_value(self, value: Any):
+        """Lists of scalars are coded element by element, anything else as a whole"""
+        if isinstance(value, list) and all(isinstance(v, SCALAR_TYPES) for v in value):
+            return [self.value_code(v) for v in value]
+        return self.value_code(value)
+
+
+def decode_value(encoded, values: List[Any]) -> Any:
+    if isinstance(encoded, list):
+        return [values[code] for code in encoded]
+    return values[encoded]
+
+
+def encode_catalog_bundle(
+    layers: List[Dict[str, Any]], precision: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Turns catalog layers (ResLyrMapData dicts) into one bundle. Property keys
+    and values are replaced by indexes into dictionaries shared by the whole
+    catalog; each feature's properties become a flat [key, value, key, value,
+    ...] list and the point coordinates of a layer are packed into one
+    base64 float64 array of [lng, lat, lng, lat, ...]. With precision, the
+    coordinates are compact instead (see encode_compact_coordinates), the
+    features follow the curve order and coordinate_encoding says how to
+    decode them.
+    """
+    dictionary = SharedDictionary()
+    bundle_layers = []
+    for layer in layers:
+        features = layer["features"]
+        bundle_layer = {field: layer[field] for field in BUNDLE_LAYER_FIELDS if field in layer}
+        points = [feature["geometry"]["coordinates"][:2] for feature in features]
+        if precision is None:
+            bundle_layer["coordinates"] = pack_coordinates(
+                [value for point in points for value in point]
+            )
+        else:
+            order, bundle_layer["coordinates"], bundle_layer["coordinate_encoding"] = (
+                encode_compact_coordinates(points, precision)
+            )
+            features = [features[i] for i in order]
+
+        feature_properties = []
+        for feature in features:
+            encoded = []
+            for key, value in feature["properties"].items():
+                encoded.append(dictionary.key_code(key))
+                encoded.append(dictionary.encode_value(value))
+            feature_properties.append(encoded)
+        bundle_layer["feature_properties"] = feature_properties
+        bundle_layers.append(bundle_layer)
+
+    return {
+        "keys": dictionary.keys,
+        "values": dictionary.values,
+        "layers": bundle_layers,
+    }
+
+
+def decode_catalog_bundle(bundle: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Rebuilds the GeoJSON layers of a bundle made by encode_catalog_bundle"""
+    keys, values = bundle["keys"], bundle["values"]
+    layers = []
+    for bundle_layer in bundle["layers"]:
+        coordinate_encoding = bundle_layer.get("coordinate_encoding")
+        if coordinate_encoding is None:
+            coordinates = unpack_coordinates(bundle_layer["coordinates"])
+        else:
+            coordinates = decode_compact_coordinates(
+                bundle_layer["coordinates"], coordinate_encoding
+            )
+        features = []
+        for i, encoded in enumerate(bundle_layer["feature_properties"]):
+            properties = {
+                keys[encoded[j]]: decode_value(encoded[j + 1], values)
+                for j in range(0, len(encoded), 2)
+            }
+            features.append(
+                {
+                    "type": "Feature",
+                    "properties": properties,
+                    "geometry": {
+                        "type": "Point",
+                        "coordinates": coordinates[2 * i : 2 * i + 2],
+                    },
+                }
+            )
+        layer = {
+            field: value
+            for field, value in bundle_layer.items()
+            if field not in ("coordinates", "coordinate_encoding", "feature_properties")
+        }
+        layer["type"] = "FeatureCollection"
+        layer["features"] = features
+        layers.append(layer)
+    return layers
+
+
+async def close_stream(stream: AsyncIterable) -> None:
+    """
+    Closes an async generator that may have been left before its end, so
+    whatever it holds open (a cursor and its pooled connection) is released
+    now rather than whenever it is garbage collected.
+    """
+    aclose = getattr(stream, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+async def buffer_chunks(parts: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Joins small pieces of output into chunks of about STREAM_CHUNK_SIZE"""
+    buffer = bytearray()
+    try:
+        async for part in parts:
+            buffer += part
+            if len(buffer) >= STREAM_CHUNK_SIZE:
+                yield bytes(buffer)
+                buffer.clear()
+    finally:
+        await close_stream(parts)
+    if buffer:
+        yield bytes(buffer)
+
+
+async def _feature_collection_parts(
+    envelope: Dict[str, Any], features: AsyncIterable[bytes]
+) -> AsyncIterator[bytes]:
+    # The envelope is written without its closing brace, then the features
+    head = orjson.dumps({key: value for key, value in envelope.items() if key != "features"})
+    yield head[:-1] + (b',"features":[' if len(head) > 2 else b'"features":[')
+    first = True
+    try:
+        async for feature in features:
+            yield feature if first else b"," + feature
+            first = False
+    finally:
+        await close_stream(features)
+    yield b"]}"
+
+
+def stream_feature_collection(
+    envelope: Dict[str, Any], features: AsyncIterable[bytes]
+) -> AsyncIterator[bytes]:
+    """
+    Streams a FeatureCollection as JSON: the envelope fields first, then the
+    already encoded features one after the other, without building the whole
+    document in memory.
+    """
+    return buffer_chunks(_feature_collection_parts(envelope, features))
+
+
+async def stream_json_array(items: AsyncIterable[AsyncIterable[bytes]]) -> AsyncIterator[bytes]:
+    """Streams a JSON array whose items are themselves streamed"""
+    yield b"["
+    first = True
+    try:
+        async for item in items:
+            if not first:
+                yield b","
+            first = False
+            try:
+                async for chunk in item:
+                    yield chunk
+            finally:
+                await close_stream(item)
+    finally:
+        await close_stream(items)
+    yield b"]"
+
+
+async def stream_response_model(
+    data_chunks: AsyncIterable[bytes], request_id: str, message: str = "Request received"
+) -> AsyncIterator[bytes]:
+    """Wraps streamed data in the usual {message, request_id, data} envelope"""
+    try:
+        yield orjson.dumps({"message": message, "request_id": request_id})[:-1] + b',"data":'
+        async for chunk in data_chunks:
+            yield chunk
+    finally:
+        await close_stream(data_chunks)
+    yield b"}"
+
+
+LAYER_BINARY_MEDIA_TYPE = "application/vnd.slocator.layer+binary"
+LAYER_BINARY_MAGIC = b"SLYR"
+LAYER_BINARY_VERSION = 1
+# Code of a property a feature does not have, in dictionary columns
+MISSING_CODE = 0xFFFFFFFF
+COORDINATE_TYPES = {"float64": "d", "float32": "f"}
+# Stands for a property a feature does not have, as opposed to a null value
+MISSING = object()
+# array typecode and presence test of each typed column kind
+COLUMN_KINDS = {
+    "bool": ("B", lambda value: isinstance(value, bool)),
+    "int": (
+        "q",
+        lambda value: isinstance(value, int)
+        and not isinstance(value, bool)
+        and -(2**63) <= value < 2**63,
+    ),
+    "float": ("d", lambda value: isinstance(value, float)),
+}
+
+
+def to_little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def from_little_endian(typecode: str, buffer: memoryview) -> List[Any]:
+    values = array(typecode)
+    values.frombytes(buffer)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tolist()
+
+
+def column_kind(values: List[Any]) -> str:
+    """Typed column kind when every present value has that type, else dictionary"""
+    present = [value for value in values if value is not MISSING]
+    for kind, (_, accepts) in COLUMN_KINDS.items():
+        if present and all(accepts(value) for value in present):
+            return kind
+    return "dictionary"
+
+
+def dictionary_encode(values: List[Any]) -> Tuple[List[Any], array]:
+    """Distinct values in order of appearance and the uint32 code of each value"""
+    if all(isinstance(value, str) or value is MISSING for value in values):
+        # Plain strings need no type-aware identity
+        string_codes: Dict[str, int] = {}
+        codes = array(
+            "I",
+            (
+                MISSING_CODE if value is MISSING else string_codes.setdefault(value, len(string_codes))
+                for value in values
+            ),
+        )
+        return list(string_codes), codes
+    dictionary = SharedDictionary()
+    codes = array(
+        "I",
+        (MISSING_CODE if value is MISSING else dictionary.value_code(value) for value in values),
+    )
+    return dictionary.values, codes
+
+
+def _pad(buffer: bytes, fill: bytes = b"\0") -> bytes:
+    return buffer + fill * (-len(buffer) % 8)
+
+
+def encode_layer_binary(layer: Dict[str, Any], coordinate_type: str = "float64") -> bytes:
+    """
+    Columnar binary form of one layer: a JSON header with the layer fields
+    and column descriptors, then 8-byte aligned little-endian buffers. Point
+    coordinates are one interleaved [lng, lat, ...] float buffer; every
+    property is one column, either typed (bool/int/float, with a presence
+    byte per feature) or dictionary-encoded as uint32 codes into a value list
+    kept in the header.
+    """
+    features = layer.get("features") or []
+    count = len(features)
+    keys = list(dict.fromkeys(key for feature in features for key in feature["properties"]))
+
+    buffers = []
+    offset = 0
+
+    def add_buffer(buffer: bytes) -> Dict[str, int]:
+        nonlocal offset
+        descriptor = {"offset": offset, "length": len(buffer)}
+        buffers.append(_pad(buffer))
+        offset += len(buffers[-1])
+        return descriptor
+
+    coordinates = array(COORDINATE_TYPES[coordinate_type])
+    for feature in features:
+        coordinates.extend(feature["geometry"]["coordinates"][:2])
+    header = {
+        "fields": {key: value for key, value in layer.items() if key != "features"},
+        "count": count,
+        "coordinate_type": coordinate_type,
+        "coordinates": add_buffer(to_little_endian(coordinates)),
+        "columns": [],
+    }
+
+    for key in keys:
+        values = [feature["properties"].get(key, MISSING) for feature in features]
+        kind = column_kind(values)
+        column = {"name": key, "kind": kind}
+        if kind == "dictionary":
+            column["values"], codes = dictionary_encode(values)
+            column["codes"] = add_buffer(to_little_endian(codes))
+        else:
+            typecode = COLUMN_KINDS[kind][0]
+            column["present"] = add_buffer(bytes(value is not MISSING for value in values))
+            column["data"] = add_buffer(
+                to_little_endian(array(typecode, (0 if value is MISSING else value for value in values)))
+            )
+        header["columns"].append(column)
+
+    # Spaces keep the padded header valid JSON
+    header_bytes = _pad(orjson.dumps(header), b" ")
+    return struct.pack("<Q", len(header_bytes)) + header_bytes + b"".join(buffers)
+
+
+def decode_layer_binary(blob: bytes) -> Dict[str, Any]:
+    """Rebuilds the GeoJSON layer of a blob made by encode_layer_binary"""
+    view = memoryview(blob)
+    (header_length,) = struct.unpack_from("<Q", view)
+    header = orjson.loads(view[8 : 8 + header_length])
+    body = view[8 + header_length :]
+
+    def buffer(descriptor: Dict[str, int]) -> memoryview:
+        return body[descriptor["offset"] : descriptor["offset"] + descriptor["length"]]
+
+    count = header["count"]
+    coordinates = from_little_endian(
+        COORDINATE_TYPES[header["coordinate_type"]], buffer(header["coordinates"])
+    )
+    properties = [{} for _ in range(count)]
+    for column in header["columns"]:
+        name = column["name"]
+        if column["kind"] == "dictionary":
+            values = column["values"]
+            for i, code in enumerate(from_little_endian("I", buffer(column["codes"]))):
+                if code != MISSING_CODE:
+                    properties[i][name] = values[code]
+        else:
+            present = buffer(column["present"])
+            data = from_little_endian(COLUMN_KINDS[column["kind"]][0], buffer(column["data"]))
+            if column["kind"] == "bool":
+                data = [bool(value) for value in data]
+            for i, value in enumerate(data):
+                if present[i]:
+                    properties[i][name] = value
+
+    layer = dict(header["fields"])
+    layer["features"] = [
+        {
+            "type": "Feature",
+            "properties": properties[i],
+            "geometry": {"type": "Point", "coordinates": coordinates[2 * i : 2 * i + 2]},
+        }
+        for i in range(count)
+    ]
+    return layer
+
+
+def encode_layers_binary(layers: List[Dict[str, Any]], coordinate_type: str = "float64") -> bytes:
+    """
+    Magic, version and layer count, then each layer blob prefixed by its
+    length. Every buffer starts on an 8-byte boundary of the payload, so
+    clients can view it as a typed array without copying.
+    """
+    blobs = [encode_layer_binary(layer, coordinate_type) for layer in layers]
+    parts = [LAYER_BINARY_MAGIC, struct.pack("<BxxxIxxxx", LAYER_BINARY_VERSION, len(blobs))]
+    for blob in blobs:
+        parts.append(struct.pack("<Q", len(blob)))
+        parts.append(blob)
+    return b"".join(parts)
+
+
+def decode_layers_binary(payload: bytes) -> List[Dict[str, Any]]:
+    view = memoryview(payload)
+    if bytes(view[:4]) != LAYER_BINARY_MAGIC:
+        raise ValueError("Not a binary layer payload")
+    version, count = struct.unpack_from("<BxxxIxxxx", view, 4)
+    if version != LAYER_BINARY_VERSION:
+        raise ValueError(f"Unsupported binary layer version {version}")
+    position = 16
+    layers = []
+    for _ in range(count):
+        (length,) = struct.unpack_from("<Q", view, position)
+        position += 8
+        layers.append(decode_layer_binary(view[position : position + length]))
+        position += length
+    return layers
+
+
+def binary_coordinate_type(accept: str) -> Optional[str]:
+    """
+    The coordinate type asked for when the Accept header lists the binary
+    layer media type ("...; precision=float32" for float32), else None.
+    """
+    for media_range in accept.split(","):
+        media_type, *parameters = [part.strip() for part in media_range.split(";")]
+        if media_type != LAYER_BINARY_MEDIA_TYPE:
+            continue
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip() == "precision" and value.strip() in COORDINATE_TYPES:
+                return value.strip()
+        return "float64"
+    return None
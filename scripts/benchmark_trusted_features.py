@@ -0,0 +1,94 @@
+# benchmark_trusted_features.py
+import argparse
+import time
+import uuid
+from all_types.response_dtypes import ResLyrMapData, ResModel
+
+DEFAULT_FEATURES = 10000
+DEFAULT_ROUNDS = 5
+
+
+def make_features(count: int) -> list[dict]:
+    """Features shaped like MapBoxConnector.assign_point_properties output"""
+    return [
+        {
+            "type": "Feature",
+            "properties": {
+                "name": f"Place {i}",
+                "rating": 4.5,
+                "address": "King Fahd Rd, Riyadh",
+                "phone": "+966 11 000 0000",
+                "types": ["cafe", "food", "establishment"],
+                "priceLevel": "PRICE_LEVEL_MODERATE",
+                "primaryType": "cafe",
+                "user_ratings_total": i,
+                "heatmap_weight": 1,
+            },
+            "geometry": {"type": "Point", "coordinates": [46.6 + i * 1e-5, 24.7]},
+        }
+        for i in range(count)
+    ]
+
+
+def make_layer_fields(count: int) -> dict:
+    return {
+        "type": "FeatureCollection",
+        "properties": ["name", "rating", "address"],
+        "prdcer_layer_name": "Cafes",
+        "prdcer_lyr_id": "l1",
+        "bknd_dataset_id": "dataset",
+        "points_color": "red",
+        "layer_legend": "",
+        "layer_description": "",
+        "records_count": count,
+        "city_name": "Riyadh",
+        "is_zone_lyr": "false",
+    }
+
+
+def validated_response(features: list[dict], fields: dict) -> bytes:
+    data = ResLyrMapData(features=features, **fields)
+    response = ResModel[ResLyrMapData](
+        message="Request received", request_id=f"req-{uuid.uuid4()}", data=data
+    )
+    return response.model_dump_json().encode()
+
+
+def trusted_response(features: list[dict], fields: dict) -> bytes:
+    data = ResLyrMapData.construct_trusted(features=features, **fields)
+    response = ResModel[ResLyrMapData](
+        message="Request received", request_id=f"req-{uuid.uuid4()}", data=data
+    )
+    return response.model_dump_json(serialize_as_any=True).encode()
+
+
+def time_ms(func, rounds: int, *args) -> float:
+    func(*args)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(*args)
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main(count: int, rounds: int):
+    features = make_features(count)
+    fields = make_layer_fields(count)
+    assert validated_response(features, fields)[-200:] == trusted_response(features, fields)[-200:]
+
+    before = time_ms(validated_response, rounds, features, fields)
+    after = time_ms(trusted_response, rounds, features, fields)
+    per_10k = 10000 / count
+    print(f"{count} features, {rounds} rounds")
+    print(f"validated: {before:.1f} ms ({before * per_10k:.1f} ms per 10k features)")
+    print(f"trusted:   {after:.1f} ms ({after * per_10k:.1f} ms per 10k features)")
+    print(f"speedup:   {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare serializing a layer with and without per-feature validation"
+    )
+    parser.add_argument("--features", type=int, default=DEFAULT_FEATURES)
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    args = parser.parse_args()
+    main(args.features, args.rounds)
@@ -0,0 +1,233 @@
+# load_census_data.py
+import argparse
+import asyncio
+import logging
+import re
+import sys
+import time
+import pandas as pd
+from backend_common.database import Database
+from storage import CENSUS_FILE_MAPPING
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+CENSUS_SCHEMA = "schema_marketplace"
+DEFAULT_CHUNK_SIZE = 50000
+DEFAULT_WORKERS = 4
+# Rows read up front to infer the Postgres column types; later values that
+# don't fit widen the column (see PG_TYPE_FALLBACKS)
+TYPE_INFERENCE_ROWS = 20000
+
+
+def parse_bool(value: str) -> bool:
+    lowered = value.strip().lower()
+    if lowered in ("true", "1"):
+        return True
+    if lowered in ("false", "0"):
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+
+# Postgres type -> caster of the CSV text for COPY
+PG_TYPE_CASTERS = {
+    "BIGINT": int,
+    "DOUBLE PRECISION": float,
+    "BOOLEAN": parse_bool,
+    "TEXT": str,
+}
+# Type a column is widened to when one of its values doesn't parse
+PG_TYPE_FALLBACKS = {
+    "BIGINT": "DOUBLE PRECISION",
+    "DOUBLE PRECISION": "TEXT",
+    "BOOLEAN": "TEXT",
+}
+
+
+def normalize_column_name(name: str) -> str:
+    """Lower-cases a CSV header into a plain Postgres identifier."""
+    normalized = re.sub(r"[^0-9a-zA-Z_]+", "_", str(name).strip()).strip("_").lower()
+    if not normalized or normalized[0].isdigit():
+        normalized = f"col_{normalized}"
+    return normalized
+
+
+def infer_pg_type(series: pd.Series) -> str:
+    if pd.api.types.is_bool_dtype(series):
+        return "BOOLEAN"
+    if pd.api.types.is_integer_dtype(series):
+        return "BIGINT"
+    if pd.api.types.is_float_dtype(series):
+        return "DOUBLE PRECISION"
+    return "TEXT"
+
+
+def infer_census_schema(csv_path: str) -> dict[str, str]:
+    """
+    Reads the first rows of a census CSV and returns the Postgres type of every
+    column, keyed by the original CSV header.
+    """
+    sample = pd.read_csv(csv_path, nrows=TYPE_INFERENCE_ROWS)
+    schema = {column: infer_pg_type(sample[column]) for column in sample.columns}
+    normalized = [normalize_column_name(column) for column in schema]
+    if "latitude" not in normalized or "longitude" not in normalized:
+        raise ValueError(f"{csv_path} has no latitude/longitude columns")
+    if len(set(normalized)) != len(normalized):
+        raise ValueError(f"{csv_path} has columns that collide after normalization")
+    return schema
+
+
+def convert_column(values: list, pg_type: str) -> tuple[str, list]:
+    """
+    Casts CSV text values to pg_type, widening the type until every value
+    parses. Returns the type used and the cast values.
+    """
+    while True:
+        caster = PG_TYPE_CASTERS[pg_type]
+        try:
+            return pg_type, [None if pd.isna(value) else caster(value) for value in values]
+        except ValueError:
+            pg_type = PG_TYPE_FALLBACKS[pg_type]
+
+
+def chunk_to_records(
+    chunk: pd.DataFrame, schema: dict[str, str]
+) -> tuple[list[tuple], dict[str, str]]:
+    """
+    COPY records of a chunk read as text, and {column: type} of the columns
+    that had to be widened for it. schema is updated in place.
+    """
+    columns = []
+    widened = {}
+    for column, pg_type in schema.items():
+        used_type, values = convert_column(chunk[column].tolist(), pg_type)
+        if used_type != pg_type:
+            schema[column] = widened[column] = used_type
+        columns.append(values)
+    return list(zip(*columns)), widened
+
+
+async def load_census_file(census_type: str, csv_path: str, chunk_size: int) -> int:
+    """
+    Streams one census CSV into a staging table with COPY, builds the indexes
+    used by the bounding-box queries and then swaps the staging table in place
+    of the live one, so readers never see a half-loaded table.
+    """
+    started = time.monotonic()
+    schema = await asyncio.to_thread(infer_census_schema, csv_path)
+    columns = [normalize_column_name(column) for column in schema]
+    staging_table = f"{census_type}__staging"
+    column_definitions = ",\n".join(
+        f'"{column}" {pg_type}' for column, pg_type in zip(columns, schema.values())
+    )
+
+    # Read as text so values the sample didn't foresee widen the column
+    # instead of failing the parse
+    reader = pd.read_csv(csv_path, chunksize=chunk_size, dtype=str)
+
+    total_rows = 0
+    async with Database.get_connection() as conn:
+        await conn.execute(f'CREATE SCHEMA IF NOT EXISTS "{CENSUS_SCHEMA}"')
+        await conn.execute(f'DROP TABLE IF EXISTS "{CENSUS_SCHEMA}"."{staging_table}"')
+        await conn.execute(
+            f'CREATE TABLE "{CENSUS_SCHEMA}"."{staging_table}" ({column_definitions})'
+        )
+
+        while True:
+            # Parse the next chunk off the event loop so other files keep loading
+            chunk = await asyncio.to_thread(next, reader, None)
+            if chunk is None:
+                break
+            records, widened = await asyncio.to_thread(chunk_to_records, chunk, schema)
+            for column, pg_type in widened.items():
+                name = normalize_column_name(column)
+                logger.warning(f"{census_type}: widening {name} to {pg_type}")
+                await conn.execute(
+                    f'ALTER TABLE "{CENSUS_SCHEMA}"."{staging_table}" '
+                    f'ALTER COLUMN "{name}" TYPE {pg_type} USING "{name}"::{pg_type}'
+                )
+            await conn.copy_records_to_table(
+                staging_table,
+                records=records,
+                columns=columns,
+                schema_name=CENSUS_SCHEMA,
+            )
+            total_rows += len(records)
+            logger.info(f"{census_type}: copied {total_rows} rows")
+
+        await conn.execute(
+            f'CREATE INDEX "{staging_table}_lat_lng_idx" '
+            f'ON "{CENSUS_SCHEMA}"."{staging_table}" (latitude, longitude)'
+        )
+        await conn.execute(f'ANALYZE "{CENSUS_SCHEMA}"."{staging_table}"')
+
+        async with conn.transaction():
+            await conn.execute(f'DROP TABLE IF EXISTS "{CENSUS_SCHEMA}"."{census_type}"')
+            await conn.execute(
+                f'ALTER TABLE "{CENSUS_SCHEMA}"."{staging_table}" RENAME TO "{census_type}"'
+            )
+            await conn.execute(
+                f'ALTER INDEX "{CENSUS_SCHEMA}"."{staging_table}_lat_lng_idx" '
+                f'RENAME TO "{census_type}_lat_lng_idx"'
+            )
+
+    logger.info(
+        f"{census_type}: loaded {total_rows} rows from {csv_path} "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+    return total_rows
+
+
+async def main(census_types: list[str], chunk_size: int, workers: int) -> int:
+    """Loads the census tables and returns how many of them failed"""
+    failed = 0
+    try:
+        await Database.create_pool()
+        if not await Database.health_check():
+            raise Exception("Database health check failed")
+
+        semaphore = asyncio.Semaphore(workers)
+
+        async def load_with_limit(census_type: str) -> int:
+            async with semaphore:
+                return await load_census_file(
+                    census_type, CENSUS_FILE_MAPPING[census_type], chunk_size
+                )
+
+        results = await asyncio.gather(
+            *(load_with_limit(census_type) for census_type in census_types),
+            return_exceptions=True,
+        )
+        for census_type, result in zip(census_types, results):
+            if isinstance(result, Exception):
+                failed += 1
+                logger.error(f"{census_type}: load failed: {result}")
+            else:
+                logger.info(f"{census_type}: {result} rows")
+    finally:
+        await Database.close_pool()
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Bulk load the census CSVs in storage.CENSUS_FILE_MAPPING into Postgres"
+    )
+    parser.add_argument(
+        "--types",
+        nargs="+",
+        choices=list(CENSUS_FILE_MAPPING.keys()),
+        default=list(CENSUS_FILE_MAPPING.keys()),
+        help="census tables to (re)load",
+    )
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_WORKERS, help="files loaded in parallel"
+    )
+    args = parser.parse_args()
+    failed = asyncio.run(main(args.types, args.chunk_size, args.workers))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,75 @@
+# migrate_layer_matching.py
+import argparse
+import asyncio
+import logging
+from collections import defaultdict
+from backend_common.auth import db
+from storage import (
+    LAYER_ENTRIES_COLLECTION,
+    load_dataset_layer_matching,
+    load_user_layer_matching,
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+# Firestore rejects batches with more than 500 writes
+FIRESTORE_BATCH_LIMIT = 500
+
+
+def split_legacy_matching(
+    dataset_layer_matching: dict, user_layer_matching: dict
+) -> dict:
+    """
+    Turns the two legacy matching documents into per-layer entries. A layer
+    listed under several datasets keeps the first one, like the legacy
+    reader did.
+    """
+    layer_entries = defaultdict(dict)
+    for d_id, dataset_info in dataset_layer_matching.items():
+        for lyr_id in dataset_info.get("prdcer_lyrs", []):
+            if "bknd_dataset_id" not in layer_entries[lyr_id]:
+                layer_entries[lyr_id]["bknd_dataset_id"] = d_id
+                layer_entries[lyr_id]["records_count"] = dataset_info.get(
+                    "records_count"
+                )
+    for lyr_id, layer_owner_id in user_layer_matching.items():
+        layer_entries[lyr_id]["layer_owner_id"] = layer_owner_id
+    return dict(layer_entries)
+
+
+async def write_entries(collection_name: str, entries: dict, dry_run: bool):
+    client = db.get_async_client()
+    items = list(entries.items())
+    for start in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+        chunk = items[start : start + FIRESTORE_BATCH_LIMIT]
+        if not dry_run:
+            batch = client.batch()
+            for doc_id, fields in chunk:
+                batch.set(
+                    client.collection(collection_name).document(doc_id),
+                    fields,
+                    merge=True,
+                )
+            await batch.commit()
+        logger.info(f"{collection_name}: {start + len(chunk)}/{len(items)} entries")
+
+
+async def main(dry_run: bool):
+    dataset_layer_matching = await load_dataset_layer_matching()
+    user_layer_matching = await load_user_layer_matching()
+    layer_entries = split_legacy_matching(dataset_layer_matching, user_layer_matching)
+    await write_entries(LAYER_ENTRIES_COLLECTION, layer_entries, dry_run)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Copy the legacy layer_matchings documents into per-entry documents"
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.dry_run))
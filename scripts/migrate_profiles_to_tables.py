@@ -0,0 +1,102 @@
+# migrate_profiles_to_tables.py
+import argparse
+import asyncio
+import logging
+import sys
+from backend_common.database import Database
+from sql_object import SqlObject
+from storage import (
+    fetch_dataset_ids,
+    list_profile_user_ids,
+    load_user_profile,
+    save_prdcer_catalog_relations,
+    save_prdcer_layer_relations,
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+
+
+async def migrate_user(user_id: str) -> tuple[int, int]:
+    """
+    Copies one user's prdcer_lyrs, prdcer_ctlgs and draft_ctlgs from the
+    profile JSON into the normalized tables. Safe to run more than once.
+    """
+    user_data = await load_user_profile(user_id)
+    prdcer = user_data.get("prdcer", {})
+    user_layers = prdcer.get("prdcer_lyrs", {}) or {}
+    layers_dataset_ids = await fetch_dataset_ids(list(user_layers.keys()))
+
+    layers_done = 0
+    for lyr_id, lyr_data in user_layers.items():
+        if lyr_id not in layers_dataset_ids:
+            logger.warning(f"{user_id}: layer {lyr_id} has no dataset, skipped")
+            continue
+        dataset_id, dataset_info = layers_dataset_ids[lyr_id]
+        await save_prdcer_layer_relations(
+            user_id,
+            lyr_id,
+            {**lyr_data, "bknd_dataset_id": dataset_id},
+            dataset_info["records_count"],
+        )
+        layers_done += 1
+
+    catalogs_done = 0
+    for section, is_draft in (("prdcer_ctlgs", False), ("draft_ctlgs", True)):
+        for ctlg_id, ctlg in (prdcer.get(section, {}) or {}).items():
+            await save_prdcer_catalog_relations(user_id, ctlg_id, ctlg, is_draft)
+            catalogs_done += 1
+    return layers_done, catalogs_done
+
+
+async def main(user_ids: list[str], workers: int) -> int:
+    """Migrates user_ids, every user when empty, and returns how many failed"""
+    failed = 0
+    try:
+        await Database.create_pool()
+        if not await Database.health_check():
+            raise Exception("Database health check failed")
+        await Database.execute(SqlObject.create_prdcer_tables)
+
+        if not user_ids:
+            # Profiles live in the Firestore store of backend_common.auth
+            user_ids = await list_profile_user_ids()
+
+        semaphore = asyncio.Semaphore(workers)
+
+        async def migrate_with_limit(user_id: str):
+            async with semaphore:
+                return await migrate_user(user_id)
+
+        results = await asyncio.gather(
+            *(migrate_with_limit(user_id) for user_id in user_ids),
+            return_exceptions=True,
+        )
+        for user_id, result in zip(user_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"{user_id}: migration failed: {result}")
+                failed += 1
+            else:
+                logger.info(f"{user_id}: {result[0]} layers, {result[1]} catalogs")
+    finally:
+        await Database.close_pool()
+    if failed:
+        logger.error(f"{failed} of {len(user_ids)} users failed to migrate")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Copy producer layers and catalogs from user profiles into the normalized tables"
+    )
+    parser.add_argument("--users", nargs="*", default=[], help="user ids, all users if omitted")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    args = parser.parse_args()
+    failed = asyncio.run(main(args.users, args.workers))
+    sys.exit(1 if failed else 0)
@@ -1,9 +1,154 @@
 # run_fetch_transform.py
+import argparse
 import asyncio
+import json
+import logging
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from backend_common.database import Database
+from database_files.database_transformation import (
+    create_feature_collection,
+    insert_geojson_to_table,
+)
+from sql_object import SqlObject
 
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
 
-async def main():
+DEFAULT_SOURCE_TABLE = "riyadh_villa_allrooms"
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_WORKERS = 4
+
+SOURCE_QUERY = """
+    SELECT price, additional__WebListing_uri___location_lat, additional__WebListing_uri___location_lng, *
+    FROM public.{source_table}
+    {resume_filter}
+    ORDER BY {key_column}
+"""
+
+
+def quote_identifier(name: str) -> str:
+    """name as a quoted Postgres identifier, safe to format into a query"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def transform_batch(rows: list[dict]) -> list[dict]:
+    """Runs in a worker process: turns one batch of source rows into GeoJSON features."""
+    return create_feature_collection(rows)["features"]
+
+
+async def load_checkpoint(job_name: str) -> tuple:
+    await Database.execute(SqlObject.create_etl_checkpoints_table)
+    checkpoint = await Database.fetchrow(SqlObject.load_etl_checkpoint, job_name)
+    if checkpoint is None or checkpoint["last_key"] is None:
+        return None, 0
+    return json.loads(checkpoint["last_key"]), checkpoint["rows_done"]
+
+
+async def fetch_key_column_type(source_table: str, key_column: str) -> str:
+    """Postgres type of the key column, which resumed runs cast the checkpoint to"""
+    row = await Database.fetchrow(
+        SqlObject.load_column_type, f"public.{source_table}", key_column
+    )
+    if row is None:
+        raise ValueError(f"public.{source_table} has no column {key_column}")
+    return row["column_type"]
+
+
+async def save_checkpoint(job_name: str, last_key, rows_done: int):
+    await Database.execute(
+        SqlObject.upsert_etl_checkpoint,
+        job_name,
+        json.dumps(last_key, default=str),
+        rows_done,
+        datetime.utcnow(),
+    )
+
+
+async def run_pipeline(
+    source_table: str,
+    target_table: str,
+    key_column: str,
+    batch_size: int,
+    workers: int,
+    restart: bool,
+):
+    """
+    Streams source_table through a server-side cursor in key order, transforms
+    each batch in a process pool and upserts the features into target_table.
+    After every written batch the last key is checkpointed, so a failed run
+    resumes after the last batch that reached Postgres. Batches are written in
+    order; re-running a batch is harmless because the write is an upsert.
+    """
+    job_name = f"{source_table}->{target_table}"
+    if restart:
+        await Database.execute(SqlObject.create_etl_checkpoints_table)
+        await Database.execute(SqlObject.delete_etl_checkpoint, job_name)
+    last_key, rows_done = await load_checkpoint(job_name)
+    if last_key is not None:
+        logger.info(f"Resuming {job_name} after {key_column}={last_key} ({rows_done} rows done)")
+
+    resume_filter = ""
+    query_args = []
+    if last_key is not None:
+        # The checkpoint is JSON, so timestamps, UUIDs and decimals come back
+        # as text; the cast compares them as the key column's own type
+        key_type = await fetch_key_column_type(source_table, key_column)
+        resume_filter = (
+            f"WHERE {quote_identifier(key_column)} > CAST($1::text AS {key_type})"
+        )
+        query_args = [str(last_key)]
+    query = SOURCE_QUERY.format(
+        source_table=source_table,
+        key_column=quote_identifier(key_column),
+        resume_filter=resume_filter,
+    )
+
+    loop = asyncio.get_running_loop()
+    pending = deque()
+
+    async def write_oldest():
+        nonlocal rows_done
+        batch_last_key, batch_rows, future = pending.popleft()
+        features = await future
+        if features:
+            await insert_geojson_to_table(
+                target_table, {"type": "FeatureCollection", "features": features}
+            )
+        rows_done += batch_rows
+        await save_checkpoint(job_name, batch_last_key, rows_done)
+        logger.info(f"{job_name}: {rows_done} rows written, checkpoint {key_column}={batch_last_key}")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        async with Database.get_connection() as conn:
+            # Server-side cursors only live inside a transaction
+            async with conn.transaction():
+                cursor = await conn.cursor(query, *query_args, prefetch=batch_size)
+                while True:
+                    rows = await cursor.fetch(batch_size)
+                    if not rows:
+                        break
+                    rows = [dict(row) for row in rows]
+                    future = loop.run_in_executor(executor, transform_batch, rows)
+                    pending.append((rows[-1][key_column], len(rows), future))
+                    # Keep at most one batch per worker in flight
+                    if len(pending) >= workers:
+                        await write_oldest()
+
+        while pending:
+            await write_oldest()
+
+    logger.info(f"{job_name}: finished, {rows_done} rows")
+
+
+async def main(args) -> int:
+    """Runs the pipeline and returns the exit code, 1 when it failed"""
     try:
         # Initialize the database pool
         await Database.create_pool()
@@ -14,38 +159,44 @@ async def main():
         if not await Database.health_check():
             raise Exception("Database health check failed")
 
-        # Run the fetch and transform process
-        query = "SELECT price, additional__WebListing_uri___location_lat, additional__WebListing_uri___location_lng, * FROM public.riyadh_villa_allrooms limit 10"
+        await run_pipeline(
+            args.source_table,
+            args.target_table or f"{args.source_table}_features",
+            args.key_column,
+            args.batch_size,
+            args.workers,
+            args.restart,
+        )
 
-        # Fetch data from backend_common.database
-        rows = await Database.fetch(query)
-
-        # do your transofmration
-        transformed_data = [
-            {
-                "id": row['id'],
-                "name": row['name'],
-                # Add more fields as needed
-            }
-            for row in rows
-        ]
-        # save it back to postgres in a new table as a json object in 1 column
-
-        # usea method in storage.py to save to JSON file
-
-
-
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
+    except Exception:
+        # The checkpoint is kept, so the run resumes from it next time
+        logger.exception("Fetch and transform failed, re-run to resume")
+        return 1
     finally:
         # Always ensure the pool is closed, even if an error occurred
         await Database.close_pool()
         print("Database connection pool closed.")
+    return 0
 
 
 if __name__ == "__main__":
-    # Set up asyncio to use only one worker
-    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())  # Use this line if on Windows, comment if on mac or linx
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
-    loop.close()
\ No newline at end of file
+    parser = argparse.ArgumentParser(
+        description="Stream a listings table into a GeoJSON feature table with checkpoints"
+    )
+    parser.add_argument("--source-table", default=DEFAULT_SOURCE_TABLE)
+    parser.add_argument(
+        "--target-table", default="", help="defaults to <source-table>_features"
+    )
+    parser.add_argument(
+        "--key-column", default="id", help="unique, ordered column used for checkpoints"
+    )
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument(
+        "--restart", action="store_true", help="ignore the stored checkpoint"
+    )
+    args = parser.parse_args()
+
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    sys.exit(asyncio.run(main(args)))
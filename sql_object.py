@@ -44,6 +44,146 @@ class SqlObject:
             AND longitude BETWEEN $4 AND $5
         LIMIT 20;
     """
+    census_stratified_w_bounding_box: str = """
+        SELECT * FROM (
+            SELECT *,
+                row_number() OVER (
+                    PARTITION BY width_bucket(latitude::float8, $1::float8, $2::float8, $5),
+                                 width_bucket(longitude::float8, $3::float8, $4::float8, $5)
+                    ORDER BY random()
+                ) AS cell_rank
+            FROM "schema_marketplace".{table_name}
+            WHERE latitude BETWEEN $1 AND $2 AND longitude BETWEEN $3 AND $4
+        ) AS stratified
+        ORDER BY cell_rank, random()
+        LIMIT $6;
+    """
+    canada_commercial_stratified_w_bounding_box_and_property_type: str = """
+        SELECT address, price, price_description, property_type, city, description, region_stats_summary, latitude, longitude
+        FROM (
+            SELECT *,
+                row_number() OVER (
+                    PARTITION BY width_bucket(latitude::float8, $2::float8, $3::float8, $6),
+                                 width_bucket(longitude::float8, $4::float8, $5::float8, $6)
+                    ORDER BY random()
+                ) AS cell_rank
+            FROM "schema_marketplace".canada_commercial_properties
+            WHERE lower(property_type) LIKE '%' || lower($1) || '%'
+                AND latitude BETWEEN $2 AND $3
+                AND longitude BETWEEN $4 AND $5
+        ) AS stratified
+        ORDER BY cell_rank, random()
+        LIMIT $7;
+    """
+    saudi_real_estate_stratified_w_bounding_box_and_category: str = """
+        SELECT url, price, city, latitude, longitude
+        FROM (
+            SELECT *,
+                row_number() OVER (
+                    PARTITION BY width_bucket(latitude::float8, $2::float8, $3::float8, $6),
+                                 width_bucket(longitude::float8, $4::float8, $5::float8, $6)
+                    ORDER BY random()
+                ) AS cell_rank
+            FROM "schema_marketplace".saudi_real_estate
+            WHERE "category" = $1
+                AND latitude BETWEEN $2 AND $3
+                AND longitude BETWEEN $4 AND $5
+        ) AS stratified
+        ORDER BY cell_rank, random()
+        LIMIT $7;
+    """
+    census_aggregation_columns: str = """
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = 'schema_marketplace'
+            AND table_name = $1
+            AND data_type IN ('smallint', 'integer', 'bigint', 'numeric', 'real',
+                              'double precision', 'text', 'character varying')
+        ORDER BY ordinal_position;
+    """
+    # $5 scales longitudes by cos(latitude), $6 is the hex size (centre to corner) in degrees.
+    # Axial hex coordinates are rounded through cube coordinates.
+    census_hex_aggregation_w_bounding_box: str = """
+        WITH hex_axial AS (
+            SELECT *,
+                (sqrt(3) / 3 * longitude::float8 * $5 - latitude::float8 / 3) / $6 AS axial_q,
+                (2.0 / 3 * latitude::float8) / $6 AS axial_r
+            FROM "schema_marketplace".{table_name}
+            WHERE latitude BETWEEN $1 AND $2 AND longitude BETWEEN $3 AND $4
+        ),
+        hex_rounded AS (
+            SELECT *,
+                round(axial_q) AS round_q,
+                round(axial_r) AS round_r,
+                round(-axial_q - axial_r) AS round_s,
+                abs(round(axial_q) - axial_q) AS diff_q,
+                abs(round(axial_r) - axial_r) AS diff_r,
+                abs(round(-axial_q - axial_r) + axial_q + axial_r) AS diff_s
+            FROM hex_axial
+        ),
+        hex_cells AS (
+            SELECT *,
+                CASE WHEN diff_q > diff_r AND diff_q > diff_s THEN -round_r - round_s
+                     ELSE round_q END AS cell_col,
+                CASE WHEN diff_q > diff_r AND diff_q > diff_s THEN round_r
+                     WHEN diff_r > diff_s THEN -round_q - round_s
+                     ELSE round_r END AS cell_row
+            FROM hex_rounded
+        )
+        SELECT
+            cell_col,
+            cell_row,
+            $6 * sqrt(3) * (cell_col + cell_row / 2.0) / $5 AS longitude,
+            $6 * 1.5 * cell_row AS latitude,
+            count(*) AS point_count{aggregates}
+        FROM hex_cells
+        GROUP BY cell_col, cell_row;
+    """
+    # $5 scales longitudes by cos(latitude), $6 is the square side in degrees.
+    census_square_aggregation_w_bounding_box: str = """
+        WITH square_cells AS (
+            SELECT *,
+                floor(longitude::float8 * $5 / $6) AS cell_col,
+                floor(latitude::float8 / $6) AS cell_row
+            FROM "schema_marketplace".{table_name}
+            WHERE latitude BETWEEN $1 AND $2 AND longitude BETWEEN $3 AND $4
+        )
+        SELECT
+            cell_col,
+            cell_row,
+            (cell_col + 0.5) * $6 / $5 AS longitude,
+            (cell_row + 0.5) * $6 AS latitude,
+            count(*) AS point_count{aggregates}
+        FROM square_cells
+        GROUP BY cell_col, cell_row;
+    """
+    create_etl_checkpoints_table: str = """
+    CREATE TABLE IF NOT EXISTS etl_checkpoints (
+        job_name TEXT PRIMARY KEY,
+        last_key JSONB,
+        rows_done BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+    load_etl_checkpoint: str = """
+    SELECT last_key, rows_done FROM etl_checkpoints WHERE job_name = $1;
+    """
+    upsert_etl_checkpoint: str = """
+    INSERT INTO etl_checkpoints (job_name, last_key, rows_done, updated_at)
+    VALUES ($1, $2, $3, $4)
+    ON CONFLICT (job_name) DO UPDATE SET
+        last_key = $2,
+        rows_done = $3,
+        updated_at = $4;
+    """
+    delete_etl_checkpoint: str = """
+    DELETE FROM etl_checkpoints WHERE job_name = $1;
+    """
+    load_column_type: str = """
+    SELECT format_type(atttypid, atttypmod) AS column_type
+    FROM pg_attribute
+    WHERE attrelid = to_regclass($1) AND attname = $2 AND NOT attisdropped;
+    """
     create_datasets_table: str = """
     CREATE SCHEMA IF NOT EXISTS "schema_marketplace";
     
@@ -51,19 +191,26 @@ class SqlObject:
         filename TEXT PRIMARY KEY,
         request_data JSONB,
         response_data JSONB,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        manifest JSONB,
+        etag TEXT
     );
+
+    ALTER TABLE "schema_marketplace"."datasets" ADD COLUMN IF NOT EXISTS manifest JSONB;
+    ALTER TABLE "schema_marketplace"."datasets" ADD COLUMN IF NOT EXISTS etag TEXT;
     """
     
     store_dataset: str = """
     INSERT INTO "schema_marketplace"."datasets" 
-    (filename, request_data, response_data, created_at)
-    VALUES ($1, $2, $3, $4)
+    (filename, request_data, response_data, created_at, manifest, etag)
+    VALUES ($1, $2, $3, $4, $5, $6)
     ON CONFLICT (filename) 
     DO UPDATE SET 
         request_data = $2,
         response_data = $3,
-        created_at = $4;
+        created_at = $4,
+        manifest = $5,
+        etag = $6;
     """
     
     load_dataset: str = """
@@ -71,3 +218,306 @@ class SqlObject:
     FROM "schema_marketplace"."datasets" 
     WHERE filename = $1;
     """
+
+    create_prdcer_tables: str = """
+    CREATE SCHEMA IF NOT EXISTS "schema_marketplace";
+
+    CREATE TABLE IF NOT EXISTS "schema_marketplace"."prdcer_layers" (
+        prdcer_lyr_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        layer_data JSONB NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS prdcer_layers_user_id_idx
+        ON "schema_marketplace"."prdcer_layers" (user_id, created_at);
+
+    CREATE TABLE IF NOT EXISTS "schema_marketplace"."prdcer_catalogs" (
+        prdcer_ctlg_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        is_draft BOOLEAN NOT NULL DEFAULT FALSE,
+        catalog_data JSONB NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS prdcer_catalogs_user_id_idx
+        ON "schema_marketplace"."prdcer_catalogs" (user_id, is_draft, created_at);
+
+    CREATE TABLE IF NOT EXISTS "schema_marketplace"."catalog_layers" (
+        prdcer_ctlg_id TEXT NOT NULL
+            REFERENCES "schema_marketplace"."prdcer_catalogs" ON DELETE CASCADE,
+        layer_order INTEGER NOT NULL,
+        prdcer_lyr_id TEXT NOT NULL,
+        layer_info JSONB NOT NULL,
+        PRIMARY KEY (prdcer_ctlg_id, layer_order)
+    );
+    CREATE INDEX IF NOT EXISTS catalog_layers_lyr_id_idx
+        ON "schema_marketplace"."catalog_layers" (prdcer_lyr_id);
+
+    CREATE TABLE IF NOT EXISTS "schema_marketplace"."dataset_layers" (
+        prdcer_lyr_id TEXT PRIMARY KEY,
+        bknd_dataset_id TEXT NOT NULL,
+        records_count BIGINT
+    );
+    CREATE INDEX IF NOT EXISTS dataset_layers_dataset_id_idx
+        ON "schema_marketplace"."dataset_layers" (bknd_dataset_id);
+    """
+
+    upsert_prdcer_layer: str = """
+    INSERT INTO "schema_marketplace"."prdcer_layers" (prdcer_lyr_id, user_id, layer_data)
+    VALUES ($1, $2, $3)
+    ON CONFLICT (prdcer_lyr_id) DO UPDATE SET
+        user_id = $2,
+        layer_data = $3;
+    """
+
+    upsert_dataset_layer: str = """
+    INSERT INTO "schema_marketplace"."dataset_layers" (prdcer_lyr_id, bknd_dataset_id, records_count)
+    VALUES ($1, $2, $3)
+    ON CONFLICT (prdcer_lyr_id) DO UPDATE SET
+        bknd_dataset_id = $2,
+        records_count = $3;
+    """
+
+    upsert_prdcer_catalog: str = """
+    INSERT INTO "schema_marketplace"."prdcer_catalogs" (prdcer_ctlg_id, user_id, is_draft, catalog_data)
+    VALUES ($1, $2, $3, $4)
+    ON CONFLICT (prdcer_ctlg_id) DO UPDATE SET
+        user_id = $2,
+        is_draft = $3,
+        catalog_data = $4;
+    """
+
+    delete_catalog_layers: str = """
+    DELETE FROM "schema_marketplace"."catalog_layers" WHERE prdcer_ctlg_id = $1;
+    """
+
+    insert_catalog_layer: str = """
+    INSERT INTO "schema_marketplace"."catalog_layers" (prdcer_ctlg_id, layer_order, prdcer_lyr_id, layer_info)
+    VALUES ($1, $2, $3, $4);
+    """
+
+    load_user_prdcer_layers: str = """
+    SELECT l.prdcer_lyr_id, l.layer_data, d.bknd_dataset_id, d.records_count
+    FROM "schema_marketplace"."prdcer_layers" l
+    LEFT JOIN "schema_marketplace"."dataset_layers" d ON d.prdcer_lyr_id = l.prdcer_lyr_id
+    WHERE l.user_id = $1
+    ORDER BY l.created_at, l.prdcer_lyr_id;
+    """
+
+    load_prdcer_layers_by_ids: str = """
+    SELECT l.prdcer_lyr_id, l.layer_data, d.bknd_dataset_id, d.records_count
+    FROM "schema_marketplace"."prdcer_layers" l
+    LEFT JOIN "schema_marketplace"."dataset_layers" d ON d.prdcer_lyr_id = l.prdcer_lyr_id
+    WHERE l.prdcer_lyr_id = ANY($1::text[]);
+    """
+
+    # Catalog rows with their layer list rebuilt from catalog_layers
+    load_user_prdcer_catalogs: str = """
+    SELECT c.prdcer_ctlg_id, c.user_id, c.catalog_data,
+        COALESCE(
+            (SELECT jsonb_agg(cl.layer_info ORDER BY cl.layer_order)
+             FROM "schema_marketplace"."catalog_layers" cl
+             WHERE cl.prdcer_ctlg_id = c.prdcer_ctlg_id),
+            '[]'::jsonb
+        ) AS lyrs
+    FROM "schema_marketplace"."prdcer_catalogs" c
+    WHERE c.user_id = $1 AND c.is_draft = $2
+    ORDER BY c.created_at, c.prdcer_ctlg_id;
+    """
+
+    load_prdcer_catalog: str = """
+    SELECT c.prdcer_ctlg_id, c.user_id, c.is_draft, c.catalog_data,
+        COALESCE(
+            (SELECT jsonb_agg(cl.layer_info ORDER BY cl.layer_order)
+             FROM "schema_marketplace"."catalog_layers" cl
+             WHERE cl.prdcer_ctlg_id = c.prdcer_ctlg_id),
+            '[]'::jsonb
+        ) AS lyrs
+    FROM "schema_marketplace"."prdcer_catalogs" c
+    WHERE c.prdcer_ctlg_id = $1;
+    """
+
+    load_datasets: str = """
+    SELECT filename, response_data
+    FROM "schema_marketplace"."datasets"
+    WHERE filename = ANY($1::text[]);
+    """
+
+    # jsonb_array_elements yields the features in array order for the single
+    # matching row, so the stream needs no sort
+    stream_dataset_features: str = """
+    SELECT f.feature::text AS feature
+    FROM "schema_marketplace"."datasets" d,
+         jsonb_array_elements(d.response_data -> 'features') AS f(feature)
+    WHERE d.filename = $1;
+    """
+
+    create_dataset_features_table: str = """
+    CREATE SCHEMA IF NOT EXISTS "schema_marketplace";
+
+    CREATE TABLE IF NOT EXISTS "schema_marketplace"."dataset_features" (
+        filename TEXT NOT NULL,
+        feature_order INTEGER NOT NULL,
+        lat DOUBLE PRECISION,
+        lng DOUBLE PRECISION,
+        feature JSONB NOT NULL,
+        PRIMARY KEY (filename, feature_order)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_dataset_features_location
+    ON "schema_marketplace"."dataset_features" (filename, lat, lng);
+
+    ALTER TABLE "schema_marketplace"."datasets" ADD COLUMN IF NOT EXISTS features_indexed_at TIMESTAMP;
+    """
+
+    delete_dataset_features: str = """
+    DELETE FROM "schema_marketplace"."dataset_features" WHERE filename = $1;
+    """
+
+    index_dataset_features: str = """
+    INSERT INTO "schema_marketplace"."dataset_features"
+    (filename, feature_order, lat, lng, feature)
+    SELECT d.filename,
+           f.feature_order,
+           (f.feature #>> '{geometry,coordinates,1}')::float8,
+           (f.feature #>> '{geometry,coordinates,0}')::float8,
+           f.feature
+    FROM "schema_marketplace"."datasets" d,
+         jsonb_array_elements(d.response_data -> 'features')
+         WITH ORDINALITY AS f(feature, feature_order)
+    WHERE d.filename = $1;
+    """
+
+    mark_dataset_features_indexed: str = """
+    UPDATE "schema_marketplace"."datasets" SET features_indexed_at = $2 WHERE filename = $1;
+    """
+
+    load_dataset_features_indexed_at: str = """
+    SELECT features_indexed_at FROM "schema_marketplace"."datasets" WHERE filename = $1;
+    """
+
+    load_dataset_features_in_bbox: str = """
+    SELECT COALESCE(
+        jsonb_agg(
+            CASE WHEN $6::text[] IS NULL THEN f.feature
+            ELSE jsonb_set(
+                f.feature,
+                '{properties}',
+                COALESCE(
+                    (SELECT jsonb_object_agg(p.key, p.value)
+                     FROM jsonb_each(f.feature -> 'properties') p
+                     WHERE p.key = ANY($6::text[])),
+                    '{}'::jsonb
+                )
+            )
+            END
+            ORDER BY f.feature_order
+        ),
+        '[]'::jsonb
+    )::text AS features
+    FROM "schema_marketplace"."dataset_features" f
+    WHERE f.filename = $1
+      AND f.lat BETWEEN $2 AND $3
+      AND f.lng BETWEEN $4 AND $5;
+    """
+
+    # Same as load_datasets / stream_dataset_features, keeping only the feature
+    # properties listed in $2
+    load_datasets_projected: str = """
+    SELECT d.filename,
+           jsonb_set(
+               d.response_data,
+               '{features}',
+               COALESCE(
+                   (SELECT jsonb_agg(
+                        jsonb_set(
+                            f.feature,
+                            '{properties}',
+                            COALESCE(
+                                (SELECT jsonb_object_agg(p.key, p.value)
+                                 FROM jsonb_each(f.feature -> 'properties') p
+                                 WHERE p.key = ANY($2::text[])),
+                                '{}'::jsonb
+                            )
+                        )
+                        ORDER BY f.feature_order
+                    )
+                    FROM jsonb_array_elements(d.response_data -> 'features')
+                         WITH ORDINALITY AS f(feature, feature_order)),
+                   '[]'::jsonb
+               )
+           )::text AS response_data
+    FROM "schema_marketplace"."datasets" d
+    WHERE d.filename = ANY($1::text[]);
+    """
+
+    stream_dataset_features_projected: str = """
+    SELECT jsonb_set(
+               f.feature,
+               '{properties}',
+               COALESCE(
+                   (SELECT jsonb_object_agg(p.key, p.value)
+                    FROM jsonb_each(f.feature -> 'properties') p
+                    WHERE p.key = ANY($2::text[])),
+                   '{}'::jsonb
+               )
+           )::text AS feature
+    FROM "schema_marketplace"."datasets" d,
+         jsonb_array_elements(d.response_data -> 'features') AS f(feature)
+    WHERE d.filename = $1;
+    """
+
+    load_dataset_manifest: str = """
+    SELECT manifest
+    FROM "schema_marketplace"."datasets"
+    WHERE filename = $1;
+    """
+
+    load_dataset_manifests: str = """
+    SELECT filename, manifest
+    FROM "schema_marketplace"."datasets"
+    WHERE filename = ANY($1::text[]);
+    """
+
+    load_dataset_etags: str = """
+    SELECT filename, etag, created_at
+    FROM "schema_marketplace"."datasets"
+    WHERE filename = ANY($1::text[]);
+    """
+
+    update_dataset_manifest: str = """
+    UPDATE "schema_marketplace"."datasets" SET manifest = $2 WHERE filename = $1;
+    """
+
+    create_plan_manifests_table: str = """
+    CREATE SCHEMA IF NOT EXISTS "schema_marketplace";
+
+    CREATE TABLE IF NOT EXISTS "schema_marketplace"."plan_manifests" (
+        plan_name TEXT PRIMARY KEY,
+        pages INTEGER[] NOT NULL DEFAULT '{}',
+        manifest JSONB NOT NULL DEFAULT '{}'::jsonb,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+
+    insert_plan_manifest: str = """
+    INSERT INTO "schema_marketplace"."plan_manifests" (plan_name)
+    VALUES ($1)
+    ON CONFLICT (plan_name) DO NOTHING;
+    """
+
+    lock_plan_manifest: str = """
+    SELECT pages, manifest
+    FROM "schema_marketplace"."plan_manifests"
+    WHERE plan_name = $1
+    FOR UPDATE;
+    """
+
+    update_plan_manifest: str = """
+    UPDATE "schema_marketplace"."plan_manifests"
+    SET pages = $2, manifest = $3, updated_at = $4
+    WHERE plan_name = $1;
+    """
+
+    load_plan_manifest: str = """
+    SELECT manifest FROM "schema_marketplace"."plan_manifests" WHERE plan_name = $1;
+    """
@@ -1,27 +1,46 @@
 import logging
+import math
 import uuid
 from datetime import datetime, date
-from typing import Any, Dict, Tuple, Optional, Union, List
+from typing import Any, AsyncIterator, Dict, Tuple, Optional, Union, List
 import json
 import os
 import asyncio
 import aiofiles
+from functools import partial
 from contextlib import asynccontextmanager
 from fastapi import HTTPException, status
 from pydantic import BaseModel
-from backend_common.auth import load_user_profile
+from backend_common.auth import (
+    load_user_profile as load_stored_user_profile,
+    update_user_profile as update_stored_user_profile,
+)
 from backend_common.database import Database
 import pandas as pd
 from backend_common.dtypes.auth_dtypes import ReqUserProfile
 from sql_object import SqlObject
-from all_types.myapi_dtypes import ReqCommercial, ReqLocation, ReqFetchDataset, ReqRealEstate
+from all_types.myapi_dtypes import (
+    ReqCommercial,
+    ReqLocation,
+    ReqFetchDataset,
+    ReqRealEstate,
+    ReqCensusAggregation,
+)
 from config_factory import CONF
 from backend_common.logging_wrapper import apply_decorator_to_module
 from backend_common.auth import db
 from firebase_admin import firestore
 import asyncpg
-from backend_common.background import get_background_tasks
 import orjson
+from write_behind_queue import merge_maps, write_behind_queue
+from unit_of_work import current_unit_of_work
+from vector_tiles import TileIndex, tile_indexes
+from clustering import ClusterIndex, cluster_indexes
+from etags import content_etag
+from dataset_stats import (
+    build_dataset_manifest,
+    merge_dataset_manifests,
+)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -54,6 +73,42 @@ CENSUS_FILE_MAPPING = {
     "economic": "Backend/census_data/Final_economic_all.csv",
 }
 
+# Keywords in a requested census type that select each census table
+CENSUS_TYPE_KEYWORDS = {
+    "household": ["household", "degree"],
+    "population": ["population", "demographics"],
+    "housing": ["housing", "units"],
+    "economic": ["economic", "income"],
+}
+CENSUS_BOUNDING_BOX_QUERIES = {
+    "household": SqlObject.household_w_bounding_box,
+    "population": SqlObject.population_w_bounding_box,
+    "housing": SqlObject.housing_w_bounding_box,
+    "economic": SqlObject.economic_w_bounding_box,
+}
+CENSUS_GRID_TYPES = ["hex", "square"]
+KM_PER_DEGREE = 111.32
+# Census columns that are never aggregated
+CENSUS_NON_METRIC_COLUMNS = ["latitude", "longitude", "city", "country"]
+
+# records_count used when a dataset's features can't be counted
+UNKNOWN_RECORDS_COUNT = 9191919
+# Plan datasets loaded at the same time by load_datasets
+DATASET_LOAD_CONCURRENCY = 8
+# Features fetched per round trip when streaming a dataset from a cursor
+FEATURE_STREAM_PREFETCH = 500
+EARTH_RADIUS_M = 6371000
+# Firestore collection backend_common.auth keeps user profiles in
+USER_PROFILES_COLLECTION = "all_user_profiles"
+# Profile sections that patch_user_profile may update
+PROFILE_PATCH_SECTIONS = ["prdcer_dataset", "prdcer_lyrs", "prdcer_ctlgs", "draft_ctlgs"]
+# Row cap applied by the bounding-box queries in SqlObject
+BOUNDING_BOX_ROW_LIMIT = 20
+# "grid" spreads the capped rows over a grid laid on the bounding box
+SAMPLING_MODES = ["", "grid"]
+# Half width, in degrees, given to a grid axis whose bounds are equal
+DEGENERATE_BOX_PADDING = 1e-6
+
 os.makedirs(STORAGE_DIR, exist_ok=True)
 
 
@@ -72,6 +127,45 @@ class FileLock:
 file_lock_manager = FileLock()
 
 
+# Legacy matching documents: one "dataset_matching" and one "user_matching"
+# document holding every layer of the platform. They are only read now, as a
+# fallback for layers that have no per-layer entry yet.
+LAYER_MATCHING_COLLECTION = "layer_matchings"
+# Per-entry matching: one document per layer ({bknd_dataset_id, records_count,
+# layer_owner_id}), written with field-level merges so a save never rewrites
+# other layers.
+LAYER_ENTRIES_COLLECTION = "layer_matching_layers"
+
+
+class LayerDatasetIndex:
+    """
+    Reverse index of the legacy dataset_matching document (layer id -> dataset id),
+    only used for layers that have no per-layer entry. That document is no
+    longer written, so the index is rebuilt only when a different copy of it
+    is loaded.
+    """
+
+    def __init__(self):
+        self.source = None
+        self.layer_to_dataset: Dict[str, str] = {}
+
+    def refresh(self, dataset_layer_matching: Dict):
+        if dataset_layer_matching is self.source:
+            return
+        layer_to_dataset = {}
+        for d_id, dataset_info in dataset_layer_matching.items():
+            for lyr_id in dataset_info.get("prdcer_lyrs", []):
+                layer_to_dataset.setdefault(lyr_id, d_id)
+        self.layer_to_dataset = layer_to_dataset
+        self.source = dataset_layer_matching
+
+    def get(self, lyr_id: str) -> Optional[str]:
+        return self.layer_to_dataset.get(lyr_id)
+
+
+layer_dataset_index = LayerDatasetIndex()
+
+
 def to_serializable(obj: Any) -> Any:
     """
     Convert a Pydantic model or any other object to a JSON-serializable format.
@@ -137,13 +231,15 @@ def make_ggl_layer_filename(req: ReqFetchDataset) -> str:
     return tcc_string
 
 
-def make_dataset_filename(req) -> str:
+def make_dataset_filename(req, sampling_mode: str = "") -> str:
     cord_string = make_ggl_dataset_cord_string(req.lng, req.lat, req.radius)
     type_string = make_include_exclude_name(req.includedTypes, req.excludedTypes)
     try:
         name = f"{cord_string}_{type_string}_token={req.page_token}"
         if req.text_search != "" and req.text_search is not None:
             name = name + f"_text_search={req.text_search}_"
+        if sampling_mode:
+            name = name + f"_sampling={sampling_mode}"
         return name
     except AttributeError as e:
         raise ValueError(f"Invalid location request object: {str(e)}")
@@ -173,18 +269,58 @@ async def search_metastore_for_string(string_search: str) -> Optional[Dict]:
 
 async def fetch_dataset_id(lyr_id: str) -> Tuple[str, Dict]:
     """
-    Searches for the dataset ID associated with a given layer ID. This function
-    reads the dataset-layer matching file and iterates through it to find the
-    corresponding dataset for a given layer.
+    Searches for the dataset ID associated with a given layer ID. The per-layer
+    matching entry is used when present, otherwise the reverse index of the
+    legacy dataset-layer matching document.
     """
+    layer_entry = await load_layer_matching_entry(lyr_id)
+    if layer_entry.get("bknd_dataset_id"):
+        return layer_entry["bknd_dataset_id"], {
+            "records_count": layer_entry.get("records_count")
+        }
+
     dataset_layer_matching = await load_dataset_layer_matching()
+    layer_dataset_index.refresh(dataset_layer_matching)
 
-    for d_id, dataset_info in dataset_layer_matching.items():
-        if lyr_id in dataset_info["prdcer_lyrs"]:
-            return d_id, dataset_info
-    raise HTTPException(
-        status_code=status.HTTP_404_NOT_FOUND, detail="Dataset not found for this layer"
-    )
+    d_id = layer_dataset_index.get(lyr_id)
+    if d_id is None or d_id not in dataset_layer_matching:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Dataset not found for this layer",
+        )
+    return d_id, dataset_layer_matching[d_id]
+
+
+async def fetch_dataset_ids(lyr_ids: List[str]) -> Dict[str, Tuple[str, Dict]]:
+    """
+    Bulk version of fetch_dataset_id: loads the per-layer entries in one
+    batch read and the legacy matching document at most once, and returns
+    {layer_id: (dataset_id, dataset_info)}. Layers without a dataset are left
+    out of the result.
+    """
+    layer_entries = await load_matching_documents(LAYER_ENTRIES_COLLECTION, lyr_ids)
+
+    dataset_ids = {}
+    legacy_lyr_ids = []
+    for lyr_id, layer_entry in layer_entries.items():
+        if layer_entry.get("bknd_dataset_id"):
+            dataset_ids[lyr_id] = (
+                layer_entry["bknd_dataset_id"],
+                {"records_count": layer_entry.get("records_count")},
+            )
+        else:
+            legacy_lyr_ids.append(lyr_id)
+    if not legacy_lyr_ids:
+        return dataset_ids
+
+    dataset_layer_matching = await load_dataset_layer_matching()
+    layer_dataset_index.refresh(dataset_layer_matching)
+
+    for lyr_id in legacy_lyr_ids:
+        d_id = layer_dataset_index.get(lyr_id)
+        if d_id is not None and d_id in dataset_layer_matching:
+            dataset_ids[lyr_id] = (d_id, dataset_layer_matching[d_id])
+    return dataset_ids
 
 
 def fetch_layer_owner(prdcer_lyr_id: str) -> str:
@@ -264,85 +400,237 @@ def fetch_layer_owner(prdcer_lyr_id: str) -> str:
 #         )
 
 
-async def load_dataset_layer_matching() -> Dict:
-    """Load dataset layer matching from Firestore"""
+async def load_matching_document(collection_name: str, document_id: str) -> Dict:
+    """
+    Loads a matching document from Firestore, {} when it does not exist.
+    Within a request the document is only looked up once.
+    """
+    uow = current_unit_of_work()
+    if uow is not None and (collection_name, document_id) in uow.documents:
+        return uow.documents[(collection_name, document_id)]
     try:
-        return await db.get_document("layer_matchings", "dataset_matching")
+        document = await db.get_document(collection_name, document_id)
     except HTTPException as e:
         if e.status_code == status.HTTP_404_NOT_FOUND:
-            return {}
-        raise e
+            document = {}
+        else:
+            raise e
+    if uow is not None:
+        uow.documents[(collection_name, document_id)] = document
+    return document
 
 
-async def update_dataset_layer_matching(
-    prdcer_lyr_id: str, bknd_dataset_id: str, records_count: int = 9191919
-):
-    collection_name = "layer_matchings"
-    document_id = "dataset_matching"
-    
-    try:
-        dataset_layer_matching = await db.get_document(collection_name, document_id)
-    except HTTPException as e:
-        if e.status_code == status.HTTP_404_NOT_FOUND:
-            dataset_layer_matching = {}
+async def load_matching_documents(
+    collection_name: str, document_ids: List[str]
+) -> Dict[str, Dict]:
+    """
+    Bulk version of load_matching_document, {document_id: document}. Documents
+    not already cached are read with a single Firestore get_all; missing ones
+    map to {}.
+    """
+    uow = current_unit_of_work()
+    cache = db._cache.get(collection_name, {})
+    documents = {}
+    unread_ids = []
+    for document_id in dict.fromkeys(document_ids):
+        if uow is not None and (collection_name, document_id) in uow.documents:
+            documents[document_id] = uow.documents[(collection_name, document_id)]
+        elif document_id in cache:
+            documents[document_id] = cache[document_id]
         else:
-            raise e
+            unread_ids.append(document_id)
+
+    if unread_ids:
+        client = db.get_async_client()
+        collection = client.collection(collection_name)
+        read = {}
+        async for snapshot in client.get_all(
+            [collection.document(document_id) for document_id in unread_ids]
+        ):
+            if snapshot.exists:
+                read[snapshot.id] = snapshot.to_dict()
+        if read:
+            db._cache.setdefault(collection_name, {}).update(read)
+        for document_id in unread_ids:
+            documents[document_id] = read.get(document_id, {})
+            if uow is not None:
+                uow.documents[(collection_name, document_id)] = documents[document_id]
+    return documents
 
-    if bknd_dataset_id not in dataset_layer_matching:
-        dataset_layer_matching[bknd_dataset_id] = {
-            "records_count": records_count,
-            "prdcer_lyrs": [],
-        }
 
-    if prdcer_lyr_id not in dataset_layer_matching[bknd_dataset_id]["prdcer_lyrs"]:
-        dataset_layer_matching[bknd_dataset_id]["prdcer_lyrs"].append(prdcer_lyr_id)
+async def load_dataset_layer_matching() -> Dict:
+    """Load the legacy dataset layer matching document from Firestore"""
+    return await load_matching_document(LAYER_MATCHING_COLLECTION, "dataset_matching")
 
-    dataset_layer_matching[bknd_dataset_id]["records_count"] = records_count
 
-    # Update cache immediately
-    db._cache[collection_name][document_id] = dataset_layer_matching
-    
-    async def _background_update():
-        doc_ref = db.get_async_client().collection(collection_name).document(document_id)
-        await doc_ref.set(dataset_layer_matching)
-    
-    get_background_tasks().add_task(_background_update)
-    return dataset_layer_matching
+async def load_layer_matching_entry(lyr_id: str) -> Dict:
+    """Load the per-layer matching document, {} when the layer has none yet"""
+    return await load_matching_document(LAYER_ENTRIES_COLLECTION, lyr_id)
+
+
+async def merge_layer_matching_entry(lyr_id: str, fields: Dict) -> Dict:
+    """
+    Merges fields into the per-layer matching document; only the given
+    fields are queued for Firestore. Within a request the merge is held in
+    the unit of work and only cached and queued once the request commits.
+    """
+    layer_entry = {**(await load_layer_matching_entry(lyr_id)), **fields}
+    uow = current_unit_of_work()
+    if uow is not None:
+        uow.documents[(LAYER_ENTRIES_COLLECTION, lyr_id)] = layer_entry
+        uow.document_writes.append((LAYER_ENTRIES_COLLECTION, lyr_id, fields))
+    else:
+        queue_document_merge(LAYER_ENTRIES_COLLECTION, lyr_id, layer_entry, fields)
+    return layer_entry
+
+
+def queue_document_merge(
+    collection_name: str, document_id: str, document: Optional[Dict], fields: Dict
+):
+    """
+    Queues a merge of fields into a Firestore document. The cached copy is
+    replaced by document when given, otherwise fields are merged into it.
+    """
+    cache = db._cache.setdefault(collection_name, {})
+    if document is not None:
+        cache[document_id] = document
+    elif document_id in cache:
+        cache[document_id] = merge_maps(cache[document_id], fields)
+    write_behind_queue.enqueue(collection_name, document_id, fields)
+
+
+async def update_dataset_layer_matching(
+    prdcer_lyr_id: str, bknd_dataset_id: str, records_count: int = UNKNOWN_RECORDS_COUNT
+):
+    layer_entry = await merge_layer_matching_entry(
+        prdcer_lyr_id,
+        {"bknd_dataset_id": bknd_dataset_id, "records_count": records_count},
+    )
+    return layer_entry
+
+
+def get_write_queue_metrics() -> Dict[str, Any]:
+    return write_behind_queue.metrics()
 
 
 async def load_user_layer_matching() -> Dict:
-    """Load user layer matching from Firestore"""
-    try:
-        return await db.get_document("layer_matchings", "user_matching")
-    except HTTPException as e:
-        if e.status_code == status.HTTP_404_NOT_FOUND:
-            return {}
-        raise e
+    """Load the legacy user layer matching document from Firestore"""
+    return await load_matching_document(LAYER_MATCHING_COLLECTION, "user_matching")
+
+
+async def fetch_layer_owner_id(lyr_id: str) -> Optional[str]:
+    """
+    Returns the owner of a layer from its per-layer matching entry, falling
+    back to the legacy user matching document.
+    """
+    layer_entry = await load_layer_matching_entry(lyr_id)
+    if layer_entry.get("layer_owner_id"):
+        return layer_entry["layer_owner_id"]
+    user_layer_matching = await load_user_layer_matching()
+    return user_layer_matching.get(lyr_id)
 
 
 async def update_user_layer_matching(layer_id: str, layer_owner_id: str):
-    collection_name = "layer_matchings"
-    document_id = "user_matching"
-    
-    try:
-        user_layer_matching = await db.get_document(collection_name, document_id)
-    except HTTPException as e:
-        if e.status_code == status.HTTP_404_NOT_FOUND:
-            user_layer_matching = {}
-        else:
-            raise e
+    return await merge_layer_matching_entry(
+        layer_id, {"layer_owner_id": layer_owner_id}
+    )
 
-    user_layer_matching[layer_id] = layer_owner_id
 
-    # Update cache immediately
-    db._cache[collection_name][document_id] = user_layer_matching
-    
-    async def _background_update():
-        doc_ref = db.get_async_client().collection(collection_name).document(document_id)
-        await doc_ref.set(user_layer_matching)
-    
-    get_background_tasks().add_task(_background_update)
-    return user_layer_matching
+async def load_user_profile(user_id: str) -> Dict[str, Any]:
+    """
+    Loads a user profile. Within a request each profile is loaded once and
+    later calls get the same (possibly already modified) dict back.
+    """
+    uow = current_unit_of_work()
+    if uow is None:
+        return await load_stored_user_profile(user_id)
+    if user_id not in uow.profiles:
+        uow.profiles[user_id] = await load_stored_user_profile(user_id)
+    return uow.profiles[user_id]
+
+
+async def update_user_profile(user_id: str, user_data: Dict[str, Any]):
+    """
+    Saves a user profile. Within a request the write is deferred to
+    commit_unit_of_work so several updates of one profile become one write.
+    """
+    uow = current_unit_of_work()
+    if uow is None:
+        return await update_stored_user_profile(user_id, user_data)
+    uow.profiles[user_id] = user_data
+    uow.dirty_profiles.add(user_id)
+
+
+async def list_profile_user_ids() -> List[str]:
+    """Ids of every user with a profile in the backend_common.auth store"""
+    collection = db.get_async_client().collection(USER_PROFILES_COLLECTION)
+    return [doc_ref.id async for doc_ref in collection.list_documents()]
+
+
+async def patch_user_profile(user_id: str, section: str, key: str, value: Any):
+    """
+    Sets user_data["prdcer"][section][key] to value without loading or
+    rewriting the rest of the profile: only that entry is merged into the
+    profile document backend_common.auth stores, through the write-behind
+    queue. Within a request the merge is queued by commit_unit_of_work and
+    a profile the request already loaded gets the entry right away.
+    """
+    if section not in PROFILE_PATCH_SECTIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid profile section: {section}",
+        )
+    fields = {"prdcer": {section: {key: value}}}
+    uow = current_unit_of_work()
+    if uow is None:
+        queue_document_merge(USER_PROFILES_COLLECTION, user_id, None, fields)
+        return
+    if user_id in uow.profiles:
+        user_data = uow.profiles[user_id]
+        user_data.setdefault("prdcer", {}).setdefault(section, {})[key] = value
+    uow.document_writes.append((USER_PROFILES_COLLECTION, user_id, fields))
+
+
+async def commit_unit_of_work():
+    """
+    Writes the layer and catalog tables, the profiles and the Firestore
+    document merges (matching entries, profile patches) of the current
+    request, once it has succeeded.
+
+    The stores are written one after the other, not atomically: the tables
+    first, then the profiles, and the document merges are only queued once
+    both succeeded. A failing table write leaves nothing written; a failing
+    profile write leaves the table rows (idempotent upserts) written and
+    the merges unqueued, and the request fails.
+    """
+    uow = current_unit_of_work()
+    if uow is None or not (
+        uow.dirty_profiles or uow.relation_writes or uow.document_writes
+    ):
+        return
+    relation_writes = list(uow.relation_writes)
+    dirty_profiles = list(uow.dirty_profiles)
+    document_writes = list(uow.document_writes)
+    uow.relation_writes.clear()
+    uow.dirty_profiles.clear()
+    uow.document_writes.clear()
+    # In order, a catalog saved twice in one request keeps its last version
+    for write in relation_writes:
+        await write()
+    await asyncio.gather(
+        *(
+            update_stored_user_profile(user_id, uow.profiles[user_id])
+            for user_id in dirty_profiles
+        )
+    )
+    for collection_name, document_id, fields in document_writes:
+        queue_document_merge(
+            collection_name,
+            document_id,
+            uow.documents.get((collection_name, document_id)),
+            fields,
+        )
+
 
 async def fetch_user_layers(user_id: str) -> Dict[str, Any]:
     try:
@@ -361,6 +649,176 @@ async def fetch_user_catalogs(user_id: str) -> Dict[str, Any]:
     return user_catalogs
 
 
+async def save_prdcer_layer_relations(
+    user_id: str,
+    prdcer_lyr_id: str,
+    layer_data: Dict[str, Any],
+    records_count: int = UNKNOWN_RECORDS_COUNT,
+):
+    """
+    Writes a layer to the prdcer_layers and dataset_layers tables, next to
+    the JSON copy kept in the user profile. Within a request the write waits
+    for commit_unit_of_work, which saves the profile in the same step.
+    """
+    uow = current_unit_of_work()
+    if uow is not None:
+        uow.relation_writes.append(
+            partial(
+                write_prdcer_layer_relations,
+                user_id,
+                prdcer_lyr_id,
+                layer_data,
+                records_count,
+            )
+        )
+        return
+    await write_prdcer_layer_relations(user_id, prdcer_lyr_id, layer_data, records_count)
+
+
+async def write_prdcer_layer_relations(
+    user_id: str,
+    prdcer_lyr_id: str,
+    layer_data: Dict[str, Any],
+    records_count: int = UNKNOWN_RECORDS_COUNT,
+):
+    try:
+        async with Database.get_connection() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    SqlObject.upsert_prdcer_layer,
+                    prdcer_lyr_id,
+                    user_id,
+                    orjson.dumps(convert_to_serializable(layer_data)).decode(),
+                )
+                await conn.execute(
+                    SqlObject.upsert_dataset_layer,
+                    prdcer_lyr_id,
+                    layer_data["bknd_dataset_id"],
+                    records_count,
+                )
+    except asyncpg.exceptions.UndefinedTableError:
+        await Database.execute(SqlObject.create_prdcer_tables)
+        await write_prdcer_layer_relations(
+            user_id, prdcer_lyr_id, layer_data, records_count
+        )
+
+
+async def save_prdcer_catalog_relations(
+    user_id: str, prdcer_ctlg_id: str, catalog: Dict[str, Any], is_draft: bool = False
+):
+    """
+    Writes a catalog to prdcer_catalogs and its ordered layer list to
+    catalog_layers, next to the JSON copy kept in the user profile. Within a
+    request the write waits for commit_unit_of_work, like
+    save_prdcer_layer_relations.
+    """
+    uow = current_unit_of_work()
+    if uow is not None:
+        uow.relation_writes.append(
+            partial(write_prdcer_catalog_relations, user_id, prdcer_ctlg_id, catalog, is_draft)
+        )
+        return
+    await write_prdcer_catalog_relations(user_id, prdcer_ctlg_id, catalog, is_draft)
+
+
+async def write_prdcer_catalog_relations(
+    user_id: str, prdcer_ctlg_id: str, catalog: Dict[str, Any], is_draft: bool = False
+):
+    catalog = convert_to_serializable(catalog)
+    catalog_data = {key: value for key, value in catalog.items() if key != "lyrs"}
+    try:
+        async with Database.get_connection() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    SqlObject.upsert_prdcer_catalog,
+                    prdcer_ctlg_id,
+                    user_id,
+                    is_draft,
+                    orjson.dumps(catalog_data).decode(),
+                )
+                await conn.execute(SqlObject.delete_catalog_layers, prdcer_ctlg_id)
+                await conn.executemany(
+                    SqlObject.insert_catalog_layer,
+                    [
+                        (
+                            prdcer_ctlg_id,
+                            layer_order,
+                            lyr_info["layer_id"],
+                            orjson.dumps(lyr_info).decode(),
+                        )
+                        for layer_order, lyr_info in enumerate(catalog.get("lyrs", []))
+                    ],
+                )
+    except asyncpg.exceptions.UndefinedTableError:
+        await Database.execute(SqlObject.create_prdcer_tables)
+        await write_prdcer_catalog_relations(user_id, prdcer_ctlg_id, catalog, is_draft)
+
+
+def make_layer_relations(rows) -> Tuple[Dict[str, Dict], Dict[str, Tuple[str, Dict]]]:
+    """
+    Splits prdcer_layers/dataset_layers rows into {layer_id: layer_data} and
+    {layer_id: (dataset_id, dataset_info)}, the shapes of the profile JSON and
+    fetch_dataset_ids.
+    """
+    layers, dataset_ids = {}, {}
+    for row in rows:
+        layers[row["prdcer_lyr_id"]] = orjson.loads(row["layer_data"])
+        if row["bknd_dataset_id"] is not None:
+            dataset_ids[row["prdcer_lyr_id"]] = (
+                row["bknd_dataset_id"],
+                {"records_count": row["records_count"]},
+            )
+    return layers, dataset_ids
+
+
+async def load_normalized_user_layers(
+    user_id: str,
+) -> Tuple[Dict[str, Dict], Dict[str, Tuple[str, Dict]]]:
+    """Loads a user's layers from the prdcer_layers table, empty if there are none"""
+    try:
+        rows = await Database.fetch(SqlObject.load_user_prdcer_layers, user_id)
+    except asyncpg.exceptions.UndefinedTableError:
+        return {}, {}
+    return make_layer_relations(rows)
+
+
+async def load_normalized_layers(
+    lyr_ids: List[str],
+) -> Tuple[Dict[str, Dict], Dict[str, Tuple[str, Dict]]]:
+    """Loads the given layers from the prdcer_layers table, missing ones are left out"""
+    try:
+        rows = await Database.fetch(SqlObject.load_prdcer_layers_by_ids, lyr_ids)
+    except asyncpg.exceptions.UndefinedTableError:
+        return {}, {}
+    return make_layer_relations(rows)
+
+
+def make_catalog(row) -> Dict[str, Any]:
+    return {**orjson.loads(row["catalog_data"]), "lyrs": orjson.loads(row["lyrs"])}
+
+
+async def load_normalized_user_catalogs(
+    user_id: str, is_draft: bool = False
+) -> Dict[str, Dict]:
+    """Loads a user's catalogs from the prdcer_catalogs table, {} if there are none"""
+    try:
+        rows = await Database.fetch(SqlObject.load_user_prdcer_catalogs, user_id, is_draft)
+    except asyncpg.exceptions.UndefinedTableError:
+        return {}
+    return {row["prdcer_ctlg_id"]: make_catalog(row) for row in rows}
+
+
+async def load_normalized_catalog(prdcer_ctlg_id: str, user_id: str) -> Dict[str, Any]:
+    """Loads one of the user's published catalogs from the prdcer_catalogs table, {} if not found"""
+    try:
+        row = await Database.fetchrow(SqlObject.load_prdcer_catalog, prdcer_ctlg_id)
+    except asyncpg.exceptions.UndefinedTableError:
+        return {}
+    if row is None or row["user_id"] != user_id or row["is_draft"]:
+        return {}
+    return make_catalog(row)
+
+
 # def create_new_user(user_id: str, username: str, email: str) -> None:
 #     user_file_path = os.path.join(USERS_PATH, f"user_{user_id}.json")
 
@@ -618,24 +1076,39 @@ async def store_data_resp(req: ReqLocation, dataset: Dict, file_name:str) -> str
     Returns:
         str: Filename/ID used as the primary key
     """
+    # Convert request object to dictionary using Pydantic's model_dump
+    req_dict = req.model_dump()
+    manifest = build_dataset_manifest(dataset)
+    dataset_json = json.dumps(dataset)
+    store_args = (
+        file_name,
+        json.dumps(req_dict),
+        dataset_json,
+        datetime.utcnow(),
+        json.dumps(manifest),
+        content_etag(dataset_json.encode()),
+    )
+
     try:
-        # Convert request object to dictionary using Pydantic's model_dump
-        req_dict = req.model_dump()
-
-        await Database.execute(
-            SqlObject.store_dataset,
-            file_name,
-            json.dumps(req_dict),
-            json.dumps(dataset),
-            datetime.utcnow(),
-        )
+        await Database.execute(SqlObject.store_dataset, *store_args)
+    except (
+        asyncpg.exceptions.UndefinedTableError,
+        asyncpg.exceptions.UndefinedColumnError,
+    ):
+        # If the table or its manifest column doesn't exist, create it and retry once
+        await Database.execute(SqlObject.create_datasets_table)
+        await Database.execute(SqlObject.store_dataset, *store_args)
 
-        return file_name
+    await merge_plan_page_manifest(file_name, manifest)
+    # Tiles cut from the previous version of this dataset are stale
+    tile_indexes.pop(file_name)
+    cluster_indexes.pop(file_name)
+    # Outside the try above: an indexing failure must not recreate the
+    # datasets table and store the dataset again
+    if "plan" not in file_name:
+        await index_dataset_features(file_name)
 
-    except asyncpg.exceptions.UndefinedTableError:
-        # If table doesn't exist, create it and retry
-        await Database.execute(SqlObject.create_datasets_table)
-        return await store_data_resp(req, dataset, file_name)
+    return file_name
 
 
 # async def get_dataset_from_storage(
@@ -653,10 +1126,13 @@ async def store_data_resp(req: ReqLocation, dataset: Dict, file_name:str) -> str
 #     return None, None
 
 
-async def load_dataset(dataset_id: str) -> Dict:
+async def load_dataset(dataset_id: str, fields: Optional[List[str]] = None) -> Dict:
     """
-    Loads a dataset from file based on its ID.
+    Loads a dataset from file based on its ID. With fields, features keep
+    only those properties (see load_datasets).
     """
+    if fields is not None:
+        return (await load_datasets([dataset_id], fields))[dataset_id]
     # if the dataset_id contains the word plan '21.57445341427591_39.1728_2000.0_mosque__plan_mosque_Saudi Arabia_Jeddah@#$9'
     # isolate the plan's name from the dataset_id = mosque__plan_mosque_Saudi Arabia_Jeddah
     # load the plan's json file
@@ -704,6 +1180,487 @@ async def load_dataset(dataset_id: str) -> Dict:
     return all_datasets
 
 
+async def load_datasets(
+    dataset_ids: List[str], fields: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    Loads several datasets at once and returns {dataset_id: dataset}. Stored
+    datasets come back in a single ANY($1) query; plan datasets go through
+    load_dataset concurrently, at most DATASET_LOAD_CONCURRENCY at a time.
+    Datasets that do not exist map to None, like in load_dataset.
+    With fields, features keep only those properties; for stored datasets
+    the projection happens in Postgres so other properties are never sent
+    or decoded.
+    """
+    unique_ids = list(dict.fromkeys(dataset_ids))
+    plan_ids = [dataset_id for dataset_id in unique_ids if "plan" in dataset_id]
+    stored_ids = [dataset_id for dataset_id in unique_ids if "plan" not in dataset_id]
+
+    datasets = {}
+    if stored_ids:
+        try:
+            if fields is None:
+                rows = await Database.fetch(SqlObject.load_datasets, stored_ids)
+            else:
+                rows = await Database.fetch(
+                    SqlObject.load_datasets_projected, stored_ids, fields
+                )
+        except asyncpg.exceptions.UndefinedTableError:
+            await Database.execute(SqlObject.create_datasets_table)
+            rows = []
+        response_data = {row["filename"]: row["response_data"] for row in rows}
+        for dataset_id in stored_ids:
+            raw_dataset = response_data.get(dataset_id)
+            datasets[dataset_id] = orjson.loads(raw_dataset) if raw_dataset else None
+
+    if plan_ids:
+        semaphore = asyncio.Semaphore(DATASET_LOAD_CONCURRENCY)
+
+        async def load_with_limit(dataset_id: str):
+            async with semaphore:
+                return await load_dataset(dataset_id)
+
+        plan_datasets = await asyncio.gather(
+            *(load_with_limit(dataset_id) for dataset_id in plan_ids)
+        )
+        if fields is not None:
+            plan_datasets = [
+                {**dataset, "features": project_feature_properties(dataset["features"], fields)}
+                if dataset
+                else dataset
+                for dataset in plan_datasets
+            ]
+        datasets.update(zip(plan_ids, plan_datasets))
+    return datasets
+
+
+async def load_dataset_tile_index(dataset_id: str) -> TileIndex:
+    """
+    The vector tile index of a dataset, built on first use in a worker
+    thread and kept in an LRU cache until the dataset is stored again.
+    """
+    index = tile_indexes.get(dataset_id)
+    if index is None:
+        dataset = await load_dataset(dataset_id)
+        if not dataset:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Dataset not found"
+            )
+        index = await asyncio.to_thread(TileIndex, dataset.get("features", []))
+        tile_indexes.put(dataset_id, index)
+    return index
+
+
+async def load_dataset_cluster_index(dataset_id: str) -> ClusterIndex:
+    """
+    The point clustering index of a dataset, built on first use in a worker
+    thread and kept in an LRU cache until the dataset is stored again.
+    """
+    index = cluster_indexes.get(dataset_id)
+    if index is None:
+        dataset = await load_dataset(dataset_id)
+        if not dataset:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Dataset not found"
+            )
+        index = await asyncio.to_thread(ClusterIndex, dataset.get("features", []))
+        cluster_indexes.put(dataset_id, index)
+    return index
+
+
+def project_feature_properties(
+    features: List[Dict], fields: Optional[List[str]]
+) -> List[Dict]:
+    """Copies of the features keeping only the properties in fields, all when None"""
+    if fields is None:
+        return features
+    return [
+        {
+            **feature,
+            "properties": {
+                key: value
+                for key, value in (feature.get("properties") or {}).items()
+                if key in fields
+            },
+        }
+        for feature in features
+    ]
+
+
+def features_in_bounding_box(
+    features: List[Dict], bounding_box: List[float]
+) -> List[Dict]:
+    """Features whose point lies in [lat_min, lat_max, lng_min, lng_max], edges included"""
+    lat_min, lat_max, lng_min, lng_max = bounding_box
+    return [
+        feature
+        for feature in features
+        if lat_min <= feature["geometry"]["coordinates"][1] <= lat_max
+        and lng_min <= feature["geometry"]["coordinates"][0] <= lng_max
+    ]
+
+
+def distance_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Haversine distance in meters"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def radius_bounding_box(lat: float, lng: float, radius: float) -> List[float]:
+    """[lat_min, lat_max, lng_min, lng_max] enclosing radius meters around a point"""
+    lat_delta = radius / (KM_PER_DEGREE * 1000)
+    lng_delta = lat_delta / max(math.cos(math.radians(lat)), 1e-6)
+    return [lat - lat_delta, lat + lat_delta, lng - lng_delta, lng + lng_delta]
+
+
+async def write_dataset_features_index(dataset_id: str):
+    async with Database.get_connection() as conn:
+        async with conn.transaction():
+            await conn.execute(SqlObject.delete_dataset_features, dataset_id)
+            await conn.execute(SqlObject.index_dataset_features, dataset_id)
+            await conn.execute(
+                SqlObject.mark_dataset_features_indexed, dataset_id, datetime.utcnow()
+            )
+
+
+async def index_dataset_features(dataset_id: str):
+    """
+    Copies the features of a stored dataset into dataset_features, one row per
+    feature with its lat/lng, replacing rows of a previous version. A missing
+    table or column is created and the copy retried once; a second failure
+    is raised.
+    """
+    try:
+        await write_dataset_features_index(dataset_id)
+    except (
+        asyncpg.exceptions.UndefinedTableError,
+        asyncpg.exceptions.UndefinedColumnError,
+    ):
+        await Database.execute(SqlObject.create_dataset_features_table)
+        await write_dataset_features_index(dataset_id)
+
+
+async def load_indexed_features_in_bbox(
+    dataset_id: str, bounding_box: List[float], fields: Optional[List[str]]
+) -> List[Dict]:
+    lat_min, lat_max, lng_min, lng_max = bounding_box
+    row = await Database.fetchrow(
+        SqlObject.load_dataset_features_in_bbox,
+        dataset_id,
+        lat_min,
+        lat_max,
+        lng_min,
+        lng_max,
+        fields,
+    )
+    return orjson.loads(row["features"])
+
+
+async def load_dataset_features_in_area(
+    dataset_id: str,
+    bounding_box: Optional[List[float]] = None,
+    center: Optional[Tuple[float, float]] = None,
+    radius: Optional[float] = None,
+    fields: Optional[List[str]] = None,
+) -> List[Dict]:
+    """
+    Features of a dataset inside bounding_box ([lat_min, lat_max, lng_min,
+    lng_max]) or within radius meters of center (lat, lng), keeping only the
+    properties in fields when given. Stored datasets are answered from the
+    (filename, lat, lng) index of dataset_features and indexed on first
+    use; plan datasets are filtered after a full load.
+    """
+    if center is not None:
+        bounding_box = radius_bounding_box(center[0], center[1], radius)
+
+    if "plan" in dataset_id:
+        dataset = await load_dataset(dataset_id, fields) or {}
+        features = features_in_bounding_box(dataset.get("features", []), bounding_box)
+    else:
+        try:
+            features = await load_indexed_features_in_bbox(dataset_id, bounding_box, fields)
+        except asyncpg.exceptions.UndefinedTableError:
+            features = []
+        if not features:
+            # Datasets stored before dataset_features existed are indexed now
+            try:
+                row = await Database.fetchrow(
+                    SqlObject.load_dataset_features_indexed_at, dataset_id
+                )
+            except asyncpg.exceptions.UndefinedTableError:
+                # No datasets table means no stored dataset
+                row = None
+            except asyncpg.exceptions.UndefinedColumnError:
+                await Database.execute(SqlObject.create_dataset_features_table)
+                row = await Database.fetchrow(
+                    SqlObject.load_dataset_features_indexed_at, dataset_id
+                )
+            if row is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND, detail="Dataset not found"
+                )
+            if row["features_indexed_at"] is None:
+                await index_dataset_features(dataset_id)
+                features = await load_indexed_features_in_bbox(
+                    dataset_id, bounding_box, fields
+                )
+
+    if center is not None:
+        features = [
+            feature
+            for feature in features
+            if distance_m(
+                center[0],
+                center[1],
+                feature["geometry"]["coordinates"][1],
+                feature["geometry"]["coordinates"][0],
+            )
+            <= radius
+        ]
+    return features
+
+
+def stream_dataset_features(
+    dataset_id: str, fields: Optional[List[str]] = None
+) -> AsyncIterator[bytes]:
+    """
+    Yields the features of a dataset one by one as JSON bytes, keeping only
+    the properties in fields when given. Stored datasets are read through a
+    server-side cursor so the whole FeatureCollection is never held in
+    memory; plan datasets are concatenated from pages and go through
+    load_dataset.
+    """
+
+    async def plan_features():
+        dataset = await load_dataset(dataset_id, fields)
+        for feature in (dataset or {}).get("features", []):
+            yield orjson.dumps(feature)
+
+    async def stored_features():
+        if fields is None:
+            query_args = (SqlObject.stream_dataset_features, dataset_id)
+        else:
+            query_args = (SqlObject.stream_dataset_features_projected, dataset_id, fields)
+        async with Database.get_connection() as conn:
+            async with conn.transaction():
+                async for record in conn.cursor(
+                    *query_args, prefetch=FEATURE_STREAM_PREFETCH
+                ):
+                    yield record["feature"].encode()
+
+    if "plan" in dataset_id:
+        return plan_features()
+    return stored_features()
+
+
+def parse_plan_dataset_id(dataset_id: str) -> Optional[Tuple[str, int]]:
+    """
+    Splits a plan dataset id ("...page_token=<plan_name>@#$<page>") into the
+    plan name and page number, like load_dataset does. None for other ids.
+    """
+    try:
+        plan_part, page_number = dataset_id.split("@#$")
+        _, plan_name = plan_part.split("page_token=")
+        return plan_name, int(page_number)
+    except ValueError:
+        return None
+
+
+async def merge_plan_page_manifest(dataset_id: str, manifest: Dict):
+    """
+    Folds the manifest of a newly stored plan page into the plan's running
+    manifest, so plan-wide counts and numeric ranges grow page by page.
+    A page is only counted once.
+    """
+    parsed = parse_plan_dataset_id(dataset_id)
+    if parsed is None:
+        return
+    plan_name, page_number = parsed
+    try:
+        async with Database.get_connection() as conn:
+            async with conn.transaction():
+                await conn.execute(SqlObject.insert_plan_manifest, plan_name)
+                row = await conn.fetchrow(SqlObject.lock_plan_manifest, plan_name)
+                if page_number in row["pages"]:
+                    return
+                merged = merge_dataset_manifests(orjson.loads(row["manifest"]), manifest)
+                await conn.execute(
+                    SqlObject.update_plan_manifest,
+                    plan_name,
+                    list(row["pages"]) + [page_number],
+                    json.dumps(merged),
+                    datetime.utcnow(),
+                )
+    except asyncpg.exceptions.UndefinedTableError:
+        await Database.execute(SqlObject.create_plan_manifests_table)
+        await merge_plan_page_manifest(dataset_id, manifest)
+
+
+async def load_plan_manifest(dataset_id: str) -> Dict:
+    """Loads the running manifest of the plan a dataset id points at, {} if none"""
+    parsed = parse_plan_dataset_id(dataset_id)
+    if parsed is None:
+        return {}
+    try:
+        row = await Database.fetchrow(SqlObject.load_plan_manifest, parsed[0])
+    except asyncpg.exceptions.UndefinedTableError:
+        return {}
+    if row is None:
+        return {}
+    return orjson.loads(row["manifest"])
+
+
+async def load_dataset_manifest(dataset_id: str) -> Dict:
+    """
+    Loads the manifest stored next to a dataset (see dataset_stats). Datasets
+    stored before manifests existed get one computed and saved on first
+    read. Plan datasets get the plan's running manifest.
+    """
+    if "plan" in dataset_id:
+        return await load_plan_manifest(dataset_id)
+    try:
+        row = await Database.fetchrow(SqlObject.load_dataset_manifest, dataset_id)
+    except (
+        asyncpg.exceptions.UndefinedTableError,
+        asyncpg.exceptions.UndefinedColumnError,
+    ):
+        await Database.execute(SqlObject.create_datasets_table)
+        row = await Database.fetchrow(SqlObject.load_dataset_manifest, dataset_id)
+    if row is None:
+        return {}
+    if row["manifest"] is not None:
+        return orjson.loads(row["manifest"])
+
+    dataset = await load_dataset(dataset_id)
+    if not dataset:
+        return {}
+    manifest = build_dataset_manifest(dataset)
+    await Database.execute(
+        SqlObject.update_dataset_manifest, dataset_id, json.dumps(manifest)
+    )
+    return manifest
+
+
+async def load_dataset_manifests(dataset_ids: List[str]) -> Dict[str, Dict]:
+    """Bulk version of load_dataset_manifest, {dataset_id: manifest}"""
+    unique_ids = list(dict.fromkeys(dataset_ids))
+    plan_ids = [dataset_id for dataset_id in unique_ids if "plan" in dataset_id]
+    stored_ids = [dataset_id for dataset_id in unique_ids if "plan" not in dataset_id]
+    manifests = {dataset_id: {} for dataset_id in unique_ids}
+    if plan_ids:
+        plan_manifests = await asyncio.gather(
+            *(load_plan_manifest(dataset_id) for dataset_id in plan_ids)
+        )
+        manifests.update(zip(plan_ids, plan_manifests))
+    if not stored_ids:
+        return manifests
+    try:
+        rows = await Database.fetch(SqlObject.load_dataset_manifests, stored_ids)
+    except (
+        asyncpg.exceptions.UndefinedTableError,
+        asyncpg.exceptions.UndefinedColumnError,
+    ):
+        await Database.execute(SqlObject.create_datasets_table)
+        rows = await Database.fetch(SqlObject.load_dataset_manifests, stored_ids)
+
+    missing_ids = []
+    for row in rows:
+        if row["manifest"] is not None:
+            manifests[row["filename"]] = orjson.loads(row["manifest"])
+        else:
+            missing_ids.append(row["filename"])
+    if missing_ids:
+        backfilled = await asyncio.gather(
+            *(load_dataset_manifest(dataset_id) for dataset_id in missing_ids)
+        )
+        manifests.update(zip(missing_ids, backfilled))
+    return manifests
+
+
+async def load_dataset_etags(dataset_ids: List[str]) -> Dict[str, str]:
+    """
+    {dataset_id: etag} of stored datasets, without loading them. Rows stored
+    before etags existed get one from their created_at, which also changes
+    on every store. Unknown datasets are left out.
+    """
+    unique_ids = list(dict.fromkeys(dataset_ids))
+    try:
+        rows = await Database.fetch(SqlObject.load_dataset_etags, unique_ids)
+    except (
+        asyncpg.exceptions.UndefinedTableError,
+        asyncpg.exceptions.UndefinedColumnError,
+    ):
+        await Database.execute(SqlObject.create_datasets_table)
+        rows = await Database.fetch(SqlObject.load_dataset_etags, unique_ids)
+    return {
+        row["filename"]: row["etag"] or content_etag(row["filename"], row["created_at"])
+        for row in rows
+    }
+
+
+async def fetch_dataset_records_count(dataset_id: str) -> int:
+    """
+    Number of features in a dataset, from its manifest when there is one.
+    Falls back to UNKNOWN_RECORDS_COUNT when the dataset can't be read.
+    """
+    manifest = await load_dataset_manifest(dataset_id)
+    if "records_count" in manifest:
+        return manifest["records_count"]
+    try:
+        dataset = await load_dataset(dataset_id)
+    except Exception as e:
+        logger.warning(f"Could not count the features of {dataset_id}: {e}")
+        return UNKNOWN_RECORDS_COUNT
+    if not dataset:
+        return UNKNOWN_RECORDS_COUNT
+    return len(dataset.get("features", []))
+
+
+def fetch_census_table_name(data_type: str) -> str:
+    """
+    Returns the census table in schema_marketplace that holds the requested census type.
+    """
+    for census_table, keywords in CENSUS_TYPE_KEYWORDS.items():
+        if any(keyword in data_type for keyword in keywords):
+            return census_table
+    raise HTTPException(status_code=404, detail="Invalid census data type requested")
+
+
+def fetch_sampling_grid_size(row_limit: int = BOUNDING_BOX_ROW_LIMIT) -> int:
+    """
+    Returns the number of cells per side of the sampling grid, so that a capped
+    result has roughly one row per cell.
+    """
+    return math.ceil(math.sqrt(row_limit))
+
+
+def make_bounding_box_query_args(bounding_box: list[float], sampling_mode: str) -> list:
+    """
+    Builds the positional arguments that follow the bounding box in the
+    bounding-box queries. Stratified queries also take the grid size and the row cap.
+    """
+    sampling_mode = sampling_mode or ""
+    if sampling_mode not in SAMPLING_MODES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid sampling mode: {sampling_mode}",
+        )
+    query_args = list(bounding_box)
+    if sampling_mode == "grid":
+        # width_bucket raises on equal bounds, so a box collapsed to a line or
+        # a point (a single-point city box) is widened along that axis
+        for low, high in ((0, 1), (2, 3)):
+            if query_args[low] == query_args[high]:
+                query_args[low] -= DEGENERATE_BOX_PADDING
+                query_args[high] += DEGENERATE_BOX_PADDING
+        query_args.extend([fetch_sampling_grid_size(), BOUNDING_BOX_ROW_LIMIT])
+    return query_args
+
+
 async def get_census_dataset_from_storage(
     req: ReqRealEstate, filename: str, action: str, request_location: ReqLocation
 ) -> tuple[dict, str]:
@@ -712,29 +1669,20 @@ async def get_census_dataset_from_storage(
     Returns data in GeoJSON format for consistency with other dataset types.
     """
 
-    # Determine which CSV file to use based on included types
+    # Determine which census table to use based on included types
     data_type = req.includedTypes[0]  # Using first type for now
-    csv_file = None
-
-    if any(type in data_type for type in ["household", "degree"]):
-        csv_file = CENSUS_FILE_MAPPING["household"]
-        query = SqlObject.household_w_bounding_box
-    elif any(type in data_type for type in ["population", "demographics"]):
-        csv_file = CENSUS_FILE_MAPPING["population"]
-        query = SqlObject.population_w_bounding_box
-    elif any(type in data_type for type in ["housing", "units"]):
-        csv_file = CENSUS_FILE_MAPPING["housing"]
-        query = SqlObject.housing_w_bounding_box
-    elif any(type in data_type for type in ["economic", "income"]):
-        csv_file = CENSUS_FILE_MAPPING["economic"]
-        query = SqlObject.economic_w_bounding_box
-
-    if not csv_file:
-        raise HTTPException(
-            status_code=404, detail="Invalid census data type requested"
+    census_table = fetch_census_table_name(data_type)
+    query = CENSUS_BOUNDING_BOX_QUERIES[census_table]
+
+    if req.sampling_mode == "grid":
+        query = SqlObject.census_stratified_w_bounding_box.format(
+            table_name=census_table
         )
+    query_args = make_bounding_box_query_args(
+        request_location.bounding_box, req.sampling_mode
+    )
 
-    city_data = await Database.fetch(query, *request_location.bounding_box)
+    city_data = await Database.fetch(query, *query_args)
     city_df = pd.DataFrame([dict(record) for record in city_data])
 
     if city_df.empty:
@@ -752,6 +1700,8 @@ async def get_census_dataset_from_storage(
         columns_to_drop = ["latitude", "longitude", "city"]
         if "country" in row:
             columns_to_drop.append("country")
+        if "cell_rank" in row:
+            columns_to_drop.append("cell_rank")
         properties = row.drop(columns_to_drop).to_dict()
 
         feature = {
@@ -771,6 +1721,114 @@ async def get_census_dataset_from_storage(
     return geojson_data, filename
 
 
+def make_census_aggregate_expressions(columns: list) -> tuple[str, list[str]]:
+    """
+    Builds the SUM/AVG select list for the census grid aggregation queries.
+    Text columns are aggregated only where they hold numbers, so mixed columns
+    do not abort the query.
+    """
+    expressions = []
+    metric_names = []
+    for column in columns:
+        column_name = column["column_name"]
+        if column_name in CENSUS_NON_METRIC_COLUMNS:
+            continue
+        quoted_name = '"' + column_name.replace('"', '""') + '"'
+        if column["data_type"] in ("text", "character varying"):
+            value = (
+                f"CASE WHEN {quoted_name} ~ '^\\s*-?[0-9]+(\\.[0-9]+)?\\s*$' "
+                f"THEN {quoted_name}::numeric END"
+            )
+        else:
+            value = quoted_name
+        index = len(metric_names)
+        expressions.append(f"sum({value})::float8 AS sum_{index}")
+        expressions.append(f"avg({value})::float8 AS mean_{index}")
+        metric_names.append(column_name)
+
+    aggregates = "".join(f",\n            {expression}" for expression in expressions)
+    return aggregates, metric_names
+
+
+async def get_census_aggregation_from_storage(
+    req: ReqCensusAggregation, request_location: ReqLocation
+) -> dict:
+    """
+    Bins the census rows inside the request bounding box into a hex or square
+    grid in Postgres and returns one point feature per cell, placed at the cell
+    centre, with the row count and the sum and mean of every numeric column.
+    """
+    if req.grid_type not in CENSUS_GRID_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid grid type: {req.grid_type}",
+        )
+    if req.cell_size_km <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="cell_size_km must be positive",
+        )
+
+    census_table = fetch_census_table_name(req.includedTypes[0])
+    columns = await Database.fetch(SqlObject.census_aggregation_columns, census_table)
+    aggregates, metric_names = make_census_aggregate_expressions(columns)
+
+    if req.grid_type == "hex":
+        query = SqlObject.census_hex_aggregation_w_bounding_box
+    else:
+        query = SqlObject.census_square_aggregation_w_bounding_box
+    query = query.format(table_name=census_table, aggregates=aggregates)
+
+    # Longitudes are scaled by cos(latitude) so that cells are not stretched east-west
+    lat_min, lat_max = request_location.bounding_box[0], request_location.bounding_box[1]
+    lng_scale = math.cos(math.radians((lat_min + lat_max) / 2))
+    cell_size_deg = req.cell_size_km / KM_PER_DEGREE
+
+    cells = await Database.fetch(
+        query, *request_location.bounding_box, lng_scale, cell_size_deg
+    )
+    if not cells:
+        raise HTTPException(
+            status_code=404, detail=f"No data found for {req.city_name}"
+        )
+
+    features = []
+    for cell in cells:
+        properties = {
+            "cell_id": f"{int(cell['cell_col'])}_{int(cell['cell_row'])}",
+            "point_count": cell["point_count"],
+        }
+        for index, metric_name in enumerate(metric_names):
+            properties[f"{metric_name}_sum"] = cell[f"sum_{index}"]
+            properties[f"{metric_name}_mean"] = cell[f"mean_{index}"]
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [float(cell["longitude"]), float(cell["latitude"])],
+                },
+                "properties": properties,
+            }
+        )
+
+    # Drop metrics that had no numeric value in any cell (e.g. label columns)
+    empty_properties = [
+        key
+        for key in features[0]["properties"]
+        if all(feature["properties"][key] is None for feature in features)
+    ]
+    for feature in features:
+        for key in empty_properties:
+            del feature["properties"][key]
+
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "properties": list(features[0]["properties"].keys()),
+    }
+
+
 async def get_commercial_properties_dataset_from_storage(
     req: ReqCommercial, filename: str, action: str, request_location: ReqLocation
 ) -> tuple[dict, str]:
@@ -780,8 +1838,13 @@ async def get_commercial_properties_dataset_from_storage(
     """
     data_type = req.includedTypes[0]
     query = SqlObject.canada_commercial_w_bounding_box_and_property_type
+    if req.sampling_mode == "grid":
+        query = SqlObject.canada_commercial_stratified_w_bounding_box_and_property_type
+    query_args = make_bounding_box_query_args(
+        request_location.bounding_box, req.sampling_mode
+    )
 
-    city_data = await Database.fetch(query, data_type.replace("_", " "), *request_location.bounding_box)
+    city_data = await Database.fetch(query, data_type.replace("_", " "), *query_args)
     city_df = pd.DataFrame([dict(record) for record in city_data])
 
     if city_df.empty:
@@ -831,8 +1894,13 @@ async def get_real_estate_dataset_from_storage(
 
     data_type = req.includedTypes[0]
     query = SqlObject.saudi_real_estate_w_bounding_box_and_category
+    if req.sampling_mode == "grid":
+        query = SqlObject.saudi_real_estate_stratified_w_bounding_box_and_category
+    query_args = make_bounding_box_query_args(
+        request_location.bounding_box, req.sampling_mode
+    )
 
-    city_data = await Database.fetch(query, data_type, *request_location.bounding_box)
+    city_data = await Database.fetch(query, data_type, *query_args)
     city_df = pd.DataFrame([dict(record) for record in city_data])
 
     if city_df.empty:
@@ -0,0 +1,47 @@
+import random
+
+from clustering import MAX_CLUSTER_ZOOM, ClusterIndex
+
+
+def make_features(count, seed=7):
+    rng = random.Random(seed)
+    return [
+        {
+            "type": "Feature",
+            "properties": {"name": f"Place {i}", "rating": rng.uniform(1, 5)},
+            "geometry": {"type": "Point", "coordinates": [46.5 + rng.random() * 0.5, 24.5 + rng.random() * 0.5]},
+        }
+        for i in range(count)
+    ]
+
+
+def represented_points(features):
+    return sum(
+        feature["properties"]["point_count"] if feature["properties"].get("cluster") is True else 1
+        for feature in features
+    )
+
+
+def test_clusters_keep_every_point_and_shrink_with_zoom():
+    features = make_features(2000)
+    index = ClusterIndex(features)
+    bounding_box = [24.4, 25.1, 46.4, 47.1]
+
+    counts = []
+    for zoom in (4, 8, 12, MAX_CLUSTER_ZOOM + 1):
+        visible = index.get_clusters(bounding_box, zoom)
+        assert represented_points(visible) == len(features)
+        counts.append(len(visible))
+    assert counts == sorted(counts)
+    assert counts[-1] == len(features)
+
+    (cluster,) = index.get_clusters(bounding_box, 4)
+    ratings = [feature["properties"]["rating"] for feature in features]
+    aggregate = cluster["properties"]["aggregates"]["rating"]
+    assert abs(aggregate["mean"] - sum(ratings) / len(ratings)) < 1e-9
+    assert aggregate["min"] == min(ratings) and aggregate["max"] == max(ratings)
+
+
+def test_clusters_outside_bounding_box_are_left_out():
+    index = ClusterIndex(make_features(200))
+    assert index.get_clusters([40.0, 41.0, -75.0, -73.0], 10) == []
@@ -0,0 +1,101 @@
+import asyncio
+import gzip
+import zlib
+
+from compression import (
+    CACHE_COMPRESSED_HEADER,
+    CompressedBodyCache,
+    STREAM_FLUSH_SIZE,
+    CompressionMiddleware,
+    choose_encoding,
+    compress_json_envelope,
+)
+
+
+def make_app(chunks, content_type=b"application/json", extra_headers=()):
+    async def app(scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", content_type), (b"vary", b"Origin"), *extra_headers],
+            }
+        )
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+
+    return app
+
+
+def call(app, accept_encoding):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    asyncio.run(app(scope, None, send))
+    headers = dict(messages[0]["headers"])
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return headers, body
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, deflate", ["br", "gzip"]) == "gzip"
+    assert choose_encoding("br;q=0.5, gzip;q=0", ["br", "gzip"]) == "br"
+    assert choose_encoding("identity", ["br", "gzip"]) is None
+    assert choose_encoding("*", ["zstd", "gzip"]) == "zstd"
+
+
+def test_whole_body_is_compressed_and_cached():
+    body = b'{"features": [' + b'{"type": "Feature"},' * 500 + b"{}]}"
+    cache = CompressedBodyCache()
+    app = CompressionMiddleware(
+        make_app([body], extra_headers=[(CACHE_COMPRESSED_HEADER, b"1")]), cache=cache
+    )
+
+    for _ in range(2):
+        headers, compressed = call(app, "gzip")
+        assert headers[b"content-encoding"] == b"gzip"
+        assert headers[b"vary"] == b"Origin, Accept-Encoding"
+        assert CACHE_COMPRESSED_HEADER not in headers
+        assert gzip.decompress(compressed) == body
+    assert (cache.misses, cache.hits) == (1, 1)
+
+
+def test_small_or_binary_bodies_are_left_alone():
+    headers, body = call(CompressionMiddleware(make_app([b"{}"])), "gzip")
+    assert b"content-encoding" not in headers and body == b"{}"
+    headers, body = call(CompressionMiddleware(make_app([b"\0" * 5000], b"image/png")), "gzip")
+    assert b"content-encoding" not in headers
+
+
+def test_streamed_body_is_gzipped_chunk_by_chunk():
+    chunks = [b'{"a": [', b"1," * 2000, b"2]}"]
+    headers, body = call(CompressionMiddleware(make_app(chunks)), "gzip, br")
+    assert headers[b"content-encoding"] == b"gzip"
+    assert zlib.decompress(body, 31) == b"".join(chunks)
+
+
+def test_small_streamed_chunks_are_flushed_together():
+    chunks = [b'{"id": %d},' % i for i in range(20000)] + [b"{}"]
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(CompressionMiddleware(make_app(chunks))(scope, None, send))
+    bodies = [message["body"] for message in messages[1:]]
+    assert len(bodies) <= len(b"".join(chunks)) // STREAM_FLUSH_SIZE + 2
+    assert zlib.decompress(b"".join(bodies), 31) == b"".join(chunks)
+
+
+def test_json_envelope_reuses_cached_data_segment():
+    cache = CompressedBodyCache()
+    data = b'{"features": [' + b'{"type": "Feature"},' * 500 + b"{}]}"
+    for request_id in (b"req-1", b"req-2"):
+        prefix = b'{"message":"Request received","request_id":"' + request_id + b'","data":'
+        compressed = compress_json_envelope(prefix, data, b"}", "gzip", cache)
+        assert gzip.decompress(compressed) == prefix + data + b"}"
+    assert (cache.misses, cache.hits) == (1, 1)
@@ -0,0 +1,174 @@
+import asyncio
+
+import asyncpg
+import pytest
+from fastapi import HTTPException
+
+import storage
+from all_types.myapi_dtypes import Coordinate, ReqLocation, ReqPrdcerLyrMapData
+from data_fetcher import lyr_map_data_area
+from storage import (
+    distance_m,
+    features_in_bounding_box,
+    load_dataset_features_in_area,
+    make_bounding_box_query_args,
+    project_feature_properties,
+    radius_bounding_box,
+)
+
+PLAN_DATASET_ID = "plan_cafe_saudi_arabia_riyadh_page_token=plan_cafe_saudi_arabia_riyadh@#$1"
+
+
+def make_feature(lng, lat, properties=None):
+    return {
+        "type": "Feature",
+        "properties": properties or {},
+        "geometry": {"type": "Point", "coordinates": [lng, lat]},
+    }
+
+
+def test_distance_m():
+    assert distance_m(24.7, 46.7, 24.7, 46.7) == 0
+    # One degree of latitude is about 111.2 km anywhere
+    assert distance_m(24.0, 46.7, 25.0, 46.7) == pytest.approx(111195, rel=1e-3)
+    assert distance_m(24.0, 46.0, 25.0, 47.0) == pytest.approx(distance_m(25.0, 47.0, 24.0, 46.0))
+
+
+def test_radius_bounding_box_encloses_the_circle():
+    lat, lng, radius = 24.7, 46.7, 5000
+    lat_min, lat_max, lng_min, lng_max = radius_bounding_box(lat, lng, radius)
+    assert lat_min < lat < lat_max and lng_min < lng < lng_max
+    for edge in [(lat_min, lng), (lat_max, lng), (lat, lng_min), (lat, lng_max)]:
+        assert distance_m(lat, lng, *edge) == pytest.approx(radius, rel=1e-2)
+
+
+def test_project_feature_properties():
+    features = [make_feature(46.7, 24.7, {"name": "A", "rating": 4.5}), make_feature(46.8, 24.8)]
+    features[1]["properties"] = None
+    assert project_feature_properties(features, None) is features
+    projected = project_feature_properties(features, ["name", "missing"])
+    assert [feature["properties"] for feature in projected] == [{"name": "A"}, {}]
+    assert projected[0]["geometry"] == features[0]["geometry"]
+    assert features[0]["properties"] == {"name": "A", "rating": 4.5}
+
+
+def test_features_in_bounding_box_includes_edges():
+    inside, edge, outside = make_feature(46.7, 24.7), make_feature(47.0, 25.0), make_feature(47.1, 24.7)
+    assert features_in_bounding_box([inside, edge, outside], [24.5, 25.0, 46.5, 47.0]) == [inside, edge]
+
+
+def test_lyr_map_data_area():
+    def request(**viewport):
+        return ReqPrdcerLyrMapData(prdcer_lyr_id="l1", user_id="u1", **viewport)
+
+    assert lyr_map_data_area(request()) is None
+    assert lyr_map_data_area(request(bounding_box=[24.5, 25.0, 46.5, 47.0])) == {
+        "bounding_box": [24.5, 25.0, 46.5, 47.0]
+    }
+    assert lyr_map_data_area(request(center=Coordinate(latitude=24.7, longitude=46.7), radius=500)) == {
+        "center": (24.7, 46.7),
+        "radius": 500,
+    }
+
+
+@pytest.mark.parametrize(
+    "viewport",
+    [
+        {"bounding_box": [24.5, 25.0, 46.5]},
+        {"radius": 500},
+        {"center": Coordinate(latitude=24.7, longitude=46.7)},
+        {"center": Coordinate(latitude=24.7, longitude=46.7), "radius": -1},
+    ],
+)
+def test_lyr_map_data_area_rejects_bad_viewports(viewport):
+    with pytest.raises(HTTPException) as error:
+        lyr_map_data_area(ReqPrdcerLyrMapData(prdcer_lyr_id="l1", user_id="u1", **viewport))
+    assert error.value.status_code == 400
+
+
+def test_plan_datasets_are_filtered_after_a_full_load(monkeypatch):
+    center = make_feature(46.7, 24.7, {"name": "center", "rating": 4})
+    # Inside the radius' bounding box but not within the radius
+    corner = make_feature(46.749, 24.744, {"name": "corner"})
+    far = make_feature(47.5, 24.7, {"name": "far"})
+    loads = []
+
+    async def load_dataset(dataset_id, fields=None):
+        loads.append((dataset_id, fields))
+        return {"type": "FeatureCollection", "features": project_feature_properties([center, corner, far], fields)}
+
+    monkeypatch.setattr(storage, "load_dataset", load_dataset)
+
+    in_box = asyncio.run(load_dataset_features_in_area(PLAN_DATASET_ID, bounding_box=[24.6, 24.8, 46.6, 46.8]))
+    assert [feature["properties"]["name"] for feature in in_box] == ["center", "corner"]
+
+    in_radius = asyncio.run(
+        load_dataset_features_in_area(PLAN_DATASET_ID, center=(24.7, 46.7), radius=5000, fields=["name"])
+    )
+    assert in_radius == [make_feature(46.7, 24.7, {"name": "center"})]
+    assert loads == [(PLAN_DATASET_ID, None), (PLAN_DATASET_ID, ["name"])]
+
+
+def test_indexing_creates_the_table_and_retries_once(monkeypatch):
+    attempts, created = [], []
+
+    async def write_dataset_features_index(dataset_id):
+        attempts.append(dataset_id)
+        raise asyncpg.exceptions.UndefinedTableError("relation dataset_features does not exist")
+
+    class FakeDatabase:
+        @staticmethod
+        async def execute(query, *args):
+            created.append(query)
+
+    monkeypatch.setattr(storage, "write_dataset_features_index", write_dataset_features_index)
+    monkeypatch.setattr(storage, "Database", FakeDatabase)
+
+    with pytest.raises(asyncpg.exceptions.UndefinedTableError):
+        asyncio.run(storage.index_dataset_features("d1"))
+    assert attempts == ["d1", "d1"]
+    assert len(created) == 1
+
+
+def test_grid_sampling_widens_a_degenerate_bounding_box():
+    lat_min, lat_max, lng_min, lng_max, grid_size, row_limit = make_bounding_box_query_args(
+        [24.7, 24.7, 46.5, 46.9], "grid"
+    )
+    assert lat_min < 24.7 < lat_max
+    assert (lng_min, lng_max) == (46.5, 46.9)
+    assert grid_size * grid_size >= row_limit
+    assert make_bounding_box_query_args([24.7, 24.7, 46.7, 46.7], "") == [24.7, 24.7, 46.7, 46.7]
+
+
+def test_indexing_failure_does_not_store_the_dataset_again(monkeypatch):
+    executed = []
+
+    class FakeDatabase:
+        @staticmethod
+        async def execute(query, *args):
+            executed.append(query)
+
+    async def index_dataset_features(dataset_id):
+        raise asyncpg.exceptions.UndefinedTableError("relation dataset_features does not exist")
+
+    monkeypatch.setattr(storage, "Database", FakeDatabase)
+    monkeypatch.setattr(storage, "index_dataset_features", index_dataset_features)
+
+    req = ReqLocation(lat=24.7, lng=46.7, radius=500, excludedTypes=[], includedTypes=["cafe"], bounding_box=[])
+    dataset = {"type": "FeatureCollection", "features": [make_feature(46.7, 24.7)]}
+    with pytest.raises(asyncpg.exceptions.UndefinedTableError):
+        asyncio.run(storage.store_data_resp(req, dataset, "d1"))
+    assert executed == [storage.SqlObject.store_dataset]
+
+
+def test_area_of_a_dataset_without_a_datasets_table_is_a_404(monkeypatch):
+    class FakeDatabase:
+        @staticmethod
+        async def fetchrow(query, *args):
+            raise asyncpg.exceptions.UndefinedTableError("relation does not exist")
+
+    monkeypatch.setattr(storage, "Database", FakeDatabase)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(load_dataset_features_in_area("d1", bounding_box=[24.6, 24.8, 46.6, 46.8]))
+    assert error.value.status_code == 404
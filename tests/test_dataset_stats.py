@@ -0,0 +1,74 @@
+import numpy as np
+from dataset_stats import (
+    MANIFEST_QUANTILES,
+    build_dataset_manifest,
+    merge_dataset_manifests,
+)
+
+
+def make_feature(lng, lat, properties):
+    return {
+        "type": "Feature",
+        "properties": properties,
+        "geometry": {"type": "Point", "coordinates": [lng, lat]},
+    }
+
+
+def test_build_dataset_manifest():
+    ratings = [4.5, 3, None, 5, 1.5]
+    dataset = {
+        "type": "FeatureCollection",
+        "features": [
+            make_feature(46.0 + i, 24.0 + i, {"name": f"p{i}", "rating": rating, "open": i % 2 == 0})
+            for i, rating in enumerate(ratings)
+        ]
+        + [make_feature(50.0, 20.0, {"name": 7, "extra": None})],
+    }
+
+    manifest = build_dataset_manifest(dataset)
+
+    assert manifest["records_count"] == 6
+    assert manifest["properties"] == ["name", "rating", "open", "extra"]
+    assert manifest["property_types"] == {
+        "name": "mixed",
+        "rating": "number",
+        "open": "boolean",
+        "extra": "null",
+    }
+    assert manifest["bounding_box"] == [20.0, 28.0, 46.0, 50.0]
+    # Booleans and mixed properties get no numeric stats
+    assert list(manifest["numeric_stats"]) == ["rating"]
+    rating_stats = manifest["numeric_stats"]["rating"]
+    values = [r for r in ratings if r is not None]
+    assert rating_stats["count"] == 4
+    assert (rating_stats["min"], rating_stats["max"]) == (1.5, 5)
+    for q in MANIFEST_QUANTILES:
+        assert np.isclose(rating_stats["quantiles"][str(q)], np.percentile(values, q * 100))
+
+
+def test_build_dataset_manifest_empty():
+    manifest = build_dataset_manifest({"type": "FeatureCollection", "features": []})
+    assert manifest["records_count"] == 0
+    assert manifest["bounding_box"] is None
+    assert manifest["numeric_stats"] == {}
+
+
+def test_merge_dataset_manifests_matches_combined_dataset():
+    rng = np.random.default_rng(3)
+    pages = [
+        {
+            "type": "FeatureCollection",
+            "features": [
+                make_feature(float(lng), 24.0, {"rating": float(rating)})
+                for lng, rating in zip(rng.uniform(46, 47, 3000), rng.normal(page, 1, 3000))
+            ],
+        }
+        for page in range(3)
+    ]
+    merged = {}
+    for page in pages:
+        merged = merge_dataset_manifests(merged, build_dataset_manifest(page))
+
+    ratings = [f["properties"]["rating"] for page in pages for f in page["features"]]
+    assert merged["records_count"] == 9000
+    assert merged["numeric_stats"]["rating"] == {"count": 9000, "min": min(ratings), "max": max(ratings)}
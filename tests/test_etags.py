@@ -0,0 +1,54 @@
+import asyncio
+
+import data_fetcher
+from all_types.myapi_dtypes import ReqPrdcerLyrMapData
+from data_fetcher import fetch_lyr_map_data_if_modified
+from etags import content_etag, etag_matches
+
+
+def test_content_etag_is_stable_and_content_sensitive():
+    assert content_etag({"a": 1, "b": [2]}) == content_etag({"b": [2], "a": 1})
+    assert content_etag("ab", "c") != content_etag("a", "bc")
+    assert content_etag(b'{"a":1}') != content_etag(b'{"a":2}')
+    assert content_etag(b"x").startswith('W/"')
+
+
+def test_etag_matches_uses_weak_comparison():
+    etag = content_etag("dataset")
+    opaque_tag = etag.removeprefix("W/")
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", {opaque_tag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches(etag, None)
+
+
+def test_conditional_layer_fetch_resolves_the_layer_once(monkeypatch):
+    calls = []
+
+    async def resolve_lyr_map_data(req):
+        calls.append("resolve")
+        return {"city_name": "Riyadh"}, "d1", {"records_count": 1}
+
+    async def load_dataset_etags(dataset_ids):
+        return {"d1": content_etag("dataset")}
+
+    async def fetch_lyr_map_data(req, resolved):
+        calls.append(("fetch", resolved[1]))
+        return "layer"
+
+    monkeypatch.setattr(data_fetcher, "resolve_lyr_map_data", resolve_lyr_map_data)
+    monkeypatch.setattr(data_fetcher, "load_dataset_etags", load_dataset_etags)
+    monkeypatch.setattr(data_fetcher, "fetch_lyr_map_data", fetch_lyr_map_data)
+    req = ReqPrdcerLyrMapData(prdcer_lyr_id="l1", user_id="u1")
+
+    etag, layer = asyncio.run(fetch_lyr_map_data_if_modified(req, None, "None"))
+    assert layer == "layer"
+    assert calls == ["resolve", ("fetch", "d1")]
+
+    calls.clear()
+    assert asyncio.run(fetch_lyr_map_data_if_modified(req, etag, "None")) == (etag, None)
+    assert calls == ["resolve"]
+    # Another representation is another tag
+    assert asyncio.run(fetch_lyr_map_data_if_modified(req, etag, "float32"))[0] != etag
@@ -0,0 +1,179 @@
+import asyncio
+
+import orjson
+
+from layer_encoding import (
+    LAYER_BINARY_MEDIA_TYPE,
+    binary_coordinate_type,
+    decode_catalog_bundle,
+    decode_compact_coordinates,
+    decode_layers_binary,
+    encode_catalog_bundle,
+    encode_compact_coordinates,
+    encode_layers_binary,
+    pack_coordinates,
+    stream_feature_collection,
+    stream_json_array,
+    stream_response_model,
+    unpack_coordinates,
+)
+
+
+def make_feature(lng, lat, properties):
+    return {
+        "type": "Feature",
+        "properties": properties,
+        "geometry": {"type": "Point", "coordinates": [lng, lat]},
+    }
+
+
+def make_layer(lyr_id, features):
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "properties": ["name", "rating", "types"],
+        "prdcer_layer_name": f"Layer {lyr_id}",
+        "prdcer_lyr_id": lyr_id,
+        "bknd_dataset_id": f"dataset_{lyr_id}",
+        "points_color": "red",
+        "layer_legend": "",
+        "layer_description": "",
+        "records_count": len(features),
+        "city_name": "Riyadh",
+        "is_zone_lyr": "false",
+    }
+
+
+def test_pack_coordinates_roundtrip():
+    coordinates = [46.787441, 24.903622, -0.0, 1e-12]
+    assert unpack_coordinates(pack_coordinates(coordinates)) == coordinates
+
+
+def test_catalog_bundle_roundtrip_shares_dictionary():
+    layers = [
+        make_layer(
+            "l1",
+            [
+                make_feature(46.1, 24.1, {"name": "A", "rating": 4.5, "types": ["cafe", "establishment"]}),
+                make_feature(46.2, 24.2, {"name": "B", "rating": 4, "types": ["establishment"]}),
+            ],
+        ),
+        make_layer(
+            "l2",
+            [make_feature(46.3, 24.3, {"name": "A", "rating": True, "address": {"city": "Riyadh"}})],
+        ),
+    ]
+
+    bundle = encode_catalog_bundle(layers)
+
+    assert bundle["keys"] == ["name", "rating", "types", "address"]
+    # Shared values are stored once, and 4, 4.5 and True stay distinct
+    assert bundle["values"] == ["A", 4.5, "cafe", "establishment", "B", 4, True, {"city": "Riyadh"}]
+    assert decode_catalog_bundle(bundle) == layers
+
+
+def test_stream_feature_collection_is_valid_json():
+    features = [make_feature(46.0 + i, 24.0, {"name": str(i)}) for i in range(3000)]
+    envelope = {key: value for key, value in make_layer("l1", features).items() if key != "features"}
+
+    async def encoded(items):
+        for item in items:
+            yield orjson.dumps(item)
+
+    async def layers():
+        yield stream_feature_collection(envelope, encoded(features))
+        yield stream_feature_collection(envelope, encoded([]))
+
+    async def collect():
+        return b"".join([chunk async for chunk in stream_response_model(stream_json_array(layers()), "req-1")])
+
+    body = orjson.loads(asyncio.run(collect()))
+    assert body["request_id"] == "req-1"
+    assert body["data"][0] == make_layer("l1", features)
+    assert body["data"][1]["features"] == []
+
+
+def test_closing_a_stream_closes_its_sources():
+    closed = []
+
+    async def cursor():
+        try:
+            for i in range(100000):
+                yield orjson.dumps(make_feature(46.0, 24.0, {"name": str(i)}))
+        finally:
+            closed.append("cursor")
+
+    async def layers():
+        try:
+            yield stream_feature_collection({"prdcer_lyr_id": "l1"}, cursor())
+        finally:
+            closed.append("layers")
+
+    async def read_part_of_body():
+        body = stream_response_model(stream_json_array(layers()), "req-1")
+        # Envelope head, "[" and the first chunk of features
+        for _ in range(3):
+            await body.__anext__()
+        # What the response does when the client goes away
+        await body.aclose()
+
+    asyncio.run(read_part_of_body())
+    assert closed == ["cursor", "layers"]
+
+
+def test_binary_layers_roundtrip():
+    features = [
+        make_feature(46.787441, 24.903622, {"name": "A", "rating": 4.5, "types": ["cafe"], "open": True, "reviews": 10}),
+        make_feature(46.1, 24.1, {"name": "B", "rating": None, "types": ["cafe"], "open": False}),
+        make_feature(46.2, 24.2, {"name": "A", "rating": 4, "types": [], "open": True, "reviews": -3}),
+    ]
+    layers = [make_layer("l1", features), make_layer("l2", [])]
+
+    assert decode_layers_binary(encode_layers_binary(layers)) == layers
+
+    float32_layer = decode_layers_binary(encode_layers_binary(layers, "float32"))[0]
+    lng, lat = float32_layer["features"][0]["geometry"]["coordinates"]
+    assert abs(lng - 46.787441) < 1e-5 and abs(lat - 24.903622) < 1e-5
+
+
+def test_binary_coordinate_type_from_accept():
+    assert binary_coordinate_type("application/json") is None
+    assert binary_coordinate_type(f"application/json, {LAYER_BINARY_MEDIA_TYPE}") == "float64"
+    assert binary_coordinate_type(f"{LAYER_BINARY_MEDIA_TYPE}; precision=float32") == "float32"
+
+
+def test_compact_coordinates_roundtrip_and_size():
+    # A dense city layer, like a category search around Riyadh
+    points = [
+        [46.6 + (i * 7919 % 1000) * 1e-4 + 1e-9, 24.6 + (i * 104729 % 1000) * 1e-4]
+        for i in range(2000)
+    ]
+    order, packed, encoding = encode_compact_coordinates(points, 6)
+    assert sorted(order) == list(range(len(points)))
+    assert encoding == {"type": "delta-varint", "precision": 6, "order": "morton"}
+
+    decoded = decode_compact_coordinates(packed, encoding)
+    for position, i in enumerate(order):
+        assert abs(decoded[2 * position] - points[i][0]) <= 5e-7
+        assert abs(decoded[2 * position + 1] - points[i][1]) <= 5e-7
+
+    json_bytes = len(orjson.dumps(points))
+    assert len(packed) * 3 < len(pack_coordinates([v for point in points for v in point]))
+    assert len(packed) * 5 < json_bytes
+
+
+def test_compact_catalog_bundle_keeps_features_with_their_points():
+    features = [
+        make_feature(46.7 + i * 0.01, 24.7 - i * 0.01, {"name": f"Place {i}", "rating": i})
+        for i in range(20)
+    ]
+    bundle = encode_catalog_bundle([make_layer("l1", features)], precision=5)
+    assert bundle["layers"][0]["coordinate_encoding"]["precision"] == 5
+
+    (layer,) = decode_catalog_bundle(bundle)
+    by_name = {feature["properties"]["name"]: feature for feature in features}
+    assert len(layer["features"]) == len(features)
+    for feature in layer["features"]:
+        expected = by_name[feature["properties"]["name"]]["geometry"]["coordinates"]
+        lng, lat = feature["geometry"]["coordinates"]
+        assert abs(lng - expected[0]) <= 5e-6 and abs(lat - expected[1]) <= 5e-6
@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+
+import storage
+from storage import LAYER_ENTRIES_COLLECTION, USER_PROFILES_COLLECTION, fetch_dataset_ids
+from unit_of_work import begin_unit_of_work, current_unit_of_work, end_unit_of_work
+
+
+class FakeSnapshot:
+    def __init__(self, document_id, data):
+        self.id = document_id
+        self.exists = data is not None
+        self.data = data
+
+    def to_dict(self):
+        return self.data
+
+
+class FakeClient:
+    def __init__(self, documents):
+        self.documents = documents
+        self.batches = []
+
+    def collection(self, name):
+        return FakeCollection(name)
+
+    async def get_all(self, references):
+        self.batches.append(references)
+        for collection_name, document_id in reversed(references):
+            yield FakeSnapshot(document_id, self.documents.get((collection_name, document_id)))
+
+
+class FakeCollection:
+    def __init__(self, name):
+        self.name = name
+
+    def document(self, document_id):
+        return (self.name, document_id)
+
+
+class FakeDb:
+    def __init__(self, client, cache):
+        self.client = client
+        self._cache = cache
+
+    def get_async_client(self):
+        return self.client
+
+    async def get_document(self, collection_name, document_id):
+        return {}
+
+
+def test_layer_entries_are_read_in_one_batch(monkeypatch):
+    client = FakeClient(
+        {
+            (LAYER_ENTRIES_COLLECTION, "l1"): {"bknd_dataset_id": "d1", "records_count": 3},
+            (LAYER_ENTRIES_COLLECTION, "l2"): {"bknd_dataset_id": "d2", "records_count": 5},
+        }
+    )
+    cache = {LAYER_ENTRIES_COLLECTION: {"l0": {"bknd_dataset_id": "d0", "records_count": 1}}}
+    monkeypatch.setattr(storage, "db", FakeDb(client, cache))
+
+    dataset_ids = asyncio.run(fetch_dataset_ids(["l0", "l1", "l2", "l1", "missing"]))
+    assert dataset_ids == {
+        "l0": ("d0", {"records_count": 1}),
+        "l1": ("d1", {"records_count": 3}),
+        "l2": ("d2", {"records_count": 5}),
+    }
+    # Cached entries are not read again, the others in a single get_all
+    assert client.batches == [
+        [(LAYER_ENTRIES_COLLECTION, "l1"), (LAYER_ENTRIES_COLLECTION, "l2"), (LAYER_ENTRIES_COLLECTION, "missing")]
+    ]
+    assert cache[LAYER_ENTRIES_COLLECTION]["l2"] == {"bknd_dataset_id": "d2", "records_count": 5}
+
+
+class FakeQueue:
+    def __init__(self):
+        self.enqueued = []
+
+    def enqueue(self, collection_name, document_id, fields):
+        self.enqueued.append((collection_name, document_id, fields))
+
+
+def test_matching_writes_wait_for_the_unit_of_work_commit(monkeypatch):
+    queue = FakeQueue()
+    monkeypatch.setattr(storage, "db", FakeDb(FakeClient({}), {}))
+    monkeypatch.setattr(storage, "write_behind_queue", queue)
+
+    async def failing_write():
+        raise RuntimeError("Postgres unavailable")
+
+    async def handle_request(relation_write=None):
+        token = begin_unit_of_work()
+        try:
+            await storage.update_dataset_layer_matching("l1", "d1", 3)
+            assert queue.enqueued == []
+            if relation_write is not None:
+                current_unit_of_work().relation_writes.append(relation_write)
+            await storage.commit_unit_of_work()
+        finally:
+            end_unit_of_work(token)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(handle_request(failing_write))
+    assert queue.enqueued == []
+
+    asyncio.run(handle_request())
+    assert queue.enqueued == [
+        (LAYER_ENTRIES_COLLECTION, "l1", {"bknd_dataset_id": "d1", "records_count": 3})
+    ]
+    assert storage.db._cache[LAYER_ENTRIES_COLLECTION]["l1"]["bknd_dataset_id"] == "d1"
+
+
+def test_profile_patch_merges_only_the_entry(monkeypatch):
+    queue = FakeQueue()
+    cache = {USER_PROFILES_COLLECTION: {"u1": {"prdcer": {"prdcer_lyrs": {"l0": {}}}}}}
+    monkeypatch.setattr(storage, "db", FakeDb(FakeClient({}), cache))
+    monkeypatch.setattr(storage, "write_behind_queue", queue)
+
+    asyncio.run(storage.patch_user_profile("u1", "prdcer_ctlgs", "c1", {"name": "Cafes"}))
+    assert queue.enqueued == [
+        (USER_PROFILES_COLLECTION, "u1", {"prdcer": {"prdcer_ctlgs": {"c1": {"name": "Cafes"}}}})
+    ]
+    assert cache[USER_PROFILES_COLLECTION]["u1"] == {
+        "prdcer": {"prdcer_lyrs": {"l0": {}}, "prdcer_ctlgs": {"c1": {"name": "Cafes"}}}
+    }
+
+    async def patch_in_request():
+        token = begin_unit_of_work()
+        try:
+            current_unit_of_work().profiles["u2"] = {}
+            await storage.patch_user_profile("u2", "prdcer_lyrs", "l1", {"name": "Banks"})
+            # The request sees its own patch before anything is queued
+            assert current_unit_of_work().profiles["u2"] == {"prdcer": {"prdcer_lyrs": {"l1": {"name": "Banks"}}}}
+            assert len(queue.enqueued) == 1
+            await storage.commit_unit_of_work()
+        finally:
+            end_unit_of_work(token)
+
+    asyncio.run(patch_in_request())
+    assert queue.enqueued[1] == (USER_PROFILES_COLLECTION, "u2", {"prdcer": {"prdcer_lyrs": {"l1": {"name": "Banks"}}}})
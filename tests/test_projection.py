@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import data_fetcher
+import storage
+from all_types.myapi_dtypes import ReqPrdcerLyrMapData
+from data_fetcher import fetch_lyr_map_data, project_properties
+from storage import load_datasets
+
+PLAN_DATASET_ID = "plan_cafe_saudi_arabia_riyadh_page_token=plan_cafe_saudi_arabia_riyadh@#$2"
+MISSING_PLAN_DATASET_ID = "plan_bank_saudi_arabia_riyadh_page_token=plan_bank_saudi_arabia_riyadh@#$2"
+
+
+def make_feature(properties):
+    return {"type": "Feature", "properties": properties, "geometry": {"type": "Point", "coordinates": [46.7, 24.7]}}
+
+
+def test_project_properties():
+    properties = ["name", "rating", "types"]
+    assert project_properties(properties, None) is properties
+    assert project_properties(properties, ["types", "name", "missing"]) == ["name", "types"]
+    assert project_properties(properties, []) == []
+
+
+def test_plan_datasets_are_projected_after_loading(monkeypatch):
+    plan_dataset = {
+        "type": "FeatureCollection",
+        "features": [make_feature({"name": "A", "rating": 4.5}), make_feature({"name": "B", "phone": "1"})],
+    }
+    loads = []
+
+    async def load_dataset(dataset_id, fields=None):
+        loads.append((dataset_id, fields))
+        return plan_dataset if dataset_id == PLAN_DATASET_ID else None
+
+    monkeypatch.setattr(storage, "load_dataset", load_dataset)
+
+    datasets = asyncio.run(load_datasets([PLAN_DATASET_ID, MISSING_PLAN_DATASET_ID], ["name"]))
+    assert [feature["properties"] for feature in datasets[PLAN_DATASET_ID]["features"]] == [
+        {"name": "A"},
+        {"name": "B"},
+    ]
+    assert datasets[MISSING_PLAN_DATASET_ID] is None
+    # Plan pages are concatenated whole and projected in Python
+    assert sorted(loads) == [(MISSING_PLAN_DATASET_ID, None), (PLAN_DATASET_ID, None)]
+    assert plan_dataset["features"][0]["properties"] == {"name": "A", "rating": 4.5}
+
+
+def test_missing_dataset_of_a_layer_is_a_404(monkeypatch):
+    async def fetch_layer_owner_id(lyr_id):
+        return "u1"
+
+    async def load_user_profile(user_id):
+        return {"prdcer": {"prdcer_lyrs": {"l1": {"city_name": "Riyadh"}}}}
+
+    async def fetch_dataset_id(lyr_id):
+        return "d1", {"records_count": 0}
+
+    async def load_dataset(dataset_id, fields=None):
+        return None
+
+    async def load_dataset_manifest(dataset_id):
+        return {}
+
+    for name, function in [
+        ("fetch_layer_owner_id", fetch_layer_owner_id),
+        ("load_user_profile", load_user_profile),
+        ("fetch_dataset_id", fetch_dataset_id),
+        ("load_dataset", load_dataset),
+        ("load_dataset_manifest", load_dataset_manifest),
+    ]:
+        monkeypatch.setattr(data_fetcher, name, function)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(fetch_lyr_map_data(ReqPrdcerLyrMapData(prdcer_lyr_id="l1", user_id="u1", fields=["name"])))
+    assert error.value.status_code == 404
@@ -0,0 +1,33 @@
+import pytest
+from pydantic import ValidationError
+
+from all_types.response_dtypes import ResFetchDataset
+
+
+def make_dataset(features):
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "bknd_dataset_id": "dataset",
+        "prdcer_lyr_id": "l1",
+        "records_count": len(features),
+    }
+
+
+def test_construct_trusted_keeps_features_and_dumps_same_json():
+    features = [
+        {"type": "Feature", "properties": {"name": str(i)}, "geometry": {"type": "Point", "coordinates": [46.0, 24.0 + i]}}
+        for i in range(50)
+    ]
+    trusted = ResFetchDataset.construct_trusted(**make_dataset(features))
+
+    assert trusted.features is features
+    assert trusted.model_dump_json(serialize_as_any=True) == ResFetchDataset(**make_dataset(features)).model_dump_json()
+
+
+def test_construct_trusted_validates_sample_and_other_fields():
+    bad_feature = {"type": "Feature", "properties": {}, "geometry": {"type": "Polygon", "coordinates": []}}
+    with pytest.raises(ValidationError):
+        ResFetchDataset.construct_trusted(**make_dataset([bad_feature]))
+    with pytest.raises(ValidationError):
+        ResFetchDataset.construct_trusted(**{**make_dataset([]), "records_count": "many"})
@@ -0,0 +1,41 @@
+from vector_tiles import TileIndex, _varint, _zigzag, is_valid_tile, lng_lat_to_world
+
+
+def make_features(count):
+    return [
+        {
+            "type": "Feature",
+            "properties": {"name": f"Place {i}", "rating": 4.5},
+            "geometry": {"type": "Point", "coordinates": [46.6 + i * 1e-5, 24.7]},
+        }
+        for i in range(count)
+    ]
+
+
+def tile_of(lng, lat, z):
+    x, y = lng_lat_to_world(lng, lat)
+    return z, int(x * 2**z), int(y * 2**z)
+
+
+def test_varint_and_zigzag():
+    assert _varint(1) == b"\x01"
+    assert _varint(300) == b"\xac\x02"
+    assert [_zigzag(v) for v in (0, -1, 1, -2)] == [0, 1, 2, 3]
+
+
+def test_tiles_are_thinned_at_low_zoom_and_empty_elsewhere():
+    index = TileIndex(make_features(1000))
+    low = index.tile(*tile_of(46.6, 24.7, 8))
+    high = index.tile(*tile_of(46.6, 24.7, 18))
+
+    # Layers are field 3 of the tile message
+    assert low[:1] == high[:1] == b"\x1a"
+    assert len(low) < len(high)
+    assert index.tile(*tile_of(-74.0, 40.7, 8)) == b""
+    assert index.tile(*tile_of(46.6, 24.7, 8)) is low
+
+
+def test_is_valid_tile():
+    assert is_valid_tile(0, 0, 0)
+    assert not is_valid_tile(2, 4, 0)
+    assert not is_valid_tile(-1, 0, 0)
@@ -0,0 +1,165 @@
+import asyncio
+
+from firebase_admin import firestore
+
+import write_behind_queue as write_behind_queue_module
+from write_behind_queue import PendingWrite, WriteBehindQueue
+
+
+class FakeBatch:
+    def __init__(self, client):
+        self.client = client
+        self.sets = []
+
+    def set(self, doc_ref, payload, merge=False):
+        assert merge
+        self.sets.append((doc_ref, payload))
+
+    async def commit(self):
+        self.client.commits += 1
+        if self.client.before_commit is not None:
+            before_commit, self.client.before_commit = self.client.before_commit, None
+            before_commit()
+        if self.client.failures:
+            self.client.failures -= 1
+            raise RuntimeError("Firestore unavailable")
+        self.client.written.extend(self.sets)
+
+
+class FakeCollection:
+    def __init__(self, name):
+        self.name = name
+
+    def document(self, document_id):
+        return (self.name, document_id)
+
+
+class FakeClient:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.before_commit = None
+        self.commits = 0
+        self.written = []
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def collection(self, name):
+        return FakeCollection(name)
+
+
+class FakeDb:
+    def __init__(self, client):
+        self.client = client
+
+    def get_async_client(self):
+        return self.client
+
+
+def use_client(monkeypatch, client):
+    monkeypatch.setattr(write_behind_queue_module, "db", FakeDb(client))
+
+
+def plain(payload):
+    """Payload with transforms turned into comparable tuples"""
+    return {
+        field: (type(value).__name__, list(value.values))
+        if isinstance(value, (firestore.ArrayUnion, firestore.ArrayRemove))
+        else value
+        for field, value in payload.items()
+    }
+
+
+def test_updates_of_one_document_are_coalesced(monkeypatch):
+    client = FakeClient()
+    use_client(monkeypatch, client)
+    queue = WriteBehindQueue()
+    queue.enqueue("users", "u1", {"name": "old", "plan": "free"})
+    queue.enqueue("users", "u1", {"name": "new"})
+    queue.enqueue("users", "u2", {"name": "other"})
+
+    assert asyncio.run(queue.flush())
+    assert client.commits == 1
+    assert dict(client.written) == {
+        ("users", "u1"): {"name": "new", "plan": "free"},
+        ("users", "u2"): {"name": "other"},
+    }
+    assert queue.metrics()["queue_depth"] == 0
+    assert queue.metrics()["documents_written"] == 2
+
+
+def test_array_union_and_remove_cancel_out():
+    pending = PendingWrite()
+    pending.add({"lyrs": firestore.ArrayUnion(["a", "b"])})
+    pending.add({"lyrs": firestore.ArrayRemove(["a"])})
+    assert [plain(write) for write in pending.to_writes()] == [
+        {"lyrs": ("ArrayUnion", ["b"])},
+        {"lyrs": ("ArrayRemove", ["a"])},
+    ]
+
+    pending.add({"lyrs": firestore.ArrayUnion(["a"])})
+    assert [plain(write) for write in pending.to_writes()] == [
+        {"lyrs": ("ArrayUnion", ["b", "a"])}
+    ]
+
+
+def test_array_transforms_apply_to_a_replaced_value():
+    pending = PendingWrite()
+    pending.add({"lyrs": ["a"]})
+    pending.add({"lyrs": firestore.ArrayUnion(["b"])})
+    pending.add({"lyrs": firestore.ArrayRemove(["a"])})
+    assert pending.to_writes() == [{"lyrs": ["b"]}]
+
+
+def test_failed_flush_is_requeued_under_newer_updates(monkeypatch):
+    client = FakeClient(failures=1)
+    use_client(monkeypatch, client)
+    queue = WriteBehindQueue(base_backoff=0)
+    queue.enqueue("users", "u1", {"name": "first", "plan": "free"})
+    # Written while the failing batch is in flight
+    client.before_commit = lambda: queue.enqueue("users", "u1", {"name": "second"})
+
+    assert not asyncio.run(queue.flush())
+    assert client.written == []
+    assert queue.pending[("users", "u1")].attempts == 1
+
+    assert asyncio.run(queue.flush())
+    assert client.written == [(("users", "u1"), {"name": "second", "plan": "free"})]
+    assert queue.metrics()["failed_flushes"] == 1
+
+
+def test_writes_are_dropped_after_max_retries(monkeypatch):
+    client = FakeClient(failures=3)
+    use_client(monkeypatch, client)
+    queue = WriteBehindQueue(max_retries=2, base_backoff=0)
+    queue.enqueue("users", "u1", {"name": "lost"})
+
+    results = [asyncio.run(queue.flush()) for _ in range(3)]
+    assert results == [False, False, False]
+    assert queue.pending == {}
+    assert queue.metrics()["dropped_documents"] == 1
+
+
+def test_stop_drains_the_queue(monkeypatch):
+    client = FakeClient(failures=1)
+    use_client(monkeypatch, client)
+
+    async def run():
+        queue = WriteBehindQueue(flush_interval=60, base_backoff=0)
+        queue.start()
+        queue.enqueue("users", "u1", {"name": "saved"})
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(run())
+    assert client.written == [(("users", "u1"), {"name": "saved"})]
+    assert queue.pending == {}
+
+
+def test_nested_maps_are_merged_like_firestore_does():
+    pending = PendingWrite()
+    pending.add({"prdcer": {"prdcer_lyrs": {"l1": {"name": "a"}}}})
+    pending.add({"prdcer": {"prdcer_lyrs": {"l2": {"name": "b"}}, "draft_ctlgs": {"c1": {}}}})
+    assert pending.to_writes() == [
+        {"prdcer": {"prdcer_lyrs": {"l1": {"name": "a"}, "l2": {"name": "b"}}, "draft_ctlgs": {"c1": {}}}}
+    ]
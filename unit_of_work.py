@@ -0,0 +1,36 @@
+from contextvars import ContextVar, Token
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+
+class UnitOfWork:
+    """
+    Per-request cache of user profiles and matching documents. Profile
+    updates, layer/catalog table writes and matching document merges are
+    only recorded here and written when the request finishes successfully.
+    """
+
+    def __init__(self):
+        self.profiles: Dict[str, Dict[str, Any]] = {}
+        self.dirty_profiles: Set[str] = set()
+        self.relation_writes: List[Callable[[], Awaitable[Any]]] = []
+        self.documents: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        # (collection, document id, merged fields)
+        self.document_writes: List[Tuple[str, str, Dict[str, Any]]] = []
+
+
+_current_unit_of_work: ContextVar[Optional[UnitOfWork]] = ContextVar(
+    "unit_of_work", default=None
+)
+
+
+def current_unit_of_work() -> Optional[UnitOfWork]:
+    """The unit of work of the running request, None outside of a request"""
+    return _current_unit_of_work.get()
+
+
+def begin_unit_of_work() -> Token:
+    return _current_unit_of_work.set(UnitOfWork())
+
+
+def end_unit_of_work(token: Token):
+    _current_unit_of_work.reset(token)
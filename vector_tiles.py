@@ -0,0 +1,198 @@
+import math
+import struct
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+TILE_EXTENT = 4096
+# Points this far outside a tile (in tile units) are still drawn, so symbols
+# on a tile edge are not cut
+TILE_BUFFER = 64
+MAX_TILE_ZOOM = 22
+# From this zoom on every point is kept; below it points are thinned
+FULL_DETAIL_ZOOM = 12
+# Below FULL_DETAIL_ZOOM, at most one point per cell of this many tile units
+THINNING_CELL_SIZE = 64
+TILE_LAYER_NAME = "points"
+TILE_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+# Seconds clients and proxies may reuse a tile
+TILE_MAX_AGE = 300
+TILE_INDEX_CACHE_SIZE = 32
+TILE_CACHE_SIZE = 256
+MAX_MERCATOR_LAT = 85.0511287798066
+
+
+class LRUCache:
+    """Small least-recently-used mapping"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: OrderedDict = OrderedDict()
+
+    def get(self, key) -> Optional[Any]:
+        if key not in self._items:
+            return None
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def pop(self, key):
+        self._items.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+def lng_lat_to_world(lng: float, lat: float) -> Tuple[float, float]:
+    """Web Mercator position in [0, 1) x [0, 1), y growing southwards"""
+    lat = max(min(lat, MAX_MERCATOR_LAT), -MAX_MERCATOR_LAT)
+    sin_lat = math.sin(math.radians(lat))
+    x = lng / 360 + 0.5
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return x, y
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_TILE_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z
+
+
+# Minimal protobuf writer for the vector tile spec (version 2)
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number: int, wire_type: int) -> bytes:
+    return _varint((number << 3) | wire_type)
+
+
+def _bytes_field(number: int, payload: bytes) -> bytes:
+    return _field(number, 2) + _varint(len(payload)) + payload
+
+
+def _varint_field(number: int, value: int) -> bytes:
+    return _field(number, 0) + _varint(value)
+
+
+def _packed_field(number: int, values: List[int]) -> bytes:
+    return _bytes_field(number, b"".join(_varint(value) for value in values))
+
+
+def encode_tile_value(value: Any) -> bytes:
+    """A vector tile Value message; lists and objects are sent as JSON strings"""
+    if isinstance(value, bool):
+        return _varint_field(7, int(value))
+    if isinstance(value, int) and -(2**63) <= value < 2**63:
+        return _varint_field(6, _zigzag(value))
+    if isinstance(value, float):
+        return _field(3, 1) + struct.pack("<d", value)
+    if not isinstance(value, str):
+        value = orjson.dumps(value).decode()
+    return _bytes_field(1, value.encode())
+
+
+def encode_tile_layer(points: List[Tuple[int, int, Dict[str, Any]]]) -> bytes:
+    """One vector tile Layer of point features at tile positions (x, y)"""
+    keys: Dict[str, int] = {}
+    # Encoded Value messages already differ by type, so they are the identity
+    values: Dict[bytes, int] = {}
+    value_messages: List[bytes] = []
+    features = []
+    for x, y, properties in points:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            message = encode_tile_value(value)
+            if message not in values:
+                values[message] = len(value_messages)
+                value_messages.append(message)
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values[message])
+        # MoveTo with one point, then the zigzag encoded position
+        geometry = [9, _zigzag(x), _zigzag(y)]
+        features.append(
+            _packed_field(2, tags) + _varint_field(3, 1) + _packed_field(4, geometry)
+        )
+
+    layer = _varint_field(15, 2) + _bytes_field(1, TILE_LAYER_NAME.encode())
+    layer += b"".join(_bytes_field(2, feature) for feature in features)
+    layer += b"".join(_bytes_field(3, key.encode()) for key in keys)
+    layer += b"".join(_bytes_field(4, message) for message in value_messages)
+    layer += _varint_field(5, TILE_EXTENT)
+    return _bytes_field(3, layer)
+
+
+class TileIndex:
+    """
+    Point features of one dataset, projected once and sorted by Web Mercator
+    x so the points of any tile are found with a binary search. Encoded
+    tiles are kept in a per-dataset LRU cache.
+    """
+
+    def __init__(self, features: List[Dict[str, Any]]):
+        points = []
+        for feature in features:
+            coordinates = (feature.get("geometry") or {}).get("coordinates") or []
+            if len(coordinates) < 2:
+                continue
+            x, y = lng_lat_to_world(coordinates[0], coordinates[1])
+            points.append((x, y, feature.get("properties") or {}))
+        points.sort(key=lambda point: point[0])
+        self.xs = [point[0] for point in points]
+        self.points = points
+        self.tiles = LRUCache(TILE_CACHE_SIZE)
+
+    def tile(self, z: int, x: int, y: int) -> bytes:
+        key = (z, x, y)
+        tile = self.tiles.get(key)
+        if tile is None:
+            tile = self._cut_tile(z, x, y)
+            self.tiles.put(key, tile)
+        return tile
+
+    def _cut_tile(self, z: int, x: int, y: int) -> bytes:
+        scale = 2**z * TILE_EXTENT
+        buffer = TILE_BUFFER / scale
+        start = bisect_left(self.xs, x / 2**z - buffer)
+        end = bisect_left(self.xs, (x + 1) / 2**z + buffer)
+        thinned = z < FULL_DETAIL_ZOOM
+        occupied_cells = set()
+        tile_points = []
+        for world_x, world_y, properties in self.points[start:end]:
+            tile_x = round(world_x * scale - x * TILE_EXTENT)
+            tile_y = round(world_y * scale - y * TILE_EXTENT)
+            if not -TILE_BUFFER <= tile_y < TILE_EXTENT + TILE_BUFFER:
+                continue
+            if thinned:
+                cell = (tile_x // THINNING_CELL_SIZE, tile_y // THINNING_CELL_SIZE)
+                if cell in occupied_cells:
+                    continue
+                occupied_cells.add(cell)
+            tile_points.append((tile_x, tile_y, properties))
+        if not tile_points:
+            return b""
+        return encode_tile_layer(tile_points)
+
+
+tile_indexes = LRUCache(TILE_INDEX_CACHE_SIZE)
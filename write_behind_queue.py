@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from backend_common.auth import db
+from firebase_admin import firestore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 0.5
+DEFAULT_MAX_PENDING = 200
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_BACKOFF = 0.5
+# Firestore rejects batches with more than 500 writes
+FIRESTORE_BATCH_LIMIT = 500
+
+
+def merge_maps(current: Dict[str, Any], newer: Dict[str, Any]) -> Dict[str, Any]:
+    """newer applied on top of current the way a merge write does: nested maps merge"""
+    merged = dict(current)
+    for key, value in newer.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_maps(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class PendingWrite:
+    """
+    Coalesced merge-update of one Firestore document. Plain fields keep the
+    last value written; ArrayUnion/ArrayRemove transforms are accumulated so
+    several queued updates land as a single write.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.array_unions: Dict[str, List] = {}
+        self.array_removes: Dict[str, List] = {}
+        self.attempts = 0
+
+    def add(self, fields: Dict[str, Any]):
+        for field, value in fields.items():
+            if isinstance(value, firestore.ArrayUnion):
+                self._add_array_values(field, value.values, self.array_unions, self.array_removes)
+            elif isinstance(value, firestore.ArrayRemove):
+                self._add_array_values(field, value.values, self.array_removes, self.array_unions)
+            elif isinstance(value, dict) and isinstance(self.fields.get(field), dict):
+                self.fields[field] = merge_maps(self.fields[field], value)
+            else:
+                self.fields[field] = value
+                self.array_unions.pop(field, None)
+                self.array_removes.pop(field, None)
+
+    def _add_array_values(self, field: str, values, target: Dict, opposite: Dict):
+        if isinstance(self.fields.get(field), list):
+            # The field is already being replaced, apply the transform to the value
+            current = self.fields[field]
+            if target is self.array_unions:
+                current.extend(v for v in values if v not in current)
+            else:
+                self.fields[field] = [v for v in current if v not in values]
+            return
+        pending = target.setdefault(field, [])
+        pending.extend(v for v in values if v not in pending)
+        if field in opposite:
+            opposite[field] = [v for v in opposite[field] if v not in values]
+            if not opposite[field]:
+                del opposite[field]
+
+    def merge(self, newer: "PendingWrite"):
+        """Applies a newer pending write on top of this one"""
+        for field, values in newer.array_removes.items():
+            self.add({field: firestore.ArrayRemove(values)})
+        for field, values in newer.array_unions.items():
+            self.add({field: firestore.ArrayUnion(values)})
+        self.add(newer.fields)
+
+    def to_writes(self) -> List[Dict[str, Any]]:
+        """
+        Returns the merge payloads for this document. Unions and removals of
+        one field go in separate writes since Firestore allows a single
+        transform per field; they never share values, so order is irrelevant.
+        """
+        main_write = dict(self.fields)
+        for field, values in self.array_unions.items():
+            main_write[field] = firestore.ArrayUnion(values)
+        writes = [main_write] if main_write else []
+        if self.array_removes:
+            writes.append(
+                {
+                    field: firestore.ArrayRemove(values)
+                    for field, values in self.array_removes.items()
+                }
+            )
+        return writes
+
+
+class WriteBehindQueue:
+    """
+    Buffers Firestore merge-updates, coalescing them per document, and
+    flushes them in batches every flush_interval seconds or as soon as
+    max_pending documents are waiting. Failed batches are merged back under
+    newer updates and retried with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_backoff: float = DEFAULT_BASE_BACKOFF,
+    ):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.pending: Dict[Tuple[str, str], PendingWrite] = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._retry_at = 0.0
+        self.stats = {
+            "enqueued": 0,
+            "flushes": 0,
+            "documents_written": 0,
+            "failed_flushes": 0,
+            "dropped_documents": 0,
+            "last_flush_latency_ms": 0.0,
+            "max_flush_latency_ms": 0.0,
+            "total_flush_latency_ms": 0.0,
+        }
+
+    def enqueue(self, collection_name: str, document_id: str, fields: Dict[str, Any]):
+        key = (collection_name, document_id)
+        pending = self.pending.get(key)
+        if pending is None:
+            pending = self.pending[key] = PendingWrite()
+        pending.add(fields)
+        self.stats["enqueued"] += 1
+        if len(self.pending) >= self.max_pending:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the flush loop and drains whatever is still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self.pending:
+            self._retry_at = 0.0
+            if not await self.flush():
+                attempts = max(p.attempts for p in self.pending.values()) if self.pending else 0
+                await asyncio.sleep(self.base_backoff * 2 ** max(attempts - 1, 0))
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if time.monotonic() < self._retry_at:
+                continue
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception(f"Write-behind flush loop error: {e}")
+
+    async def flush(self) -> bool:
+        """Writes every pending document. Returns False if the batch failed."""
+        async with self._flush_lock:
+            if not self.pending:
+                return True
+            batch_items = list(self.pending.items())
+            self.pending = {}
+
+            started = time.monotonic()
+            try:
+                client = db.get_async_client()
+                batch, batch_size = client.batch(), 0
+                for (collection_name, document_id), pending in batch_items:
+                    doc_ref = client.collection(collection_name).document(document_id)
+                    for payload in pending.to_writes():
+                        if batch_size == FIRESTORE_BATCH_LIMIT:
+                            await batch.commit()
+                            batch, batch_size = client.batch(), 0
+                        batch.set(doc_ref, payload, merge=True)
+                        batch_size += 1
+                if batch_size:
+                    await batch.commit()
+            except Exception as e:
+                self.stats["failed_flushes"] += 1
+                self._requeue(batch_items)
+                logger.warning(f"Write-behind flush of {len(batch_items)} documents failed: {e}")
+                return False
+
+            latency_ms = (time.monotonic() - started) * 1000
+            self.stats["flushes"] += 1
+            self.stats["documents_written"] += len(batch_items)
+            self.stats["last_flush_latency_ms"] = latency_ms
+            self.stats["max_flush_latency_ms"] = max(self.stats["max_flush_latency_ms"], latency_ms)
+            self.stats["total_flush_latency_ms"] += latency_ms
+            return True
+
+    def _requeue(self, batch_items: List[Tuple[Tuple[str, str], PendingWrite]]):
+        max_attempts = 0
+        for key, failed in batch_items:
+            failed.attempts += 1
+            if failed.attempts > self.max_retries:
+                self.stats["dropped_documents"] += 1
+                logger.error(f"Dropping write to {key[0]}/{key[1]} after {self.max_retries} retries")
+                continue
+            newer = self.pending.get(key)
+            if newer is not None:
+                failed.merge(newer)
+            self.pending[key] = failed
+            max_attempts = max(max_attempts, failed.attempts)
+        if max_attempts:
+            self._retry_at = time.monotonic() + self.base_backoff * 2 ** (max_attempts - 1)
+
+    def metrics(self) -> Dict[str, Any]:
+        flushes = self.stats["flushes"]
+        return {
+            **self.stats,
+            "queue_depth": len(self.pending),
+            "avg_flush_latency_ms": self.stats["total_flush_latency_ms"] / flushes if flushes else 0.0,
+        }
+
+
+write_behind_queue = WriteBehindQueue()